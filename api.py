@@ -2,11 +2,13 @@
 Inventory Management System - Backend API
 Complete FastAPI backend with all endpoints
 """
-from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 from typing import Optional, List, Dict, Any
 import json
 from datetime import datetime, timedelta
@@ -20,48 +22,68 @@ import csv
 import io
 
 # Import our services
+from services.alert_service import AlertService
+from services.batch_service import BatchService, BatchAllocationConflict
+from services.export_service import ExportService, PDF_REPORT_JOB_TYPE
+from services.import_service import ImportService, IMPORT_JOB_TYPE, UPLOAD_IMPORT_JOB_TYPE, STREAMABLE_FORMATS
 from services.inventory_service import InventoryService
+from services.job_service import JobService
+from services.label_service import LabelService, IMAGE_MEDIA_TYPES
+from services.price_service import PriceService
+from services.purchase_order_service import PurchaseOrderService, IdempotencyKeyConflict, MAX_PURCHASE_ORDER_PAGE
+from services.scheduler_service import SchedulerService
+from services.snapshot_service import SnapshotService, SNAPSHOT_JOB_TYPE
+from services.sourcing_service import SourcingService
+from services.upload_service import UploadOffsetMismatch, MAX_CHUNK_BYTES, UPLOAD_CHUNK_HINT_BYTES
 from services.user_service import UserService
 from utils.logging_config import setup_logging
 from database.setup import initialize_database
 from database.db_connection import DBConnection
 
-# Setup logging
-setup_logging()
-logging.info("Starting Inventory Management API")
+def initialize_app():
+    """Set up logging, create or migrate the database schema and make sure the admin user exists"""
+    # Setup logging
+    setup_logging()
+    logging.info("Starting Inventory Management API")
 
-# Initialize database
-initialize_database()
+    # Initialize database
+    initialize_database()
+
+    # Initialize default admin user with SHA-256 hashed password
+    try:
+        with DBConnection().get_cursor() as cursor:
+            cursor.execute("SELECT 1")
+            # Check if admin exists
+            cursor.execute("SELECT password FROM users WHERE username = 'admin'")
+            admin = cursor.fetchone()
+
+            if admin:
+                # Update existing admin password to SHA-256 if it's plaintext
+                if admin['password'] == '1234':
+                    hashed_password = hashlib.sha256('1234'.encode()).hexdigest()
+                    cursor.execute("UPDATE users SET password = ? WHERE username = 'admin'", (hashed_password,))
+                    logging.info("Updated admin password to SHA-256 hash")
+            else:
+                # Create new admin with hashed password
+                hashed_password = hashlib.sha256('1234'.encode()).hexdigest()
+                cursor.execute("""
+                    INSERT INTO users (username, password, role)
+                    VALUES ('admin', ?, 'admin')
+                """, (hashed_password,))
+                logging.info("Created admin user with SHA-256 hashed password")
+    except Exception as e:
+        logging.error(f"Database initialization error: {e}")
+        sys.exit(1)
+
+# Worker processes started with the 'spawn' method (PDF rendering, label QR codes) re-run
+# the main script as __mp_main__ when the API is launched with `python api.py`; they only
+# need services.*, so they skip the start-up work
+if __name__ != "__mp_main__":
+    initialize_app()
 
 # Access the database connection
 db_connection = DBConnection()
 
-# Initialize default admin user with SHA-256 hashed password
-try:
-    with db_connection.get_cursor() as cursor:
-        cursor.execute("SELECT 1")
-        # Check if admin exists
-        cursor.execute("SELECT password FROM users WHERE username = 'admin'")
-        admin = cursor.fetchone()
-
-        if admin:
-            # Update existing admin password to SHA-256 if it's plaintext
-            if admin['password'] == '1234':
-                hashed_password = hashlib.sha256('1234'.encode()).hexdigest()
-                cursor.execute("UPDATE users SET password = ? WHERE username = 'admin'", (hashed_password,))
-                logging.info("Updated admin password to SHA-256 hash")
-        else:
-            # Create new admin with hashed password
-            hashed_password = hashlib.sha256('1234'.encode()).hexdigest()
-            cursor.execute("""
-                INSERT INTO users (username, password, role)
-                VALUES ('admin', ?, 'admin')
-            """, (hashed_password,))
-            logging.info("Created admin user with SHA-256 hashed password")
-except Exception as e:
-    logging.error(f"Database initialization error: {e}")
-    sys.exit(1)
-
 # Security settings
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
@@ -91,7 +113,19 @@ app.add_middleware(
 
 # Initialize services
 inventory_service = InventoryService()
+alert_service = AlertService()
+batch_service = BatchService()
+export_service = ExportService()
+import_service = ImportService()
+label_service = LabelService()
+price_service = PriceService()
+purchase_order_service = PurchaseOrderService()
+snapshot_service = SnapshotService()
+sourcing_service = SourcingService()
 user_service = UserService()
+scheduler_service = SchedulerService()
+job_service = JobService()
+upload_service = import_service.uploads
 
 # ============================================================================
 # Pydantic Models
@@ -166,6 +200,8 @@ class LocationCreate(BaseModel):
     contact_email: Optional[str] = None
     is_active: Optional[bool] = True
     notes: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class LocationUpdate(BaseModel):
     name: Optional[str] = None
@@ -182,6 +218,8 @@ class LocationUpdate(BaseModel):
     contact_email: Optional[str] = None
     is_active: Optional[bool] = None
     notes: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class ItemLocationCreate(BaseModel):
     item_name: str
@@ -731,6 +769,33 @@ async def get_all_prices(current_user: User = Depends(get_current_user)):
         logging.error(f"Error fetching prices: {e}")
         raise HTTPException(status_code=500, detail="Error fetching prices")
 
+class BulkPriceEntry(BaseModel):
+    item_name: str
+    price: float
+    supplier: Optional[str] = "default"
+
+class BulkPriceUpdateRequest(BaseModel):
+    prices: List[BulkPriceEntry]
+
+@app.post("/prices/bulk-update")
+async def bulk_update_prices(
+    request: BulkPriceUpdateRequest,
+    current_user: User = Depends(get_editor_user)
+):
+    """Set many prices in one transaction, reporting rows that could not be applied"""
+    try:
+        result = price_service.set_prices_bulk(
+            [(entry.item_name, entry.supplier, entry.price) for entry in request.prices]
+        )
+        return {
+            "message": f"Updated {result['updated']} prices",
+            "updated": result['updated'],
+            "failed": result['failed']
+        }
+    except Exception as e:
+        logging.error(f"Error in bulk price update: {e}")
+        raise HTTPException(status_code=500, detail="Error performing bulk price update")
+
 @app.get("/prices/{item_name}")
 async def get_item_price(item_name: str, current_user: User = Depends(get_current_user)):
     """Get price for specific item"""
@@ -764,29 +829,10 @@ async def update_price(
 ):
     """Update item price"""
     try:
-        with db_connection.get_cursor() as cursor:
-            # Check if item exists
-            cursor.execute("SELECT 1 FROM items WHERE item_name = ?", (item_name,))
-            if not cursor.fetchone():
-                raise HTTPException(status_code=404, detail="Item not found")
-
-            # Insert or update price
-            cursor.execute("SELECT 1 FROM prices WHERE item_name = ? AND supplier = ?", (item_name, price_update.supplier))
-            if cursor.fetchone():
-                # Update existing
-                cursor.execute("""
-                    UPDATE prices
-                    SET price = ?, date_updated = datetime('now'), is_unit_price = 1
-                    WHERE item_name = ? AND supplier = ?
-                """, (price_update.price, item_name, price_update.supplier))
-            else:
-                # Insert new
-                cursor.execute("""
-                    INSERT INTO prices (item_name, price, supplier, date_updated, is_unit_price)
-                    VALUES (?, ?, ?, datetime('now'), 1)
-                """, (item_name, price_update.price, price_update.supplier))
-
-            return {"message": "Price updated successfully"}
+        success = price_service.set_price(item_name, price_update.price, price_update.supplier)
+        if not success:
+            raise HTTPException(status_code=404, detail="Item not found")
+        return {"message": "Price updated successfully"}
     except HTTPException:
         raise
     except Exception as e:
@@ -836,29 +882,81 @@ async def get_cheapest_price(item_name: str, current_user: User = Depends(get_cu
         raise HTTPException(status_code=500, detail="Error fetching cheapest price")
 
 @app.get("/prices/{item_name}/history")
-async def get_price_history(item_name: str, current_user: User = Depends(get_current_user)):
-    """Get price history for a specific item"""
+async def get_price_history(
+    item_name: str,
+    supplier: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: int = 100,
+    current_user: User = Depends(get_current_user)
+):
+    """Get price history for a specific item, downsampled to fit max_points"""
     try:
-        with db_connection.get_cursor() as cursor:
-            cursor.execute("""
-                SELECT price, supplier, timestamp
-                FROM price_history
-                WHERE item_name = ?
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """, (item_name,))
-            history = []
-            for row in cursor.fetchall():
-                history.append({
-                    "price": row['price'],
-                    "supplier": row['supplier'],
-                    "date": row['timestamp']
-                })
-            return {"history": history, "item_name": item_name}
+        entries = price_service.get_price_history(
+            item_name, supplier, start=start, end=end, max_points=min(max(max_points, 1), 5000)
+        )
+        history = []
+        for entry in entries:
+            history.append({**entry, "date": entry['timestamp']})
+        return {
+            "history": history,
+            "item_name": item_name,
+            "resolution": history[0]['resolution'] if history else "raw"
+        }
     except Exception as e:
         logging.error(f"Error fetching price history: {e}")
         raise HTTPException(status_code=500, detail="Error fetching price history")
 
+@app.get("/prices/{item_name}/as-of")
+async def get_price_as_of(
+    item_name: str,
+    at: datetime,
+    supplier: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the price that was in effect for an item at a point in time"""
+    try:
+        entry = price_service.get_price_as_of(item_name, at, supplier)
+        if not entry:
+            raise HTTPException(status_code=404, detail="No price in effect at that time")
+        return entry
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching price as of {at}: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching historical price")
+
+class PriceAsOfRequest(BaseModel):
+    as_of: datetime
+    item_names: Optional[List[str]] = None
+    supplier: Optional[str] = None
+
+@app.post("/prices/as-of/batch")
+async def get_prices_as_of(
+    request: PriceAsOfRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the prices in effect at a point in time for many items (all items if none given)"""
+    try:
+        prices = price_service.get_prices_as_of(request.as_of, request.item_names, request.supplier)
+        return {"as_of": request.as_of.isoformat(), "prices": prices, "count": len(prices)}
+    except Exception as e:
+        logging.error(f"Error fetching prices as of {request.as_of}: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching historical prices")
+
+@app.post("/prices/history/compact")
+async def compact_price_history(
+    raw_retention_days: int = 30,
+    current_user: User = Depends(get_admin_user)
+):
+    """Fold raw price history older than the retention window into daily aggregates (admin only)"""
+    try:
+        result = price_service.compact_price_history(raw_retention_days)
+        return {"message": "Price history compacted", **result}
+    except Exception as e:
+        logging.error(f"Error compacting price history: {e}")
+        raise HTTPException(status_code=500, detail="Error compacting price history")
+
 @app.post("/prices/{item_name}")
 async def add_price(
     item_name: str,
@@ -875,13 +973,18 @@ async def compare_all_prices(current_user: User = Depends(get_current_user)):
         with db_connection.get_cursor() as cursor:
             cursor.execute("""
                 SELECT
-                    item_name,
-                    supplier,
-                    price,
-                    date_updated,
-                    RANK() OVER (PARTITION BY item_name ORDER BY price ASC) as price_rank
-                FROM prices
-                ORDER BY item_name, price ASC
+                    p.item_name,
+                    p.supplier,
+                    p.price,
+                    p.date_updated,
+                    s.min_price,
+                    s.max_price,
+                    s.avg_price,
+                    s.price_count,
+                    s.cheapest_supplier
+                FROM prices p
+                JOIN price_summary s ON s.item_name = p.item_name
+                ORDER BY p.item_name, p.price ASC
             """)
             comparison = {}
             for row in cursor.fetchall():
@@ -890,6 +993,8 @@ async def compare_all_prices(current_user: User = Depends(get_current_user)):
                     comparison[item] = {
                         'cheapest': None,
                         'most_expensive': None,
+                        'average_price': row['avg_price'],
+                        'supplier_count': row['price_count'],
                         'suppliers': []
                     }
 
@@ -897,13 +1002,13 @@ async def compare_all_prices(current_user: User = Depends(get_current_user)):
                     'supplier': row['supplier'],
                     'price': row['price'],
                     'date_updated': row['date_updated'],
-                    'is_cheapest': row['price_rank'] == 1
+                    'is_cheapest': row['price'] == row['min_price']
                 }
                 comparison[item]['suppliers'].append(supplier_data)
 
-                if comparison[item]['cheapest'] is None or row['price'] < comparison[item]['cheapest']['price']:
+                if row['supplier'] == row['cheapest_supplier']:
                     comparison[item]['cheapest'] = supplier_data
-                if comparison[item]['most_expensive'] is None or row['price'] > comparison[item]['most_expensive']['price']:
+                if comparison[item]['most_expensive'] is None and row['price'] == row['max_price']:
                     comparison[item]['most_expensive'] = supplier_data
 
             return {"comparison": comparison}
@@ -929,6 +1034,8 @@ class SupplierCreate(BaseModel):
     notes: Optional[str] = None
     rating: Optional[int] = None
     is_active: Optional[bool] = True
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class SupplierUpdate(BaseModel):
     name: Optional[str] = None
@@ -944,6 +1051,8 @@ class SupplierUpdate(BaseModel):
     notes: Optional[str] = None
     rating: Optional[int] = None
     is_active: Optional[bool] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 @app.get("/suppliers")
 async def get_all_suppliers(
@@ -1031,20 +1140,22 @@ async def create_supplier(
             cursor.execute("""
                 INSERT INTO suppliers (
                     name, contact_person, email, phone, address, city, state,
-                    zip_code, country, website, notes, rating, is_active
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    zip_code, country, website, notes, rating, is_active,
+                    latitude, longitude
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 supplier.name, supplier.contact_person, supplier.email, supplier.phone,
                 supplier.address, supplier.city, supplier.state, supplier.zip_code,
                 supplier.country, supplier.website, supplier.notes, supplier.rating,
-                1 if supplier.is_active else 0
+                1 if supplier.is_active else 0, supplier.latitude, supplier.longitude
             ))
             supplier_id = cursor.lastrowid
-            return {
-                "message": "Supplier created successfully",
-                "id": supplier_id,
-                "name": supplier.name
-            }
+        sourcing_service.invalidate_supplier_grid()
+        return {
+            "message": "Supplier created successfully",
+            "id": supplier_id,
+            "name": supplier.name
+        }
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Supplier with this name already exists")
     except Exception as e:
@@ -1108,6 +1219,12 @@ async def update_supplier(
             if supplier_update.is_active is not None:
                 updates.append("is_active = ?")
                 params.append(1 if supplier_update.is_active else 0)
+            if supplier_update.latitude is not None:
+                updates.append("latitude = ?")
+                params.append(supplier_update.latitude)
+            if supplier_update.longitude is not None:
+                updates.append("longitude = ?")
+                params.append(supplier_update.longitude)
 
             if not updates:
                 return {"message": "No updates provided"}
@@ -1118,7 +1235,8 @@ async def update_supplier(
             query = f"UPDATE suppliers SET {', '.join(updates)} WHERE id = ?"
             cursor.execute(query, params)
 
-            return {"message": "Supplier updated successfully"}
+        sourcing_service.invalidate_supplier_grid()
+        return {"message": "Supplier updated successfully"}
     except HTTPException:
         raise
     except sqlite3.IntegrityError:
@@ -1133,9 +1251,10 @@ async def delete_supplier(supplier_id: int, current_user: User = Depends(get_adm
     try:
         with db_connection.get_cursor() as cursor:
             cursor.execute("DELETE FROM suppliers WHERE id = ?", (supplier_id,))
-            if cursor.rowcount > 0:
-                return {"message": "Supplier deleted successfully"}
-            raise HTTPException(status_code=404, detail="Supplier not found")
+            if cursor.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Supplier not found")
+        sourcing_service.invalidate_supplier_grid()
+        return {"message": "Supplier deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
@@ -1401,6 +1520,32 @@ async def get_best_price(item_name: str, location_id: Optional[int] = None, curr
         logging.error(f"Error finding best price: {e}")
         raise HTTPException(status_code=500, detail="Error finding best price")
 
+class BasketLine(BaseModel):
+    item_name: str
+    quantity: int
+    location_id: Optional[int] = None
+
+class BasketRequest(BaseModel):
+    lines: List[BasketLine]
+
+@app.post("/best-price/basket")
+async def optimize_basket(request: BasketRequest, current_user: User = Depends(get_current_user)):
+    """Choose suppliers for a whole basket, minimizing landed cost with MOQs, shipping and order minimums"""
+    try:
+        if not request.lines:
+            raise HTTPException(status_code=400, detail="Basket is empty")
+        if any(line.quantity <= 0 for line in request.lines):
+            raise HTTPException(status_code=400, detail="Quantities must be positive")
+
+        return sourcing_service.optimize_basket(
+            [(line.item_name, line.quantity, line.location_id) for line in request.lines]
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error optimizing basket: {e}")
+        raise HTTPException(status_code=500, detail="Error optimizing basket")
+
 # ============================================================================
 # SUPPLIER-LOCATION RELATIONSHIPS
 # ============================================================================
@@ -1500,6 +1645,19 @@ async def create_supplier_location(sl: SupplierLocation, current_user: User = De
         logging.error(f"Error creating supplier-location: {e}")
         raise HTTPException(status_code=500, detail="Error creating supplier-location relationship")
 
+@app.post("/supplier-locations/refresh-distances")
+async def refresh_supplier_distances(
+    create_missing: bool = False,
+    current_user: User = Depends(get_admin_or_editor)
+):
+    """Recompute distance_km for supplier-location relationships from supplier and location coordinates"""
+    try:
+        result = sourcing_service.refresh_supplier_distances(create_missing=create_missing)
+        return {"message": "Supplier distances refreshed", **result}
+    except Exception as e:
+        logging.error(f"Error refreshing supplier distances: {e}")
+        raise HTTPException(status_code=500, detail="Error refreshing supplier distances")
+
 @app.put("/supplier-locations/{id}")
 async def update_supplier_location(id: int, sl: SupplierLocation, current_user: User = Depends(get_admin_or_editor)):
     """Update supplier-location relationship"""
@@ -1618,14 +1776,15 @@ async def create_location(
                 INSERT INTO locations (
                     name, address, city, state, zip_code, country,
                     location_type, capacity, current_utilization, manager_name,
-                    contact_phone, contact_email, is_active, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    contact_phone, contact_email, is_active, notes, latitude, longitude
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 location.name, location.address, location.city, location.state,
                 location.zip_code, location.country, location.location_type,
                 location.capacity, location.current_utilization, location.manager_name,
                 location.contact_phone, location.contact_email,
-                1 if location.is_active else 0, location.notes
+                1 if location.is_active else 0, location.notes,
+                location.latitude, location.longitude
             ))
             location_id = cursor.lastrowid
             return {"message": "Location created successfully", "id": location_id}
@@ -1653,7 +1812,7 @@ async def update_location(
 
             for field in ['name', 'address', 'city', 'state', 'zip_code', 'country',
                          'location_type', 'capacity', 'current_utilization', 'manager_name',
-                         'contact_phone', 'contact_email', 'notes']:
+                         'contact_phone', 'contact_email', 'notes', 'latitude', 'longitude']:
                 value = getattr(location_update, field, None)
                 if value is not None:
                     updates.append(f"{field} = ?")
@@ -1692,6 +1851,33 @@ async def delete_location(location_id: int, current_user: User = Depends(get_adm
         logging.error(f"Error deleting location: {e}")
         raise HTTPException(status_code=500, detail="Error deleting location")
 
+@app.get("/locations/{location_id}/nearest-suppliers")
+async def get_nearest_suppliers(
+    location_id: int,
+    item_name: Optional[str] = None,
+    limit: int = 5,
+    current_user: User = Depends(get_current_user)
+):
+    """Find the active suppliers closest to a location by great-circle distance"""
+    try:
+        if limit < 1 or limit > 100:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+        suppliers = sourcing_service.nearest_suppliers(location_id, item_name=item_name, limit=limit)
+        if suppliers is None:
+            raise HTTPException(status_code=404, detail="Location not found")
+        return {
+            "location_id": location_id,
+            "item_name": item_name,
+            "suppliers": suppliers
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error finding nearest suppliers: {e}")
+        raise HTTPException(status_code=500, detail="Error finding nearest suppliers")
+
 @app.get("/locations/{location_id}/items")
 async def get_location_items(location_id: int, current_user: User = Depends(get_current_user)):
     """Get all items in a specific location"""
@@ -1914,6 +2100,15 @@ async def create_batch(
         logging.error(f"Error creating batch: {e}")
         raise HTTPException(status_code=500, detail="Error creating batch")
 
+@app.post("/batches/expiry-sweep")
+async def run_expiry_sweep(current_user: User = Depends(get_admin_or_editor)):
+    """Raise expiry alerts and mark expired batches for everything that changed since the last sweep"""
+    try:
+        return batch_service.sweep_expiries()
+    except Exception as e:
+        logging.error(f"Error running expiry sweep: {e}")
+        raise HTTPException(status_code=500, detail="Error running expiry sweep")
+
 @app.put("/batches/{batch_id}")
 async def update_batch(
     batch_id: int,
@@ -2012,6 +2207,26 @@ async def get_item_batches(
         logging.error(f"Error fetching item batches: {e}")
         raise HTTPException(status_code=500, detail="Error fetching item batches")
 
+@app.get("/items/{item_name}/batches/allocation")
+async def get_batch_allocation_plan(
+    item_name: str,
+    quantity: int,
+    location_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Preview which batches a pick of `quantity` would draw from, first-expired-first-out"""
+    try:
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        return batch_service.allocate_fefo(
+            item_name, quantity, location_id=location_id, allow_partial=True, dry_run=True
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error planning batch allocation: {e}")
+        raise HTTPException(status_code=500, detail="Error planning batch allocation")
+
 # ============================================================================
 # STOCK ADJUSTMENTS ENDPOINTS
 # ============================================================================
@@ -2080,18 +2295,34 @@ async def create_stock_adjustment(
     """Create stock adjustment and update inventory"""
     try:
         with db_connection.get_cursor() as cursor:
-            # Insert adjustment record
-            cursor.execute("""
+            # Decreases without an explicit batch draw down the item's batches first-expired-first-out;
+            # whatever the batches cannot cover is recorded without a batch
+            batch_quantities = [(adjustment.batch_id, adjustment.location_id, adjustment.quantity)]
+            allocation = None
+            if adjustment.adjustment_type == "decrease" and not adjustment.batch_id:
+                allocation = batch_service.allocate_fefo_in(
+                    cursor, adjustment.item_name, adjustment.quantity,
+                    location_id=adjustment.location_id, allow_partial=True
+                )
+                batch_quantities = [
+                    (a['batch_id'], adjustment.location_id or a['location_id'], a['quantity'])
+                    for a in allocation['allocations']
+                ]
+                if allocation['unallocated']:
+                    batch_quantities.append((None, adjustment.location_id, allocation['unallocated']))
+
+            # Insert adjustment records, one per batch drawn from
+            cursor.executemany("""
                 INSERT INTO stock_adjustments (
                     item_name, location_id, batch_id, adjustment_type, quantity,
                     reason, reason_notes, adjusted_by, approved_by, reference_number
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                adjustment.item_name, adjustment.location_id, adjustment.batch_id,
-                adjustment.adjustment_type, adjustment.quantity, adjustment.reason,
+            """, [(
+                adjustment.item_name, location_id, batch_id,
+                adjustment.adjustment_type, quantity, adjustment.reason,
                 adjustment.reason_notes, adjustment.adjusted_by, adjustment.approved_by,
                 adjustment.reference_number
-            ))
+            ) for batch_id, location_id, quantity in batch_quantities])
 
             # Update item quantity in main items table
             if adjustment.adjustment_type == "increase":
@@ -2117,6 +2348,21 @@ async def create_stock_adjustment(
                         SET quantity = quantity - ?, updated_at = datetime('now')
                         WHERE item_name = ? AND location_id = ?
                     """, (adjustment.quantity, adjustment.item_name, adjustment.location_id))
+            elif allocation:
+                # A decrease without a location drew batches wherever they were, so take the
+                # stock off each of those batches' locations too
+                location_quantities: Dict[int, int] = {}
+                for batch_allocation in allocation['allocations']:
+                    if batch_allocation['location_id'] is not None:
+                        location_quantities[batch_allocation['location_id']] = (
+                            location_quantities.get(batch_allocation['location_id'], 0) + batch_allocation['quantity']
+                        )
+                cursor.executemany("""
+                    UPDATE item_locations
+                    SET quantity = MAX(quantity - ?, 0), updated_at = datetime('now')
+                    WHERE item_name = ? AND location_id = ?
+                """, [(quantity, adjustment.item_name, location_id)
+                      for location_id, quantity in location_quantities.items()])
 
             # Update batch quantity if specified
             if adjustment.batch_id:
@@ -2133,7 +2379,12 @@ async def create_stock_adjustment(
                         WHERE id = ?
                     """, (adjustment.quantity, adjustment.batch_id))
 
-            return {"message": "Stock adjustment created successfully"}
+            return {
+                "message": "Stock adjustment created successfully",
+                "batch_allocations": allocation['allocations'] if allocation else []
+            }
+    except BatchAllocationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logging.error(f"Error creating stock adjustment: {e}")
         raise HTTPException(status_code=500, detail="Error creating stock adjustment")
@@ -2146,60 +2397,36 @@ async def create_stock_adjustment(
 async def get_alerts(
     unread_only: bool = False,
     alert_type: Optional[str] = None,
+    resolved: Optional[bool] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Get alerts/notifications"""
+    """Get alerts/notifications, one page at a time (pass next_cursor back as cursor)"""
     try:
-        with db_connection.get_cursor() as cursor:
-            conditions = []
-            params = []
-
-            if unread_only:
-                conditions.append("is_read = 0")
-
-            if alert_type:
-                conditions.append("alert_type = ?")
-                params.append(alert_type)
-
-            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-
-            query = f"""
-                SELECT * FROM alerts
-                {where_clause}
-                ORDER BY
-                    CASE severity
-                        WHEN 'critical' THEN 1
-                        WHEN 'high' THEN 2
-                        WHEN 'medium' THEN 3
-                        WHEN 'low' THEN 4
-                    END,
-                    created_at DESC
-            """
-
-            cursor.execute(query, params)
-
-            alerts = []
-            for row in cursor.fetchall():
-                alerts.append({
-                    "id": row['id'],
-                    "alert_type": row['alert_type'],
-                    "severity": row['severity'],
-                    "item_name": row['item_name'],
-                    "location_id": row['location_id'],
-                    "batch_id": row['batch_id'],
-                    "message": row['message'],
-                    "is_read": bool(row['is_read']),
-                    "is_resolved": bool(row['is_resolved']),
-                    "resolved_by": row['resolved_by'],
-                    "resolved_at": row['resolved_at'],
-                    "created_at": row['created_at']
-                })
-
-            return {"alerts": alerts, "total": len(alerts)}
+        if limit < 1 or limit > 500:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+        return alert_service.list_alerts(
+            limit=limit, cursor=cursor, unread_only=unread_only,
+            alert_type=alert_type, resolved=resolved
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error fetching alerts: {e}")
         raise HTTPException(status_code=500, detail="Error fetching alerts")
 
+@app.get("/alerts/summary")
+async def get_alerts_summary(current_user: User = Depends(get_current_user)):
+    """Unread and open alert counts by severity for the notification badge"""
+    try:
+        return alert_service.get_summary()
+    except Exception as e:
+        logging.error(f"Error fetching alert summary: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching alert summary")
+
 @app.put("/alerts/{alert_id}")
 async def update_alert(
     alert_id: int,
@@ -2238,38 +2465,14 @@ async def update_alert(
         raise HTTPException(status_code=500, detail="Error updating alert")
 
 @app.post("/alerts/check-reorder-levels")
-async def check_reorder_levels(current_user: User = Depends(get_current_user)):
-    """Check all items and create alerts for low stock"""
+async def check_reorder_levels(
+    incremental: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Create reorder alerts for low stock; incremental only checks items changed since the last check"""
     try:
-        with db_connection.get_cursor() as cursor:
-            # Find items below reorder level
-            cursor.execute("""
-                SELECT item_name, quantity, reorder_level, reorder_quantity
-                FROM items
-                WHERE quantity <= reorder_level AND reorder_level IS NOT NULL
-            """)
-
-            alerts_created = 0
-            for row in cursor.fetchall():
-                # Check if alert already exists and is unresolved
-                cursor.execute("""
-                    SELECT id FROM alerts
-                    WHERE item_name = ? AND alert_type = 'reorder' AND is_resolved = 0
-                """, (row['item_name'],))
-
-                if not cursor.fetchone():
-                    severity = 'critical' if row['quantity'] == 0 else 'high' if row['quantity'] < row['reorder_level'] / 2 else 'medium'
-                    cursor.execute("""
-                        INSERT INTO alerts (alert_type, severity, item_name, message)
-                        VALUES ('reorder', ?, ?, ?)
-                    """, (
-                        severity,
-                        row['item_name'],
-                        f"Item {row['item_name']} is at {row['quantity']} units (reorder level: {row['reorder_level']})"
-                    ))
-                    alerts_created += 1
-
-            return {"message": f"Created {alerts_created} reorder alerts"}
+        result = alert_service.check_reorder_levels(incremental=incremental)
+        return {"message": f"Created {result['alerts_created']} reorder alerts", **result}
     except Exception as e:
         logging.error(f"Error checking reorder levels: {e}")
         raise HTTPException(status_code=500, detail="Error checking reorder levels")
@@ -2343,431 +2546,361 @@ async def import_inventory_csv(
     file: UploadFile = File(...),
     current_user: User = Depends(get_admin_or_editor)
 ):
-    """Import inventory items from CSV file"""
+    """Import inventory items from CSV file, streamed and merged in chunks"""
     try:
-        # Read file content
-        content = await file.read()
-        decoded_content = content.decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(decoded_content))
-
-        imported = []
-        updated = []
-        failed = []
-
-        with db_connection.get_cursor() as cursor:
-            for row in csv_reader:
-                try:
-                    item_name = row.get('name') or row.get('item_name')
-                    if not item_name:
-                        failed.append({"row": row, "reason": "Missing item name"})
-                        continue
-
-                    quantity = int(row.get('quantity', 0))
-                    group_name = row.get('group') or row.get('group_name')
-                    reorder_level = int(row.get('reorder_level', 10)) if row.get('reorder_level') else 10
-                    reorder_quantity = int(row.get('reorder_quantity', 50)) if row.get('reorder_quantity') else 50
-
-                    # Check if item exists
-                    cursor.execute("SELECT 1 FROM items WHERE item_name = ?", (item_name,))
-                    exists = cursor.fetchone()
-
-                    if exists:
-                        # Update existing item
-                        cursor.execute("""
-                            UPDATE items
-                            SET quantity = ?, group_name = ?, reorder_level = ?, reorder_quantity = ?
-                            WHERE item_name = ?
-                        """, (quantity, group_name, reorder_level, reorder_quantity, item_name))
-                        updated.append(item_name)
-                    else:
-                        # Create group if it doesn't exist
-                        if group_name:
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO groups (group_name) VALUES (?)
-                            """, (group_name,))
-
-                        # Insert new item
-                        cursor.execute("""
-                            INSERT INTO items (item_name, quantity, group_name, reorder_level, reorder_quantity)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (item_name, quantity, group_name, reorder_level, reorder_quantity))
-                        imported.append(item_name)
-
-                    # Add to history
-                    cursor.execute("""
-                        INSERT INTO history (action, item_name, quantity, group_name, user_name)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, ("csv_import", item_name, quantity, group_name, current_user.username))
-
-                except Exception as e:
-                    failed.append({"row": row, "reason": str(e)})
-
-        return {
-            "message": f"Import complete: {len(imported)} new, {len(updated)} updated",
-            "imported": imported,
-            "updated": updated,
-            "failed": failed
-        }
+        # Parsed straight from the spooled upload in a worker thread, which gets its own
+        # connection; each chunk of rows is committed as it is merged
+        return await run_in_threadpool(import_service.import_file, file.file, "csv", current_user.username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error importing CSV: {e}")
         raise HTTPException(status_code=500, detail=f"Error importing CSV: {str(e)}")
 
-@app.post("/import/excel")
-async def import_inventory_excel(
+@app.post("/import/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_import_job(
     file: UploadFile = File(...),
     current_user: User = Depends(get_admin_or_editor)
 ):
-    """Import inventory items from Excel file"""
+    """Queue an inventory import as a background job; poll /jobs/{job_id} for progress"""
     try:
-        from openpyxl import load_workbook
-        from io import BytesIO
-
-        # Read file content
-        content = await file.read()
-        workbook = load_workbook(BytesIO(content))
-        sheet = workbook.active
-
-        imported = []
-        updated = []
-        failed = []
-
-        # Get headers from first row
-        headers = [cell.value for cell in sheet[1]]
-
-        with db_connection.get_cursor() as cursor:
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                try:
-                    # Create dict from row
-                    row_dict = dict(zip(headers, row))
-
-                    item_name = row_dict.get('Item Name') or row_dict.get('item_name')
-                    if not item_name:
-                        failed.append({"row": row_idx, "reason": "Missing item name"})
-                        continue
-
-                    quantity = int(row_dict.get('Quantity', 0))
-                    group_name = row_dict.get('Group') or row_dict.get('group_name')
-                    reorder_level = int(row_dict.get('Reorder Level', 10)) if row_dict.get('Reorder Level') else 10
-                    unit = row_dict.get('Unit', 'units')
-                    location = row_dict.get('Location', '')
-                    description = row_dict.get('Description', '')
-
-                    # Check if item exists
-                    cursor.execute("SELECT 1 FROM items WHERE item_name = ?", (item_name,))
-                    exists = cursor.fetchone()
-
-                    if exists:
-                        # Update existing
-                        cursor.execute(
-                            """UPDATE items SET quantity = ?, group_name = ?, reorder_point = ?,
-                               unit = ?, location = ?, description = ?, updated_at = ?
-                               WHERE item_name = ?""",
-                            (quantity, group_name, reorder_level, unit, location, description,
-                             datetime.now().isoformat(), item_name)
-                        )
-                        updated.append(item_name)
-                    else:
-                        # Insert new
-                        cursor.execute(
-                            """INSERT INTO items
-                               (item_name, quantity, group_name, reorder_point, unit, location, description, created_at, updated_at)
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                            (item_name, quantity, group_name, reorder_level, unit, location, description,
-                             datetime.now().isoformat(), datetime.now().isoformat())
-                        )
-                        imported.append(item_name)
-
-                        # Log to history
-                        cursor.execute(
-                            """INSERT INTO history (action, item_name, quantity, group_name, user, timestamp)
-                               VALUES (?, ?, ?, ?, ?, ?)""",
-                            ('added', item_name, quantity, group_name, current_user.username, datetime.now().isoformat())
-                        )
-
-                except Exception as row_error:
-                    failed.append({"row": row_idx, "reason": str(row_error)})
-                    continue
-
-        logging.info(f"Excel import completed: {len(imported)} imported, {len(updated)} updated, {len(failed)} failed")
-
+        file_format = os.path.splitext(file.filename or "")[1].lstrip(".").lower()
+        job = await run_in_threadpool(
+            import_service.submit_import_job, job_service, file.file, file_format, current_user.username
+        )
+        return {**job, "status_url": f"/jobs/{job['id']}"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error queueing import job: {e}")
+        raise HTTPException(status_code=500, detail="Error queueing import job")
+
+class UploadCreate(BaseModel):
+    file_name: str
+    total_size: Optional[int] = None
+    sha256: Optional[str] = None
+    parse_early: bool = True
+
+class UploadFinalize(BaseModel):
+    sha256: Optional[str] = None
+
+def _get_visible_upload(upload_id: str, current_user: User) -> Dict[str, Any]:
+    """Load an upload, hiding other users' uploads from non-admins"""
+    upload = upload_service.get_upload(upload_id)
+    if not upload or (current_user.role != "admin" and upload["user_name"] != current_user.username):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+@app.post("/import/uploads", status_code=status.HTTP_201_CREATED)
+async def create_import_upload(upload: UploadCreate, current_user: User = Depends(get_admin_or_editor)):
+    """
+    Start a resumable chunked upload of an import file.
+    With parse_early the import job starts now and parses chunks as they arrive.
+    """
+    try:
+        created = upload_service.create_upload(
+            upload.file_name, current_user.username, upload.total_size, upload.sha256
+        )
+        job = None
+        if upload.parse_early and created["file_format"] in STREAMABLE_FORMATS:
+            job = import_service.submit_upload_import(job_service, created["id"], current_user.username)
         return {
-            "status": "success",
-            "imported": len(imported),
-            "updated": len(updated),
-            "failed": len(failed),
-            "failed_items": failed[:10] if failed else []  # Return first 10 failures
+            **upload_service.get_upload(created["id"]),
+            "job": job,
+            "chunk_size_hint": UPLOAD_CHUNK_HINT_BYTES,
+            "max_chunk_bytes": MAX_CHUNK_BYTES
         }
-
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logging.error(f"Error importing Excel: {e}")
-        raise HTTPException(status_code=500, detail=f"Error importing Excel: {str(e)}")
+        logging.error(f"Error creating upload: {e}")
+        raise HTTPException(status_code=500, detail="Error creating upload")
 
-@app.get("/export/csv")
-async def export_inventory_csv(
-    groups: Optional[str] = None,
-    current_user: User = Depends(get_admin_user)
+@app.get("/import/uploads/{upload_id}")
+async def get_import_upload(upload_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Upload state; received_bytes is the offset to resume from"""
+    try:
+        return _get_visible_upload(upload_id, current_user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching upload: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching upload")
+
+@app.put("/import/uploads/{upload_id}")
+async def put_import_upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    chunk_sha256: Optional[str] = None,
+    current_user: User = Depends(get_admin_or_editor)
 ):
-    """Export inventory to CSV file (admin only)"""
+    """Write a chunk (raw request body) at the given offset, which must equal received_bytes"""
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"inventory_export_{timestamp}.csv"
-        group_list = groups.split(',') if groups else None
-
-        success = inventory_service.export_to_csv(filename, group_list)
-        if success:
-            return FileResponse(
-                filename,
-                media_type='text/csv',
-                filename=filename
-            )
-        raise HTTPException(status_code=500, detail="Failed to export data")
+        _get_visible_upload(upload_id, current_user)
+        if int(request.headers.get("content-length") or 0) > MAX_CHUNK_BYTES:
+            raise HTTPException(status_code=413, detail=f"Chunk larger than {MAX_CHUNK_BYTES} bytes")
+        data = await request.body()
+        return await run_in_threadpool(upload_service.write_chunk, upload_id, offset, data, chunk_sha256)
+    except HTTPException:
+        raise
+    except UploadOffsetMismatch as e:
+        return JSONResponse(status_code=409, content={"detail": str(e), "received_bytes": e.expected})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logging.error(f"Error exporting CSV: {e}")
-        raise HTTPException(status_code=500, detail="Error exporting data")
+        logging.error(f"Error writing upload chunk: {e}")
+        raise HTTPException(status_code=500, detail="Error writing upload chunk")
 
-@app.get("/export/excel")
-async def export_inventory_excel(
-    groups: Optional[str] = None,
-    current_user: User = Depends(get_admin_user)
+@app.post("/import/uploads/{upload_id}/finalize")
+async def finalize_import_upload(
+    upload_id: str,
+    finalize: UploadFinalize,
+    current_user: User = Depends(get_admin_or_editor)
 ):
-    """Export inventory to Excel file (admin only)"""
+    """Verify the upload's SHA-256 and complete it, queueing the import if it has not started"""
+    try:
+        _get_visible_upload(upload_id, current_user)
+        upload = await run_in_threadpool(upload_service.finalize, upload_id, finalize.sha256)
+        if upload["job_id"]:
+            job = job_service.get_job(upload["job_id"])
+        else:
+            job = import_service.submit_upload_import(job_service, upload_id, current_user.username)
+        return {**upload_service.get_upload(upload_id), "job": job}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error finalizing upload: {e}")
+        raise HTTPException(status_code=500, detail="Error finalizing upload")
+
+@app.delete("/import/uploads/{upload_id}")
+async def abort_import_upload(upload_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Abort an unfinished upload, cancelling its import job"""
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
+        upload = _get_visible_upload(upload_id, current_user)
+        if upload["status"] != "uploading":
+            raise HTTPException(status_code=409, detail=f"Upload is {upload['status']}")
+        if upload["job_id"]:
+            try:
+                job_service.cancel(upload["job_id"])
+            except ValueError:
+                pass
+        return upload_service.abort(upload_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error aborting upload: {e}")
+        raise HTTPException(status_code=500, detail="Error aborting upload")
 
+@app.post("/import/excel")
+async def import_inventory_excel(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_admin_or_editor)
+):
+    """Import inventory items from an .xlsx file, streamed row by row and merged in chunks"""
+    try:
+        # openpyxl reads the spooled upload in read-only mode; rows go through the same
+        # staging and bulk upsert pipeline as CSV imports
+        return await run_in_threadpool(import_service.import_file, file.file, "xlsx", current_user.username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error importing Excel: {e}")
+        raise HTTPException(status_code=500, detail=f"Error importing Excel: {str(e)}")
+
+@app.get("/export/csv")
+async def export_inventory_csv(
+    groups: Optional[str] = None,
+    gzip: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    """Export inventory to CSV, streamed from the database (admin only); gzip=true compresses it"""
+    try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"inventory_export_{timestamp}.xlsx"
+        filename = f"inventory_export_{timestamp}.csv" + (".gz" if gzip else "")
         group_list = groups.split(',') if groups else None
+        media_type = "application/gzip" if gzip else "text/csv"
 
-        # Get inventory data
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        # Unchanged items since the last export: send the cached file
+        cached = await run_in_threadpool(export_service.cache.get, "csv.gz" if gzip else "csv", group_list)
+        if cached:
+            return FileResponse(cached, media_type=media_type, filename=filename)
 
-        if group_list:
-            placeholders = ','.join('?' * len(group_list))
-            query = f"SELECT * FROM items WHERE group_name IN ({placeholders})"
-            cursor.execute(query, group_list)
-        else:
-            cursor.execute("SELECT * FROM items")
+        return StreamingResponse(
+            export_service.iter_inventory_csv_cached(group_list, compress=gzip),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    except Exception as e:
+        logging.error(f"Error exporting CSV: {e}")
+        raise HTTPException(status_code=500, detail="Error exporting data")
 
-        items = cursor.fetchall()
+@app.get("/export/excel")
+async def export_inventory_excel(
+    groups: Optional[str] = None,
+    current_user: User = Depends(get_admin_user)
+):
+    """Export inventory to Excel file (admin only)"""
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"inventory_export_{timestamp}.xlsx"
+        group_list = groups.split(',') if groups else None
 
-        # Create workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Inventory"
-
-        # Header style
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF")
-
-        # Add headers
-        headers = ["Item Name", "Quantity", "Group", "Reorder Level", "Unit", "Location", "Description", "Created At"]
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center")
-
-        # Add data
-        for row_num, item in enumerate(items, 2):
-            ws.cell(row=row_num, column=1, value=item[0])  # item_name
-            ws.cell(row=row_num, column=2, value=item[1])  # quantity
-            ws.cell(row=row_num, column=3, value=item[2])  # group_name
-            ws.cell(row=row_num, column=4, value=item[3])  # reorder_point
-            ws.cell(row=row_num, column=5, value=item[4])  # unit
-            ws.cell(row=row_num, column=6, value=item[5])  # location
-            ws.cell(row=row_num, column=7, value=item[6])  # description
-            ws.cell(row=row_num, column=8, value=item[7])  # created_at
-
-        # Auto-size columns
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        # Save file
-        wb.save(filename)
-        conn.close()
+        # Built in write-only mode in a worker thread, or taken from the export cache;
+        # a file the cache did not keep is removed once sent
+        path, cached = await run_in_threadpool(export_service.export_inventory_xlsx, group_list)
 
         return FileResponse(
-            filename,
+            path,
             media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            filename=filename
+            filename=filename,
+            background=None if cached else BackgroundTask(os.remove, path)
         )
     except Exception as e:
         logging.error(f"Error exporting Excel: {e}")
         raise HTTPException(status_code=500, detail=f"Error exporting data: {str(e)}")
 
-@app.get("/export/pdf")
+@app.post("/export/pdf", status_code=status.HTTP_202_ACCEPTED)
 async def export_inventory_pdf(
     groups: Optional[str] = None,
     current_user: User = Depends(get_admin_user)
 ):
-    """Export inventory to PDF file (admin only)"""
+    """Queue a PDF inventory report (admin only); download it from /jobs/{job_id}/download when completed"""
     try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.lib import colors
-        from reportlab.lib.units import inch
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"inventory_report_{timestamp}.pdf"
         group_list = groups.split(',') if groups else None
+        job = await run_in_threadpool(export_service.submit_pdf_report, job_service, group_list, current_user.username)
+        return {**job, "status_url": f"/jobs/{job['id']}", "download_url": f"/jobs/{job['id']}/download"}
+    except Exception as e:
+        logging.error(f"Error exporting PDF: {e}")
+        raise HTTPException(status_code=500, detail=f"Error exporting PDF: {str(e)}")
 
-        # Get inventory data
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        if group_list:
-            placeholders = ','.join('?' * len(group_list))
-            query = f"SELECT item_name, quantity, group_name, reorder_point, unit FROM items WHERE group_name IN ({placeholders})"
-            cursor.execute(query, group_list)
-        else:
-            cursor.execute("SELECT item_name, quantity, group_name, reorder_point, unit FROM items")
+@app.get("/export/cache")
+async def get_export_cache(current_user: User = Depends(get_admin_user)):
+    """Cached export files with their data version, size and hits (admin only)"""
+    try:
+        return export_service.cache.stats()
+    except Exception as e:
+        logging.error(f"Error fetching export cache: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching export cache")
 
-        items = cursor.fetchall()
-        conn.close()
+@app.delete("/export/cache")
+async def clear_export_cache(current_user: User = Depends(get_admin_user)):
+    """Remove all cached export files (admin only)"""
+    try:
+        return await run_in_threadpool(export_service.cache.clear)
+    except Exception as e:
+        logging.error(f"Error clearing export cache: {e}")
+        raise HTTPException(status_code=500, detail="Error clearing export cache")
 
-        # Create PDF
-        doc = SimpleDocTemplate(filename, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
+class SnapshotRequest(BaseModel):
+    incremental: bool = True
+    format: Optional[str] = None
 
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1976d2'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
-        title = Paragraph("Inventory Management Report", title_style)
-        elements.append(title)
-
-        # Subtitle with date
-        subtitle_style = ParagraphStyle(
-            'CustomSubtitle',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.grey,
-            spaceAfter=20,
-            alignment=TA_CENTER
+@app.post("/export/snapshots", status_code=status.HTTP_202_ACCEPTED)
+async def create_snapshot(request: SnapshotRequest, current_user: User = Depends(get_admin_user)):
+    """Queue an analytics snapshot of the inventory tables (admin only); incremental by default"""
+    try:
+        job = await run_in_threadpool(
+            snapshot_service.submit_snapshot, job_service, request.incremental, request.format, current_user.username
         )
-        subtitle = Paragraph(f"Generated on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", subtitle_style)
-        elements.append(subtitle)
-        elements.append(Spacer(1, 0.3*inch))
-
-        # Summary
-        summary_text = f"Total Items: <b>{len(items)}</b>"
-        summary = Paragraph(summary_text, styles['Normal'])
-        elements.append(summary)
-        elements.append(Spacer(1, 0.2*inch))
-
-        # Table data
-        data = [['Item Name', 'Quantity', 'Group', 'Reorder Level', 'Unit']]
-        for item in items:
-            data.append([
-                item[0] or '',
-                str(item[1]) if item[1] is not None else '0',
-                item[2] or 'N/A',
-                str(item[3]) if item[3] is not None else 'N/A',
-                item[4] or 'N/A'
-            ])
+        return {**job, "status_url": f"/jobs/{job['id']}"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error queueing snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Error queueing snapshot")
 
-        # Create table
-        table = Table(data, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1976d2')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-        ]))
+@app.get("/export/snapshots")
+async def get_snapshots(limit: int = 50, current_user: User = Depends(get_admin_user)):
+    """Recent analytics snapshots, newest first (admin only)"""
+    try:
+        return snapshot_service.list_snapshots(max(1, min(limit, 500)))
+    except Exception as e:
+        logging.error(f"Error fetching snapshots: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching snapshots")
 
-        elements.append(table)
-        doc.build(elements)
+@app.get("/export/snapshots/{snapshot_id}")
+async def get_snapshot(snapshot_id: int, current_user: User = Depends(get_admin_user)):
+    """An analytics snapshot with row counts and download links per table (admin only)"""
+    try:
+        snapshot = snapshot_service.get_snapshot(snapshot_id)
+        if not snapshot:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+        if snapshot["tables"]:
+            for table in snapshot["tables"].values():
+                table["urls"] = [f"/export/snapshots/{snapshot_id}/files/{name}" for name in table["files"]]
+        return snapshot
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching snapshot")
 
-        return FileResponse(
-            filename,
-            media_type='application/pdf',
-            filename=filename
-        )
+@app.get("/export/snapshots/{snapshot_id}/files/{file_name}")
+async def download_snapshot_file(snapshot_id: int, file_name: str, current_user: User = Depends(get_admin_user)):
+    """Download one file of a completed analytics snapshot (admin only)"""
+    try:
+        path = snapshot_service.file_path(snapshot_id, file_name)
+        if not path:
+            raise HTTPException(status_code=404, detail="Snapshot file not found")
+        return FileResponse(path, filename=file_name)
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error exporting PDF: {e}")
-        raise HTTPException(status_code=500, detail=f"Error exporting PDF: {str(e)}")
+        logging.error(f"Error downloading snapshot file: {e}")
+        raise HTTPException(status_code=500, detail="Error downloading snapshot file")
 
 # ============================================================================
 # QR CODE GENERATION ENDPOINTS
 # ============================================================================
 
+# Barcodes depend only on the URL; QR codes encode the item's current stock, so
+# clients revalidate them (cheaply, with If-None-Match) instead of caching them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+async def _image_response(request: Request, key: str, render, image_format: str, cache_control: str) -> Response:
+    """Image response with a content-hash ETag; renders (off the event loop) only if the client lacks it"""
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    _, image = await run_in_threadpool(render)
+    return Response(content=image, media_type=IMAGE_MEDIA_TYPES[image_format.lower()], headers=headers)
+
 @app.get("/items/{item_name}/qrcode")
 async def generate_item_qrcode(
     item_name: str,
+    request: Request,
     size: int = 10,
+    format: str = "png",
     current_user: User = Depends(get_current_user)
 ):
-    """Generate QR code for an item"""
+    """QR code for an item (png or svg), cached by content"""
     try:
-        import qrcode
-        from io import BytesIO
-
-        # Get item details
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM items WHERE item_name = ?", (item_name,))
-        item = cursor.fetchone()
-        conn.close()
-
-        if not item:
+        payload = await run_in_threadpool(label_service.qrcode_payload, item_name)
+        if payload is None:
             raise HTTPException(status_code=404, detail="Item not found")
-
-        # Create QR code data
-        qr_data = {
-            "item_name": item[0],
-            "quantity": item[1],
-            "group": item[2],
-            "reorder_point": item[3],
-        }
-        import json
-        qr_content = json.dumps(qr_data)
-
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=size,
-            border=4,
+        key = label_service.qrcode_key(payload, size, format)
+        return await _image_response(
+            request, key, lambda: label_service.qrcode_image(payload, size, format), format, REVALIDATE_CACHE_CONTROL
         )
-        qr.add_data(qr_content)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        # Save to bytes
-        img_byte_arr = BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        return Response(content=img_byte_arr.getvalue(), media_type="image/png")
+    except HTTPException:
+        raise
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail="QR code generation not available. Install qrcode library."
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error generating QR code: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating QR code: {str(e)}")
@@ -2775,34 +2908,70 @@ async def generate_item_qrcode(
 @app.get("/items/{item_name}/barcode")
 async def generate_item_barcode(
     item_name: str,
+    request: Request,
+    format: str = "png",
     current_user: User = Depends(get_current_user)
 ):
-    """Generate barcode for an item (Code128)"""
+    """Generate barcode for an item (Code128, png or svg), cached by content"""
     try:
-        from barcode import Code128
-        from barcode.writer import ImageWriter
-        from io import BytesIO
+        payload = label_service.barcode_payload(item_name)
+        key = label_service.barcode_key(payload, format)
+        return await _image_response(
+            request, key, lambda: label_service.barcode_image(payload, format), format, IMMUTABLE_CACHE_CONTROL
+        )
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail="Barcode generation not available. Install python-barcode library."
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error generating barcode: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating barcode: {str(e)}")
 
-        # Create barcode
-        # Use item name or a unique identifier
-        barcode_data = item_name.replace(" ", "_")[:20]  # Limit length
+@app.on_event("shutdown")
+async def stop_label_renderers():
+    """Stop the label render processes"""
+    label_service.shutdown()
 
-        barcode = Code128(barcode_data, writer=ImageWriter())
+class LabelSheetRequest(BaseModel):
+    item_names: Optional[List[str]] = None
+    po_id: Optional[int] = None
+    include_qrcode: bool = True
 
-        # Save to bytes
-        img_byte_arr = BytesIO()
-        barcode.write(img_byte_arr)
-        img_byte_arr.seek(0)
+@app.post("/labels/sheet")
+async def generate_label_sheet(request: LabelSheetRequest, current_user: User = Depends(get_current_user)):
+    """Labels for a list of items or a purchase order's line items, 30 per page on Avery 5160-style sheets"""
+    try:
+        if (request.item_names is None) == (request.po_id is None):
+            raise HTTPException(status_code=400, detail="Give either item_names or po_id")
+        items = await run_in_threadpool(label_service.sheet_items, request.item_names, request.po_id)
+        # QR codes are rendered across the label render processes; the sheet is laid out
+        # in a worker thread and streamed from its temp file, which is removed once sent
+        path = await run_in_threadpool(label_service.write_label_sheet, items, request.include_qrcode)
 
-        return Response(content=img_byte_arr.getvalue(), media_type="image/png")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return FileResponse(
+            path,
+            media_type='application/pdf',
+            filename=f"labels_{timestamp}.pdf",
+            background=BackgroundTask(os.remove, path)
+        )
+    except HTTPException:
+        raise
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except ImportError:
         raise HTTPException(
             status_code=501,
-            detail="Barcode generation not available. Install python-barcode library."
+            detail="Label sheets need the reportlab and qrcode libraries."
         )
     except Exception as e:
-        logging.error(f"Error generating barcode: {e}")
-        raise HTTPException(status_code=500, detail=f"Error generating barcode: {str(e)}")
+        logging.error(f"Error generating label sheet: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating label sheet: {str(e)}")
 
 @app.post("/items/{item_name}/print-label")
 async def generate_print_label(
@@ -2997,78 +3166,22 @@ async def get_purchase_orders(
     status: Optional[str] = None,
     supplier_id: Optional[int] = None,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    include_items: bool = True,
     current_user: User = Depends(get_current_user)
 ):
-    """Get purchase orders"""
+    """Get purchase orders, newest first, one page at a time (pass next_cursor back as cursor)"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        query = """
-            SELECT po.*, s.name as supplier_name, l.name as location_name
-            FROM purchase_orders po
-            LEFT JOIN suppliers s ON po.supplier_id = s.id
-            LEFT JOIN locations l ON po.location_id = l.id
-            WHERE 1=1
-        """
-        params = []
-
-        if status:
-            query += " AND po.status = ?"
-            params.append(status)
-
-        if supplier_id:
-            query += " AND po.supplier_id = ?"
-            params.append(supplier_id)
-
-        query += " ORDER BY po.created_at DESC LIMIT ?"
-        params.append(limit)
-
-        cursor.execute(query, params)
-        orders = cursor.fetchall()
-
-        # Get items for each order
-        result = []
-        for order in orders:
-            cursor.execute(
-                """SELECT * FROM purchase_order_items WHERE po_id = ?""",
-                (order[0],)
-            )
-            items = cursor.fetchall()
-
-            result.append({
-                "id": order[0],
-                "order_number": order[1],
-                "supplier_id": order[2],
-                "supplier_name": order[-2],
-                "location_id": order[3],
-                "location_name": order[-1],
-                "order_date": order[4],
-                "expected_delivery_date": order[5],
-                "actual_delivery_date": order[6],
-                "status": order[7],
-                "total_amount": order[8],
-                "created_by": order[9],
-                "created_at": order[10],
-                "updated_at": order[11],
-                "notes": order[12],
-                "items": [
-                    {
-                        "id": item[0],
-                        "item_name": item[2],
-                        "quantity": item[3],
-                        "unit_price": item[4],
-                        "total_price": item[5],
-                        "received_quantity": item[6],
-                        "notes": item[7]
-                    }
-                    for item in items
-                ]
-            })
-
-        conn.close()
-        return {"purchase_orders": result}
-
+        if limit < 1 or limit > MAX_PURCHASE_ORDER_PAGE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PURCHASE_ORDER_PAGE}")
+        return purchase_order_service.list_purchase_orders(
+            limit=limit, cursor=cursor, status=status,
+            supplier_id=supplier_id, include_items=include_items
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error fetching purchase orders: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching purchase orders: {str(e)}")
@@ -3109,66 +3222,45 @@ async def update_purchase_order_status(
         logging.error(f"Error updating purchase order status: {e}")
         raise HTTPException(status_code=500, detail=f"Error updating status: {str(e)}")
 
+class ReceivedPurchaseOrderItem(BaseModel):
+    item_name: str
+    quantity: int
+    po_item_id: Optional[int] = None
+    batch_number: Optional[str] = None
+    manufacturing_date: Optional[str] = None
+    expiry_date: Optional[str] = None
+
+class ReceivePurchaseOrderRequest(BaseModel):
+    items: List[ReceivedPurchaseOrderItem]
+
 @app.post("/purchase-orders/{po_id}/receive")
 async def receive_purchase_order(
     po_id: int,
-    received_items: List[dict],  # [{"item_name": "...", "quantity": int}]
+    request: ReceivePurchaseOrderRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: User = Depends(get_admin_or_editor)
 ):
-    """Receive items from a purchase order and update inventory"""
-    try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        # Get PO details
-        cursor.execute("SELECT * FROM purchase_orders WHERE id = ?", (po_id,))
-        po = cursor.fetchone()
-        if not po:
-            raise HTTPException(status_code=404, detail="Purchase order not found")
-
-        # Update inventory for received items
-        for item in received_items:
-            item_name = item['item_name']
-            quantity = item['quantity']
-
-            # Update main inventory
-            cursor.execute(
-                """UPDATE items SET quantity = quantity + ?, updated_at = ?
-                   WHERE item_name = ?""",
-                (quantity, datetime.now().isoformat(), item_name)
-            )
-
-            # Update received quantity in PO items
-            cursor.execute(
-                """UPDATE purchase_order_items
-                   SET received_quantity = COALESCE(received_quantity, 0) + ?
-                   WHERE po_id = ? AND item_name = ?""",
-                (quantity, po_id, item_name)
-            )
+    """
+    Receive items from a purchase order and update inventory.
 
-            # Log to history
-            cursor.execute(
-                """INSERT INTO history (action, item_name, quantity, user, timestamp, notes)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                ('received_from_po', item_name, quantity, current_user.username,
-                 datetime.now().isoformat(), f"PO ID: {po_id}")
-            )
-
-        # Update PO status
-        cursor.execute(
-            """UPDATE purchase_orders
-               SET status = 'received', actual_delivery_date = ?, updated_at = ?
-               WHERE id = ?""",
-            (datetime.now().isoformat(), datetime.now().isoformat(), po_id)
+    Send an Idempotency-Key header to make retries safe: a repeated request with the same
+    key returns the first response instead of receiving the goods twice.
+    """
+    try:
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+        return await run_in_threadpool(
+            purchase_order_service.receive_items, po_id,
+            [item.dict() for item in request.items], current_user.username, idempotency_key
         )
-
-        conn.commit()
-        conn.close()
-
-        return {"status": "success", "message": "Items received and inventory updated"}
-
     except HTTPException:
         raise
+    except IdempotencyKeyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error receiving purchase order: {e}")
         raise HTTPException(status_code=500, detail=f"Error receiving PO: {str(e)}")
@@ -3191,105 +3283,91 @@ async def create_stock_transfer(
     transfer: StockTransfer,
     current_user: User = Depends(get_admin_or_editor)
 ):
-    """Transfer stock between locations"""
+    """Transfer stock between locations, moving batches first-expired-first-out"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        # Validate locations
-        cursor.execute("SELECT id, name FROM locations WHERE id IN (?, ?)",
-                      (transfer.from_location_id, transfer.to_location_id))
-        locations = cursor.fetchall()
-
-        if len(locations) != 2:
-            raise HTTPException(status_code=404, detail="One or both locations not found")
+        if transfer.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        if transfer.from_location_id == transfer.to_location_id:
+            raise HTTPException(status_code=400, detail="Source and destination locations must differ")
 
-        # Check stock at source location
-        cursor.execute(
-            """SELECT quantity FROM item_locations
-               WHERE item_name = ? AND location_id = ?""",
-            (transfer.item_name, transfer.from_location_id)
-        )
-        source_stock = cursor.fetchone()
-
-        if not source_stock or source_stock[0] < transfer.quantity:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Insufficient stock at source location. Available: {source_stock[0] if source_stock else 0}"
-            )
-
-        # Update source location
-        new_source_qty = source_stock[0] - transfer.quantity
-        cursor.execute(
-            """UPDATE item_locations SET quantity = ?, updated_at = ?
-               WHERE item_name = ? AND location_id = ?""",
-            (new_source_qty, datetime.now().isoformat(), transfer.item_name, transfer.from_location_id)
-        )
-
-        # Update or insert destination location
-        cursor.execute(
-            """SELECT quantity FROM item_locations
-               WHERE item_name = ? AND location_id = ?""",
-            (transfer.item_name, transfer.to_location_id)
-        )
-        dest_stock = cursor.fetchone()
-
-        if dest_stock:
-            new_dest_qty = dest_stock[0] + transfer.quantity
-            cursor.execute(
-                """UPDATE item_locations SET quantity = ?, updated_at = ?
-                   WHERE item_name = ? AND location_id = ?""",
-                (new_dest_qty, datetime.now().isoformat(), transfer.item_name, transfer.to_location_id)
-            )
-        else:
-            cursor.execute(
-                """INSERT INTO item_locations (item_name, location_id, quantity, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (transfer.item_name, transfer.to_location_id, transfer.quantity,
-                 datetime.now().isoformat(), datetime.now().isoformat())
+        with db_connection.get_cursor() as cursor:
+            # Validate locations
+            cursor.execute("SELECT id, name FROM locations WHERE id IN (?, ?)",
+                          (transfer.from_location_id, transfer.to_location_id))
+            locations = cursor.fetchall()
+
+            if len(locations) != 2:
+                raise HTTPException(status_code=404, detail="One or both locations not found")
+
+            # Draw the source location's batches down first-expired-first-out; this also opens
+            # the write transaction so the stock check below cannot race another transfer
+            allocation = batch_service.allocate_fefo_in(
+                cursor, transfer.item_name, transfer.quantity,
+                location_id=transfer.from_location_id, allow_partial=True
             )
 
-        # Log the transfer in stock adjustments
-        cursor.execute(
-            """INSERT INTO stock_adjustments
-               (item_name, adjustment_type, quantity, reason, location_id, reference_number, notes, adjusted_by, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (transfer.item_name, 'subtraction', transfer.quantity, 'transfer',
-             transfer.from_location_id, f"Transfer to Location {transfer.to_location_id}",
-             transfer.notes, current_user.username, datetime.now().isoformat())
-        )
-
-        cursor.execute(
-            """INSERT INTO stock_adjustments
-               (item_name, adjustment_type, quantity, reason, location_id, reference_number, notes, adjusted_by, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (transfer.item_name, 'addition', transfer.quantity, 'transfer',
-             transfer.to_location_id, f"Transfer from Location {transfer.from_location_id}",
-             transfer.notes, current_user.username, datetime.now().isoformat())
-        )
-
-        # Log to history
-        cursor.execute(
-            """INSERT INTO history (action, item_name, quantity, user, timestamp, notes)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            ('transfer', transfer.item_name, transfer.quantity, current_user.username,
-             datetime.now().isoformat(),
-             f"From Location {transfer.from_location_id} to {transfer.to_location_id}")
-        )
+            # Take stock from the source location only if enough is there
+            cursor.execute("""
+                UPDATE item_locations
+                SET quantity = quantity - ?, updated_at = datetime('now')
+                WHERE item_name = ? AND location_id = ? AND quantity >= ?
+            """, (transfer.quantity, transfer.item_name, transfer.from_location_id, transfer.quantity))
+
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    "SELECT quantity FROM item_locations WHERE item_name = ? AND location_id = ?",
+                    (transfer.item_name, transfer.from_location_id)
+                )
+                source_stock = cursor.fetchone()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient stock at source location. Available: {source_stock[0] if source_stock else 0}"
+                )
+
+            # Add to destination location
+            cursor.execute("""
+                INSERT INTO item_locations (item_name, location_id, quantity)
+                VALUES (?, ?, ?)
+                ON CONFLICT(item_name, location_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity,
+                    updated_at = datetime('now')
+            """, (transfer.item_name, transfer.to_location_id, transfer.quantity))
+
+            batch_service.move_allocations_in(cursor, allocation['allocations'], transfer.to_location_id)
+
+            # Log the transfer in stock adjustments
+            cursor.executemany("""
+                INSERT INTO stock_adjustments
+                (item_name, location_id, adjustment_type, quantity, reason, reference_number, reason_notes, adjusted_by)
+                VALUES (?, ?, ?, ?, 'transfer', ?, ?, ?)
+            """, [
+                (transfer.item_name, transfer.from_location_id, 'decrease', transfer.quantity,
+                 f"Transfer to Location {transfer.to_location_id}", transfer.notes, current_user.username),
+                (transfer.item_name, transfer.to_location_id, 'increase', transfer.quantity,
+                 f"Transfer from Location {transfer.from_location_id}", transfer.notes, current_user.username)
+            ])
 
-        conn.commit()
-        conn.close()
+            # Log to history
+            cursor.execute("""
+                INSERT INTO history (action, item_name, quantity, user_name)
+                VALUES ('transfer', ?, ?, ?)
+            """, (transfer.item_name, transfer.quantity, current_user.username))
 
         logging.info(f"Stock transfer completed: {transfer.item_name}, {transfer.quantity} units from {transfer.from_location_id} to {transfer.to_location_id}")
 
         return {
             "status": "success",
             "message": "Stock transferred successfully",
-            "transfer": transfer.dict()
+            "transfer": transfer.dict(),
+            "batch_allocations": allocation['allocations']
         }
 
     except HTTPException:
         raise
+    except BatchAllocationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error transferring stock: {e}")
         raise HTTPException(status_code=500, detail=f"Error transferring stock: {str(e)}")
@@ -3497,89 +3575,84 @@ async def get_financial_summary(
 ):
     """Get financial summary with revenue, costs, and profit"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        # Build date filter
-        date_filter = ""
-        params = []
-        if start_date:
-            date_filter += " AND po.order_date >= ?"
-            params.append(start_date)
-        if end_date:
-            date_filter += " AND po.order_date <= ?"
-            params.append(end_date)
-
-        # Get total purchase costs from purchase orders
-        cursor.execute(
-            f"""SELECT
-                   COALESCE(SUM(total_amount), 0) as total_purchase_cost,
-                   COUNT(DISTINCT id) as total_orders
-               FROM purchase_orders po
-               WHERE status = 'received'{date_filter}""",
-            params
-        )
-        purchase_data = cursor.fetchone()
-        total_purchase_cost = purchase_data['total_purchase_cost'] if purchase_data else 0
-        total_orders = purchase_data['total_orders'] if purchase_data else 0
-
-        # Calculate current inventory value based on latest prices
-        cursor.execute("""
-            SELECT
-                COALESCE(SUM(i.quantity * COALESCE(p.price, 0)), 0) as inventory_value,
-                COUNT(DISTINCT i.item_name) as total_items
-            FROM items i
-            LEFT JOIN (
-                SELECT item_name, AVG(price) as price
-                FROM prices
-                GROUP BY item_name
-            ) p ON i.item_name = p.item_name
-        """)
-        inventory_data = cursor.fetchone()
-        inventory_value = inventory_data['inventory_value'] if inventory_data else 0
-        total_items = inventory_data['total_items'] if inventory_data else 0
+        with db_connection.get_cursor() as cursor:
+            # Build date filter
+            date_filter = ""
+            params = []
+            if start_date:
+                date_filter += " AND po.order_date >= ?"
+                params.append(start_date)
+            if end_date:
+                date_filter += " AND po.order_date <= ?"
+                params.append(end_date)
+
+            # Get total purchase costs from purchase orders
+            cursor.execute(
+                f"""SELECT
+                       COALESCE(SUM(total_amount), 0) as total_purchase_cost,
+                       COUNT(DISTINCT id) as total_orders
+                   FROM purchase_orders po
+                   WHERE status = 'received'{date_filter}""",
+                params
+            )
+            purchase_data = cursor.fetchone()
+            total_purchase_cost = purchase_data['total_purchase_cost'] if purchase_data else 0
+            total_orders = purchase_data['total_orders'] if purchase_data else 0
 
-        # Get stock adjustments for revenue estimation (returned items)
-        cursor.execute(
-            f"""SELECT
-                   COUNT(*) as total_adjustments,
-                   COALESCE(SUM(CASE WHEN adjustment_type = 'increase' THEN quantity ELSE 0 END), 0) as items_added,
-                   COALESCE(SUM(CASE WHEN adjustment_type = 'decrease' THEN quantity ELSE 0 END), 0) as items_removed
-               FROM stock_adjustments
-               WHERE 1=1{date_filter.replace('po.', '')}""",
-            params
-        )
-        adjustments = cursor.fetchone()
+            # Calculate current inventory value based on latest prices
+            cursor.execute("""
+                SELECT
+                    COALESCE(SUM(i.quantity * COALESCE(p.price, 0)), 0) as inventory_value,
+                    COUNT(DISTINCT i.item_name) as total_items
+                FROM items i
+                LEFT JOIN (
+                    SELECT item_name, avg_price as price
+                    FROM price_summary
+                ) p ON i.item_name = p.item_name
+            """)
+            inventory_data = cursor.fetchone()
+            inventory_value = inventory_data['inventory_value'] if inventory_data else 0
+            total_items = inventory_data['total_items'] if inventory_data else 0
 
-        # Calculate estimated revenue (items sold * average price)
-        # Assuming items_removed represents sales/usage
-        items_sold = adjustments['items_removed'] if adjustments else 0
-        cursor.execute("""
-            SELECT AVG(price) as avg_price
-            FROM prices
-        """)
-        avg_price_data = cursor.fetchone()
-        avg_price = avg_price_data['avg_price'] if avg_price_data and avg_price_data['avg_price'] else 0
-        estimated_revenue = items_sold * avg_price
+            # Get stock adjustments for revenue estimation (returned items)
+            cursor.execute(
+                f"""SELECT
+                       COUNT(*) as total_adjustments,
+                       COALESCE(SUM(CASE WHEN adjustment_type = 'increase' THEN quantity ELSE 0 END), 0) as items_added,
+                       COALESCE(SUM(CASE WHEN adjustment_type = 'decrease' THEN quantity ELSE 0 END), 0) as items_removed
+                   FROM stock_adjustments
+                   WHERE 1=1{date_filter.replace('po.', '')}""",
+                params
+            )
+            adjustments = cursor.fetchone()
 
-        # Calculate profit margin
-        gross_profit = estimated_revenue - total_purchase_cost
-        profit_margin = (gross_profit / estimated_revenue * 100) if estimated_revenue > 0 else 0
+            # Calculate estimated revenue (items sold * average price)
+            # Assuming items_removed represents sales/usage
+            items_sold = adjustments['items_removed'] if adjustments else 0
+            cursor.execute("""
+                SELECT SUM(price_total) / SUM(price_count) as avg_price
+                FROM price_summary
+            """)
+            avg_price_data = cursor.fetchone()
+            avg_price = avg_price_data['avg_price'] if avg_price_data and avg_price_data['avg_price'] else 0
+            estimated_revenue = items_sold * avg_price
 
-        conn.close()
+            # Calculate profit margin
+            gross_profit = estimated_revenue - total_purchase_cost
+            profit_margin = (gross_profit / estimated_revenue * 100) if estimated_revenue > 0 else 0
 
-        return {
-            "total_purchase_cost": round(total_purchase_cost, 2),
-            "estimated_revenue": round(estimated_revenue, 2),
-            "gross_profit": round(gross_profit, 2),
-            "profit_margin_percent": round(profit_margin, 2),
-            "current_inventory_value": round(inventory_value, 2),
-            "total_items": total_items,
-            "total_purchase_orders": total_orders,
-            "items_sold": items_sold,
-            "items_added": adjustments['items_added'] if adjustments else 0,
-            "total_adjustments": adjustments['total_adjustments'] if adjustments else 0
-        }
+            return {
+                "total_purchase_cost": round(total_purchase_cost, 2),
+                "estimated_revenue": round(estimated_revenue, 2),
+                "gross_profit": round(gross_profit, 2),
+                "profit_margin_percent": round(profit_margin, 2),
+                "current_inventory_value": round(inventory_value, 2),
+                "total_items": total_items,
+                "total_purchase_orders": total_orders,
+                "items_sold": items_sold,
+                "items_added": adjustments['items_added'] if adjustments else 0,
+                "total_adjustments": adjustments['total_adjustments'] if adjustments else 0
+            }
 
     except Exception as e:
         logging.error(f"Error getting financial summary: {e}")
@@ -3592,38 +3665,31 @@ async def get_inventory_value_breakdown(
 ):
     """Get inventory value broken down by group/category"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT
-                COALESCE(i.group_name, 'Uncategorized') as category,
-                COUNT(i.item_name) as item_count,
-                SUM(i.quantity) as total_quantity,
-                COALESCE(SUM(i.quantity * p.avg_price), 0) as total_value,
-                COALESCE(AVG(p.avg_price), 0) as avg_unit_price
-            FROM items i
-            LEFT JOIN (
-                SELECT item_name, AVG(price) as avg_price
-                FROM prices
-                GROUP BY item_name
-            ) p ON i.item_name = p.item_name
-            GROUP BY i.group_name
-            ORDER BY total_value DESC
-        """)
+        with db_connection.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    COALESCE(i.group_name, 'Uncategorized') as category,
+                    COUNT(i.item_name) as item_count,
+                    SUM(i.quantity) as total_quantity,
+                    COALESCE(SUM(i.quantity * p.avg_price), 0) as total_value,
+                    COALESCE(AVG(p.avg_price), 0) as avg_unit_price
+                FROM items i
+                LEFT JOIN price_summary p ON i.item_name = p.item_name
+                GROUP BY i.group_name
+                ORDER BY total_value DESC
+            """)
 
-        breakdown = []
-        for row in cursor.fetchall():
-            breakdown.append({
-                "category": row['category'],
-                "item_count": row['item_count'],
-                "total_quantity": row['total_quantity'],
-                "total_value": round(row['total_value'], 2),
-                "avg_unit_price": round(row['avg_unit_price'], 2)
-            })
+            breakdown = []
+            for row in cursor.fetchall():
+                breakdown.append({
+                    "category": row['category'],
+                    "item_count": row['item_count'],
+                    "total_quantity": row['total_quantity'],
+                    "total_value": round(row['total_value'], 2),
+                    "avg_unit_price": round(row['avg_unit_price'], 2)
+                })
 
-        conn.close()
-        return breakdown
+            return breakdown
 
     except Exception as e:
         logging.error(f"Error getting inventory value breakdown: {e}")
@@ -3638,93 +3704,78 @@ async def get_top_items(
 ):
     """Get top items by various metrics"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        if metric == 'value':
-            # Top items by total value
-            cursor.execute("""
-                SELECT
-                    i.item_name,
-                    i.quantity,
-                    i.group_name,
-                    COALESCE(p.avg_price, 0) as unit_price,
-                    i.quantity * COALESCE(p.avg_price, 0) as total_value
-                FROM items i
-                LEFT JOIN (
-                    SELECT item_name, AVG(price) as avg_price
-                    FROM prices
-                    GROUP BY item_name
-                ) p ON i.item_name = p.item_name
-                ORDER BY total_value DESC
-                LIMIT ?
-            """, (limit,))
-        elif metric == 'quantity':
-            # Top items by quantity in stock
-            cursor.execute("""
-                SELECT
-                    i.item_name,
-                    i.quantity,
-                    i.group_name,
-                    COALESCE(p.avg_price, 0) as unit_price,
-                    i.quantity * COALESCE(p.avg_price, 0) as total_value
-                FROM items i
-                LEFT JOIN (
-                    SELECT item_name, AVG(price) as avg_price
-                    FROM prices
-                    GROUP BY item_name
-                ) p ON i.item_name = p.item_name
-                ORDER BY i.quantity DESC
-                LIMIT ?
-            """, (limit,))
-        else:  # movement
-            # Top items by stock movement (adjustments)
-            cursor.execute("""
-                SELECT
-                    sa.item_name,
-                    i.quantity as current_quantity,
-                    i.group_name,
-                    COUNT(*) as movement_count,
-                    SUM(sa.quantity) as total_moved,
-                    COALESCE(p.avg_price, 0) as unit_price
-                FROM stock_adjustments sa
-                JOIN items i ON sa.item_name = i.item_name
-                LEFT JOIN (
-                    SELECT item_name, AVG(price) as avg_price
-                    FROM prices
-                    GROUP BY item_name
-                ) p ON i.item_name = p.item_name
-                WHERE sa.adjustment_date >= datetime('now', '-30 days')
-                GROUP BY sa.item_name, i.quantity, i.group_name
-                ORDER BY total_moved DESC
-                LIMIT ?
-            """, (limit,))
+        with db_connection.get_cursor() as cursor:
+            if metric == 'value':
+                # Top items by total value
+                cursor.execute("""
+                    SELECT
+                        i.item_name,
+                        i.quantity,
+                        i.group_name,
+                        COALESCE(p.avg_price, 0) as unit_price,
+                        i.quantity * COALESCE(p.avg_price, 0) as total_value
+                    FROM items i
+                    LEFT JOIN price_summary p ON i.item_name = p.item_name
+                    ORDER BY total_value DESC
+                    LIMIT ?
+                """, (limit,))
+            elif metric == 'quantity':
+                # Top items by quantity in stock
+                cursor.execute("""
+                    SELECT
+                        i.item_name,
+                        i.quantity,
+                        i.group_name,
+                        COALESCE(p.avg_price, 0) as unit_price,
+                        i.quantity * COALESCE(p.avg_price, 0) as total_value
+                    FROM items i
+                    LEFT JOIN price_summary p ON i.item_name = p.item_name
+                    ORDER BY i.quantity DESC
+                    LIMIT ?
+                """, (limit,))
+            else:  # movement
+                # Top items by stock movement (adjustments)
+                cursor.execute("""
+                    SELECT
+                        sa.item_name,
+                        i.quantity as current_quantity,
+                        i.group_name,
+                        COUNT(*) as movement_count,
+                        SUM(sa.quantity) as total_moved,
+                        COALESCE(p.avg_price, 0) as unit_price
+                    FROM stock_adjustments sa
+                    JOIN items i ON sa.item_name = i.item_name
+                    LEFT JOIN price_summary p ON i.item_name = p.item_name
+                    WHERE sa.adjustment_date >= datetime('now', '-30 days')
+                    GROUP BY sa.item_name, i.quantity, i.group_name
+                    ORDER BY total_moved DESC
+                    LIMIT ?
+                """, (limit,))
 
-        items = []
-        for row in cursor.fetchall():
-            item_data = {
-                "item_name": row['item_name'],
-                "group_name": row['group_name'] or 'Uncategorized'
-            }
+            items = []
+            for row in cursor.fetchall():
+                item_data = {
+                    "item_name": row['item_name'],
+                    "group_name": row['group_name'] or 'Uncategorized'
+                }
 
-            if metric == 'movement':
-                item_data.update({
-                    "current_quantity": row['current_quantity'],
-                    "movement_count": row['movement_count'],
-                    "total_moved": row['total_moved'],
-                    "unit_price": round(row['unit_price'], 2)
-                })
-            else:
-                item_data.update({
-                    "quantity": row['quantity'],
-                    "unit_price": round(row['unit_price'], 2),
-                    "total_value": round(row['total_value'], 2)
-                })
+                if metric == 'movement':
+                    item_data.update({
+                        "current_quantity": row['current_quantity'],
+                        "movement_count": row['movement_count'],
+                        "total_moved": row['total_moved'],
+                        "unit_price": round(row['unit_price'], 2)
+                    })
+                else:
+                    item_data.update({
+                        "quantity": row['quantity'],
+                        "unit_price": round(row['unit_price'], 2),
+                        "total_value": round(row['total_value'], 2)
+                    })
 
-            items.append(item_data)
+                items.append(item_data)
 
-        conn.close()
-        return items
+            return items
 
     except Exception as e:
         logging.error(f"Error getting top items: {e}")
@@ -4780,6 +4831,180 @@ async def get_user_audit_log(
         logging.error(f"Error getting user audit log: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting user audit log: {str(e)}")
 
+# ============================================================================
+# Background Jobs
+# ============================================================================
+
+job_service.register(IMPORT_JOB_TYPE, import_service.run_import_job)
+job_service.register(UPLOAD_IMPORT_JOB_TYPE, import_service.run_import_job, pool='uploads')
+job_service.register(PDF_REPORT_JOB_TYPE, export_service.run_pdf_job)
+job_service.register(SNAPSHOT_JOB_TYPE, snapshot_service.run_snapshot_job)
+
+@app.on_event("startup")
+async def start_job_runner():
+    """Start the background job workers and resume unfinished jobs"""
+    job_service.start()
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    """Stop the background job workers; running jobs are requeued at their last checkpoint"""
+    job_service.stop()
+    export_service.shutdown()
+
+def _get_visible_job(job_id: str, current_user: User) -> Dict[str, Any]:
+    """Load a job, hiding other users' jobs from non-admins"""
+    job = job_service.get_job(job_id)
+    if not job or (current_user.role != "admin" and job["user_name"] != current_user.username):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs")
+async def get_jobs(
+    status: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_admin_or_editor)
+):
+    """Recent background jobs, newest first (admins see everyone's)"""
+    try:
+        user_name = None if current_user.role == "admin" else current_user.username
+        return job_service.list_jobs(user_name, status, max(1, min(limit, 500)))
+    except Exception as e:
+        logging.error(f"Error fetching jobs: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching jobs")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Status and progress of a background job: rows processed and failed, percent done and ETA"""
+    try:
+        return _get_visible_job(job_id, current_user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching job: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching job")
+
+@app.get("/jobs/{job_id}/download")
+async def download_job_result(job_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Download the file a completed job rendered (e.g. a PDF report)"""
+    try:
+        job = _get_visible_job(job_id, current_user)
+        if job["status"] != "completed":
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+        result = job["result"] if isinstance(job["result"], dict) else {}
+        if not result.get("file") or not os.path.exists(result["file"]):
+            raise HTTPException(status_code=404, detail="Job has no file to download")
+        return FileResponse(
+            result["file"],
+            media_type=result.get("media_type", "application/octet-stream"),
+            filename=result.get("filename", os.path.basename(result["file"]))
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error downloading job result: {e}")
+        raise HTTPException(status_code=500, detail="Error downloading job result")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Cancel a job; a running job stops after its current chunk, keeping committed work"""
+    try:
+        _get_visible_job(job_id, current_user)
+        return job_service.cancel(job_id)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error cancelling job: {e}")
+        raise HTTPException(status_code=500, detail="Error cancelling job")
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str, current_user: User = Depends(get_admin_or_editor)):
+    """Resume a failed or cancelled job from its last checkpoint"""
+    try:
+        _get_visible_job(job_id, current_user)
+        return job_service.resume(job_id)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error resuming job: {e}")
+        raise HTTPException(status_code=500, detail="Error resuming job")
+
+# ============================================================================
+# Scheduled Jobs
+# ============================================================================
+
+# Set SCHEDULER_ENABLED=0 to run without background jobs (e.g. on extra API workers)
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1").lower() not in ("0", "false", "no")
+
+scheduler_service.register("expiry_sweep", "5 * * * *", batch_service.sweep_expiries, jitter_seconds=60)
+scheduler_service.register(
+    "reorder_check", "*/15 * * * *",
+    lambda: alert_service.check_reorder_levels(incremental=True), jitter_seconds=30
+)
+scheduler_service.register("price_history_compaction", "30 2 * * *", price_service.compact_price_history, jitter_seconds=300)
+scheduler_service.register("database_backup", "0 3 * * *", inventory_service.backup_data, jitter_seconds=300)
+scheduler_service.register("backup_prune", "30 3 * * *", inventory_service.prune_backups, jitter_seconds=300)
+scheduler_service.register("wal_checkpoint", "*/30 * * * *", db_connection.checkpoint, jitter_seconds=60)
+scheduler_service.register("job_history_prune", "15 4 * * *", scheduler_service.prune_history)
+scheduler_service.register("background_job_recovery", "*/2 * * * *", job_service.recover)
+scheduler_service.register("background_job_prune", "45 4 * * *", job_service.prune, jitter_seconds=300)
+scheduler_service.register("stale_upload_prune", "50 * * * *", upload_service.prune)
+scheduler_service.register(
+    "analytics_snapshot", "30 1 * * *",
+    lambda: snapshot_service.submit_snapshot(job_service, incremental=True), jitter_seconds=300
+)
+scheduler_service.register("snapshot_prune", "0 5 * * *", snapshot_service.prune, jitter_seconds=300)
+
+@app.on_event("startup")
+async def start_scheduler():
+    """Start the background job scheduler"""
+    if SCHEDULER_ENABLED:
+        scheduler_service.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    """Stop the background job scheduler without blocking the event loop while it finishes"""
+    if SCHEDULER_ENABLED:
+        await run_in_threadpool(scheduler_service.stop)
+
+@app.get("/scheduler/jobs")
+async def get_scheduled_jobs(current_user: User = Depends(get_admin_user)):
+    """List scheduled jobs with their next run, lease holder and timing metrics"""
+    try:
+        return {"runner_id": scheduler_service.runner_id, "jobs": scheduler_service.get_jobs()}
+    except Exception as e:
+        logging.error(f"Error fetching scheduled jobs: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching scheduled jobs")
+
+@app.get("/scheduler/jobs/{job_name}/runs")
+async def get_scheduled_job_runs(
+    job_name: str,
+    limit: int = 50,
+    current_user: User = Depends(get_admin_user)
+):
+    """Run history of a scheduled job, newest first"""
+    try:
+        return {"job_name": job_name, "runs": scheduler_service.get_runs(job_name, limit)}
+    except Exception as e:
+        logging.error(f"Error fetching job runs: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching job runs")
+
+@app.post("/scheduler/jobs/{job_name}/run")
+async def run_scheduled_job(job_name: str, current_user: User = Depends(get_admin_user)):
+    """Queue a scheduled job to run now in the background"""
+    try:
+        if not scheduler_service.trigger(job_name):
+            raise HTTPException(status_code=404, detail="Job not found")
+        return {"message": f"Job {job_name} queued"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error queueing job: {e}")
+        raise HTTPException(status_code=500, detail="Error queueing job")
+
 # ============================================================================
 # Health Check
 # ============================================================================
@@ -1,14 +1,21 @@
 # database/db_connection.py
 
+import os
 import sqlite3
 import logging
-from contextlib import contextmanager
-from threading import Lock
-from typing import Optional
+from contextlib import ExitStack, contextmanager
+from threading import Lock, local
+from typing import Optional, Dict, Any, List
+from urllib.parse import quote
 
 
 class DBConnection:
-    """Database connection class that manages the connection to the SQLite database."""
+    """
+    Database connection class that manages the connection to the SQLite database.
+
+    Each thread gets its own connection, so background work running in another
+    thread never shares a transaction with the request handlers.
+    """
     
     _instance = None
     _lock = Lock()
@@ -25,11 +32,21 @@ class DBConnection:
         """Initialize database connection if not already initialized."""
         if not self.initialized:
             self.db_name = db_name
-            self.conn: Optional[sqlite3.Connection] = None
+            self._local = local()
+            self._connections = set()
             self._lock = Lock()
             self.initialized = True
             logging.info(f"Initialized database connection to {db_name}")
     
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        """The calling thread's connection, if it has opened one."""
+        return getattr(self._local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value: Optional[sqlite3.Connection]):
+        self._local.conn = value
+
     def connect(self):
         """Connect to the database with optimized settings."""
         if self.conn is None:
@@ -51,6 +68,7 @@ class DBConnection:
                         self.conn.execute("PRAGMA mmap_size = 30000000000")
                         self.conn.execute("PRAGMA page_size = 4096")
 
+                        self._connections.add(self.conn)
                         logging.info("Successfully connected to database")
                         return self.conn
             except sqlite3.Error as e:
@@ -59,18 +77,29 @@ class DBConnection:
         return self.conn
     
     def close(self):
-        """Close the database connection safely."""
+        """Close the calling thread's database connection safely."""
         with self._lock:
             if self.conn:
-                try:
-                    if self.conn.in_transaction:
-                        self.conn.rollback()
-                    self.conn.close()
-                except sqlite3.Error as e:
-                    logging.error(f"Error closing database connection: {e}")
-                finally:
-                    self.conn = None
-                    logging.info("Database connection closed")
+                self._close(self.conn)
+                self.conn = None
+
+    def close_all(self):
+        """Close the connections of all threads."""
+        with self._lock:
+            for conn in list(self._connections):
+                self._close(conn)
+            self.conn = None
+
+    def _close(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error closing database connection: {e}")
+        finally:
+            self._connections.discard(conn)
+            logging.info("Database connection closed")
     
     @contextmanager
     def get_cursor(self):
@@ -97,8 +126,50 @@ class DBConnection:
                 cursor.close()
     
     def __del__(self):
-        """Ensure the database connection is closed when the object is deleted."""
-        self.close()
+        """Ensure the database connections are closed when the object is deleted."""
+        self.close_all()
+
+    @contextmanager
+    def reader(self):
+        """
+        Context manager for a dedicated read-only connection, for long reads such as
+        streamed exports.
+
+        The connection is not tied to a thread, so a generator holding it may be resumed
+        from any worker thread. Statements run inside one BEGIN ... COMMIT share a
+        single consistent snapshot.
+        """
+        uri = f"file:{quote(os.path.abspath(self.db_name))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=10.0)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA cache_size = 10000")
+            conn.execute("PRAGMA mmap_size = 30000000000")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def snapshot_readers(self, count: int):
+        """
+        Context manager for several read-only connections that all see the same snapshot,
+        for reading tables in parallel.
+
+        Writers are held off (BEGIN IMMEDIATE on the calling thread's connection) only
+        while each reader opens its read transaction; the readers then keep that
+        snapshot until they are closed.
+        """
+        with ExitStack() as stack:
+            readers: List[sqlite3.Connection] = [stack.enter_context(self.reader()) for _ in range(count)]
+            conn = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for reader in readers:
+                    reader.execute("BEGIN")
+                    reader.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            finally:
+                conn.rollback()
+            yield readers
 
     def check_connection(self) -> bool:
         """Check if the database connection is valid."""
@@ -112,4 +183,19 @@ class DBConnection:
     def reconnect(self):
         """Force a reconnection to the database."""
         self.close()
-        return self.connect() 
\ No newline at end of file
+        return self.connect()
+
+    def checkpoint(self, mode: str = "PASSIVE") -> Dict[str, Any]:
+        """
+        Run a WAL checkpoint.
+
+        Args:
+            mode: PASSIVE, FULL, RESTART or TRUNCATE
+
+        Returns:
+            Dict[str, Any]: Whether the checkpoint was blocked, WAL frames and frames checkpointed
+        """
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Invalid checkpoint mode: {mode}")
+        busy, log_frames, checkpointed = self.connect().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed_frames': checkpointed}
@@ -4,6 +4,18 @@ import logging
 from database.db_connection import DBConnection
 
 
+# Tables whose row changes are tracked for incremental analytics snapshots, with their key columns
+SNAPSHOT_TABLE_KEYS = {
+    'items': ('item_name',),
+    'item_locations': ('id',),
+    'batches': ('id',),
+    'prices': ('item_name', 'supplier'),
+    'stock_adjustments': ('id',),
+    'purchase_orders': ('id',),
+    'purchase_order_items': ('id',),
+}
+
+
 def setup_database():
     """Create necessary database tables if they don't exist."""
     db = DBConnection()
@@ -91,6 +103,111 @@ def setup_database():
                 ON price_history(item_name, timestamp DESC)
             """)
 
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_price_history_timestamp
+                ON price_history(timestamp)
+            """)
+
+            # Serves "latest price <= timestamp" lookups per item and supplier
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_price_history_item_supplier
+                ON price_history(item_name, COALESCE(supplier, 'default'), timestamp)
+            """)
+
+            # Create daily price aggregates table (compacted price history)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_history_daily (
+                    item_name TEXT NOT NULL,
+                    supplier TEXT NOT NULL DEFAULT 'default',
+                    day DATE NOT NULL,
+                    open_price REAL NOT NULL,
+                    high_price REAL NOT NULL,
+                    low_price REAL NOT NULL,
+                    close_price REAL NOT NULL,
+                    avg_price REAL NOT NULL,
+                    sample_count INTEGER NOT NULL DEFAULT 0,
+                    first_timestamp DATETIME NOT NULL,
+                    last_timestamp DATETIME NOT NULL,
+                    close_quantity INTEGER,
+                    PRIMARY KEY (item_name, supplier, day)
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_price_history_daily_item_day
+                ON price_history_daily(item_name, day DESC)
+            """)
+
+            # Create per-item price summary table (maintained by triggers on prices)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_summary (
+                    item_name TEXT PRIMARY KEY,
+                    min_price REAL NOT NULL,
+                    max_price REAL NOT NULL,
+                    avg_price REAL NOT NULL,
+                    price_total REAL NOT NULL,
+                    price_count INTEGER NOT NULL,
+                    cheapest_supplier TEXT NOT NULL
+                )
+            """)
+
+            # Keep price_summary in step with prices; each change only
+            # re-aggregates the affected item's supplier rows
+            summary_refresh = """
+                INSERT OR REPLACE INTO price_summary (
+                    item_name, min_price, max_price, avg_price,
+                    price_total, price_count, cheapest_supplier
+                )
+                SELECT p.item_name, MIN(p.price), MAX(p.price), AVG(p.price),
+                       SUM(p.price), COUNT(*),
+                       (SELECT supplier FROM prices c
+                        WHERE c.item_name = p.item_name
+                        ORDER BY c.price, c.supplier LIMIT 1)
+                FROM prices p
+                WHERE p.item_name IN ({items})
+                GROUP BY p.item_name;
+            """
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_price_summary_insert
+                AFTER INSERT ON prices
+                BEGIN
+                    {summary_refresh.format(items='NEW.item_name')}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_price_summary_update
+                AFTER UPDATE OF item_name, price, supplier ON prices
+                BEGIN
+                    DELETE FROM price_summary WHERE item_name = OLD.item_name;
+                    {summary_refresh.format(items='OLD.item_name, NEW.item_name')}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_price_summary_delete
+                AFTER DELETE ON prices
+                BEGIN
+                    DELETE FROM price_summary WHERE item_name = OLD.item_name;
+                    {summary_refresh.format(items='OLD.item_name')}
+                END
+            """)
+
+            # Backfill the summary for databases created before it existed
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM price_summary)")
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("""
+                    INSERT INTO price_summary (
+                        item_name, min_price, max_price, avg_price,
+                        price_total, price_count, cheapest_supplier
+                    )
+                    SELECT p.item_name, MIN(p.price), MAX(p.price), AVG(p.price),
+                           SUM(p.price), COUNT(*),
+                           (SELECT supplier FROM prices c
+                            WHERE c.item_name = p.item_name
+                            ORDER BY c.price, c.supplier LIMIT 1)
+                    FROM prices p
+                    GROUP BY p.item_name
+                """)
+
             # Create suppliers table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS suppliers (
@@ -276,6 +393,18 @@ def setup_database():
                 ON batches(status)
             """)
 
+            # Index for first-expired-first-out picking of active batches per item and location
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_batches_fefo
+                ON batches(item_name, location_id, status, expiry_date)
+            """)
+
+            # Index for the expiry sweep's scan of batches changed since its last run
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_batches_updated
+                ON batches(updated_at)
+            """)
+
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_stock_adjustments_item
                 ON stock_adjustments(item_name)
@@ -296,6 +425,358 @@ def setup_database():
                 ON alerts(alert_type)
             """)
 
+            # Add severity_rank to alerts (virtual column so the severity ordering can be indexed)
+            cursor.execute("""
+                SELECT COUNT(*) FROM pragma_table_xinfo('alerts')
+                WHERE name='severity_rank'
+            """)
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("""
+                    ALTER TABLE alerts ADD COLUMN severity_rank INTEGER
+                    GENERATED ALWAYS AS (
+                        CASE severity
+                            WHEN 'critical' THEN 1
+                            WHEN 'high' THEN 2
+                            WHEN 'medium' THEN 3
+                            WHEN 'low' THEN 4
+                            ELSE 5
+                        END
+                    ) VIRTUAL
+                """)
+                logging.info("Added severity_rank column to alerts table")
+
+            # Index for keyset pagination of alerts (open first, most severe first, newest first)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alerts_page
+                ON alerts(is_resolved, severity_rank, created_at DESC, id DESC)
+            """)
+
+            # Create alert_counters table (alert counts per type, severity and state, kept by triggers)
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'alert_counters'
+            """)
+            backfill_alert_counters = cursor.fetchone() is None
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS alert_counters (
+                    alert_type TEXT NOT NULL,
+                    severity TEXT NOT NULL,
+                    is_read INTEGER NOT NULL,
+                    is_resolved INTEGER NOT NULL,
+                    alert_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (alert_type, severity, is_read, is_resolved)
+                ) WITHOUT ROWID
+            """)
+
+            alert_counter_bump = """
+                INSERT INTO alert_counters (alert_type, severity, is_read, is_resolved, alert_count)
+                VALUES ({row}.alert_type, COALESCE({row}.severity, 'medium'),
+                        COALESCE({row}.is_read, 0), COALESCE({row}.is_resolved, 0), {delta})
+                ON CONFLICT(alert_type, severity, is_read, is_resolved)
+                DO UPDATE SET alert_count = alert_count + excluded.alert_count;
+            """
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_alert_counters_insert
+                AFTER INSERT ON alerts
+                BEGIN
+                    {alert_counter_bump.format(row='NEW', delta=1)}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_alert_counters_update
+                AFTER UPDATE OF alert_type, severity, is_read, is_resolved ON alerts
+                BEGIN
+                    {alert_counter_bump.format(row='OLD', delta=-1)}
+                    {alert_counter_bump.format(row='NEW', delta=1)}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_alert_counters_delete
+                AFTER DELETE ON alerts
+                BEGIN
+                    {alert_counter_bump.format(row='OLD', delta=-1)}
+                END
+            """)
+
+            if backfill_alert_counters:
+                cursor.execute("""
+                    INSERT INTO alert_counters (alert_type, severity, is_read, is_resolved, alert_count)
+                    SELECT alert_type, COALESCE(severity, 'medium'), COALESCE(is_read, 0),
+                           COALESCE(is_resolved, 0), COUNT(*)
+                    FROM alerts
+                    GROUP BY 1, 2, 3, 4
+                """)
+
+            # Index for checking open alerts per batch when generating expiry alerts
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alerts_batch
+                ON alerts(batch_id, alert_type, is_resolved)
+            """)
+
+            # Create job_watermarks table (progress markers for incremental background jobs)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS job_watermarks (
+                    job_name TEXT PRIMARY KEY,
+                    watermark TEXT NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create scheduled_jobs table (next due time and single-runner lease per scheduled job)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                    job_name TEXT PRIMARY KEY,
+                    schedule TEXT NOT NULL,
+                    next_run_at DATETIME NOT NULL,
+                    lease_owner TEXT,
+                    lease_until DATETIME,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create job_runs table (run history and timings of scheduled jobs)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_name TEXT NOT NULL,
+                    runner TEXT NOT NULL,
+                    status TEXT CHECK(status IN ('running', 'success', 'failed')) NOT NULL,
+                    started_at DATETIME NOT NULL,
+                    finished_at DATETIME,
+                    duration_ms REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_job_runs_job_started
+                ON job_runs(job_name, started_at DESC)
+            """)
+
+            # Create background_jobs table (long-running work submitted through the API,
+            # with progress, heartbeat and a resume checkpoint)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS background_jobs (
+                    id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    status TEXT CHECK(status IN ('queued', 'running', 'completed', 'failed', 'cancelled'))
+                        NOT NULL DEFAULT 'queued',
+                    params TEXT,
+                    user_name TEXT,
+                    runner TEXT,
+                    heartbeat_at DATETIME,
+                    cancel_requested INTEGER DEFAULT 0,
+                    attempts INTEGER DEFAULT 0,
+                    progress_done INTEGER DEFAULT 0,
+                    progress_total INTEGER,
+                    rows_processed INTEGER DEFAULT 0,
+                    rows_failed INTEGER DEFAULT 0,
+                    eta_seconds REAL,
+                    checkpoint TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    started_at DATETIME,
+                    finished_at DATETIME,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_background_jobs_status
+                ON background_jobs(status, heartbeat_at)
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_background_jobs_user
+                ON background_jobs(user_name, created_at DESC)
+            """)
+
+            # Create uploads table (resumable chunked uploads spooled to disk)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    file_format TEXT,
+                    path TEXT NOT NULL,
+                    status TEXT CHECK(status IN ('uploading', 'complete', 'failed', 'aborted'))
+                        NOT NULL DEFAULT 'uploading',
+                    received_bytes INTEGER NOT NULL DEFAULT 0,
+                    total_size INTEGER,
+                    expected_sha256 TEXT,
+                    sha256 TEXT,
+                    user_name TEXT,
+                    job_id TEXT,
+                    error TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_uploads_status
+                ON uploads(status, updated_at)
+            """)
+
+            # At most one open item-level alert per item and type. Older open duplicates are
+            # resolved first so the index can be built on existing databases.
+            cursor.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_alerts_open_item'
+            """)
+            if not cursor.fetchone():
+                cursor.execute("""
+                    UPDATE alerts
+                    SET is_resolved = 1, resolved_by = 'system', resolved_at = datetime('now')
+                    WHERE is_resolved = 0 AND batch_id IS NULL AND item_name IS NOT NULL
+                      AND id NOT IN (
+                          SELECT MAX(id) FROM alerts
+                          WHERE is_resolved = 0 AND batch_id IS NULL AND item_name IS NOT NULL
+                          GROUP BY item_name, alert_type
+                      )
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX idx_alerts_open_item
+                    ON alerts(item_name, alert_type)
+                    WHERE is_resolved = 0 AND batch_id IS NULL
+                """)
+
+            # Create reorder_check_queue table (items whose stock or reorder level changed
+            # since the last reorder check)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reorder_check_queue (
+                    item_name TEXT PRIMARY KEY
+                ) WITHOUT ROWID
+            """)
+
+            # The queue triggers use ON CONFLICT DO NOTHING rather than INSERT OR IGNORE: an
+            # upsert on items imposes its own conflict policy on trigger statements, which
+            # turns OR IGNORE into an abort. Replace triggers created the old way.
+            cursor.execute("""
+                SELECT name FROM sqlite_master
+                WHERE type = 'trigger' AND name IN ('trg_reorder_queue_insert', 'trg_reorder_queue_update')
+                  AND sql LIKE '%INSERT OR IGNORE%'
+            """)
+            for row in cursor.fetchall():
+                cursor.execute(f"DROP TRIGGER {row['name']}")
+
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_reorder_queue_insert
+                AFTER INSERT ON items
+                BEGIN
+                    INSERT INTO reorder_check_queue (item_name) VALUES (NEW.item_name)
+                    ON CONFLICT DO NOTHING;
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_reorder_queue_update
+                AFTER UPDATE OF quantity, reorder_level ON items
+                WHEN OLD.quantity IS NOT NEW.quantity OR OLD.reorder_level IS NOT NEW.reorder_level
+                BEGIN
+                    INSERT INTO reorder_check_queue (item_name) VALUES (NEW.item_name)
+                    ON CONFLICT DO NOTHING;
+                END
+            """)
+
+            # Raise a reorder alert as soon as an item drops to its reorder level, keep its
+            # severity current while it stays there, and resolve it once stock recovers
+            reorder_alert_raise = """
+                INSERT INTO alerts (alert_type, severity, item_name, message)
+                VALUES ('reorder', {severity}, NEW.item_name, {message})
+                ON CONFLICT(item_name, alert_type) WHERE is_resolved = 0 AND batch_id IS NULL
+                DO UPDATE SET severity = excluded.severity, message = excluded.message;
+            """.format(
+                severity="""CASE
+                    WHEN NEW.quantity = 0 THEN 'critical'
+                    WHEN NEW.quantity * 2 < NEW.reorder_level THEN 'high'
+                    ELSE 'medium'
+                END""",
+                message="""'Item ' || NEW.item_name || ' is at ' || NEW.quantity
+                    || ' units (reorder level: ' || NEW.reorder_level || ')'"""
+            )
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_reorder_alert_insert
+                AFTER INSERT ON items
+                WHEN NEW.quantity <= NEW.reorder_level
+                BEGIN
+                    {reorder_alert_raise}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_reorder_alert_low
+                AFTER UPDATE OF quantity, reorder_level ON items
+                WHEN NEW.quantity <= NEW.reorder_level
+                 AND (OLD.quantity IS NOT NEW.quantity OR OLD.reorder_level IS NOT NEW.reorder_level)
+                BEGIN
+                    {reorder_alert_raise}
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_reorder_alert_recovered
+                AFTER UPDATE OF quantity, reorder_level ON items
+                WHEN OLD.quantity <= OLD.reorder_level
+                 AND (NEW.reorder_level IS NULL OR NEW.quantity > NEW.reorder_level)
+                BEGIN
+                    UPDATE alerts
+                    SET is_resolved = 1, resolved_by = 'system', resolved_at = datetime('now')
+                    WHERE item_name = NEW.item_name AND alert_type = 'reorder'
+                      AND is_resolved = 0 AND batch_id IS NULL;
+                END
+            """)
+
+            # Create data_versions table (change counters kept by triggers; cached exports
+            # built at an older version are stale). Updates that change nothing keep the version.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    scope TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                INSERT INTO data_versions (scope, version) VALUES ('items', 0)
+                ON CONFLICT DO NOTHING
+            """)
+
+            items_version_bump = "UPDATE data_versions SET version = version + 1 WHERE scope = 'items';"
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_items_version_insert
+                AFTER INSERT ON items
+                BEGIN
+                    {items_version_bump}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_items_version_update
+                AFTER UPDATE OF item_name, quantity, group_name, reorder_level, reorder_quantity, custom_fields
+                ON items
+                WHEN OLD.item_name IS NOT NEW.item_name OR OLD.quantity IS NOT NEW.quantity
+                  OR OLD.group_name IS NOT NEW.group_name OR OLD.reorder_level IS NOT NEW.reorder_level
+                  OR OLD.reorder_quantity IS NOT NEW.reorder_quantity OR OLD.custom_fields IS NOT NEW.custom_fields
+                BEGIN
+                    {items_version_bump}
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_items_version_delete
+                AFTER DELETE ON items
+                BEGIN
+                    {items_version_bump}
+                END
+            """)
+
+            # Create export_cache table (generated export files on disk, evicted least
+            # recently used first)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS export_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    data_version INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
             # Create notes/comments table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS notes (
@@ -438,6 +919,17 @@ def setup_database():
                 ON purchase_orders(order_date DESC)
             """)
 
+            # Keyset pagination of the purchase order list, newest first, optionally by status
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_purchase_orders_created
+                ON purchase_orders(created_at DESC, id DESC)
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_purchase_orders_status_created
+                ON purchase_orders(status, created_at DESC, id DESC)
+            """)
+
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_purchase_order_items_po
                 ON purchase_order_items(po_id)
@@ -448,6 +940,24 @@ def setup_database():
                 ON purchase_order_items(item_name)
             """)
 
+            # Create idempotency_keys table (stored responses of write requests sent with an
+            # Idempotency-Key header, so a retried request is answered without running again)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope TEXT NOT NULL,
+                    idempotency_key TEXT NOT NULL,
+                    request_hash TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (scope, idempotency_key)
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+                ON idempotency_keys(created_at)
+            """)
+
             # Create audit_log table (for tracking all important actions)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS audit_log (
@@ -493,6 +1003,74 @@ def setup_database():
                 ON audit_log(action_type)
             """)
 
+            # Create snapshot_changes table (keys of rows changed since the last analytics
+            # snapshot, kept by triggers). change_seq stays NULL until a snapshot claims the change.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS snapshot_changes (
+                    table_name TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    change_seq INTEGER,
+                    deleted INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (table_name, row_key)
+                ) WITHOUT ROWID
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_snapshot_changes_seq
+                ON snapshot_changes(table_name, change_seq)
+            """)
+
+            snapshot_change = """
+                INSERT INTO snapshot_changes (table_name, row_key, deleted)
+                SELECT '{table}', {key}, {deleted} WHERE {condition}
+                ON CONFLICT(table_name, row_key) DO UPDATE SET change_seq = NULL, deleted = excluded.deleted
+                WHERE change_seq IS NOT NULL OR deleted <> excluded.deleted;
+            """
+            for table, key_columns in SNAPSHOT_TABLE_KEYS.items():
+                old_key = f"json_array({', '.join(f'OLD.{column}' for column in key_columns)})"
+                new_key = f"json_array({', '.join(f'NEW.{column}' for column in key_columns)})"
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_snapshot_insert
+                    AFTER INSERT ON {table}
+                    BEGIN
+                        {snapshot_change.format(table=table, key=new_key, deleted=0, condition='1')}
+                    END
+                """)
+                # A changed key is a delete of the old key plus an insert of the new one
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_snapshot_update
+                    AFTER UPDATE ON {table}
+                    BEGIN
+                        {snapshot_change.format(table=table, key=old_key, deleted=1,
+                                                condition=f'{old_key} IS NOT {new_key}')}
+                        {snapshot_change.format(table=table, key=new_key, deleted=0, condition='1')}
+                    END
+                """)
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_snapshot_delete
+                    AFTER DELETE ON {table}
+                    BEGIN
+                        {snapshot_change.format(table=table, key=old_key, deleted=1, condition='1')}
+                    END
+                """)
+
+            # Create snapshot_exports table (analytics snapshots and the changes each one covers)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS snapshot_exports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT CHECK(kind IN ('full', 'incremental')) NOT NULL,
+                    file_format TEXT NOT NULL,
+                    since_id INTEGER,
+                    status TEXT CHECK(status IN ('running', 'completed', 'failed')) NOT NULL DEFAULT 'running',
+                    path TEXT,
+                    tables TEXT,
+                    error TEXT,
+                    created_by TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    finished_at DATETIME
+                )
+            """)
+
             # Add coordinates to locations for distance calculations
             cursor.execute("""
                 SELECT COUNT(*) FROM pragma_table_info('locations')
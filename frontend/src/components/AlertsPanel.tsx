@@ -53,11 +53,13 @@ const AlertsPanel: React.FC = () => {
 
   const fetchAlerts = async () => {
     try {
-      const data = await apiService.getAlerts({ unread_only: false });
-      // Ensure data is an array
-      const alertsArray = Array.isArray(data) ? data : [];
-      setAlerts(alertsArray);
-      setUnreadCount(alertsArray.filter((alert: AlertType) => !alert.is_read && !alert.is_resolved).length);
+      // The list is one page of alerts; the badge comes from the trigger-maintained counters
+      const [data, summary] = await Promise.all([
+        apiService.getAlerts({ unread_only: false }),
+        apiService.getAlertSummary(),
+      ]);
+      setAlerts(Array.isArray(data?.alerts) ? data.alerts : []);
+      setUnreadCount(summary?.unread_total ?? 0);
     } catch (err) {
       console.error('Failed to fetch alerts:', err);
       setAlerts([]);
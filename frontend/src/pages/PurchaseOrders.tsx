@@ -41,6 +41,7 @@ import { apiService } from '../services/api';
 import { getErrorMessage } from '../utils/validationSchemas';
 
 interface PurchaseOrderItem {
+  id?: number;
   item_name: string;
   quantity: number;
   unit_price: number;
@@ -84,6 +85,16 @@ interface InventoryItem {
   item_name: string;
 }
 
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost); over plain HTTP
+// on a LAN host fall back to 128 random bits from crypto.getRandomValues
+const newIdempotencyKey = (): string => {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
 const PurchaseOrders: React.FC = () => {
   const [purchaseOrders, setPurchaseOrders] = useState<PurchaseOrder[]>([]);
   const [suppliers, setSuppliers] = useState<Supplier[]>([]);
@@ -114,6 +125,8 @@ const PurchaseOrders: React.FC = () => {
   // Receive PO Dialog
   const [receiveDialogOpen, setReceiveDialogOpen] = useState(false);
   const [receiveItems, setReceiveItems] = useState<any[]>([]);
+  // One key per receive dialog, so a retried or double-submitted receipt is only applied once
+  const [receiveKey, setReceiveKey] = useState<string>('');
 
   const fetchPurchaseOrders = useCallback(async () => {
     setLoading(true);
@@ -123,7 +136,7 @@ const PurchaseOrders: React.FC = () => {
         statusFilter || undefined,
         supplierFilter ? parseInt(supplierFilter) : undefined
       );
-      setPurchaseOrders(data);
+      setPurchaseOrders(data.purchase_orders);
     } catch (err: any) {
       setError(getErrorMessage(err));
     } finally {
@@ -244,12 +257,14 @@ const PurchaseOrders: React.FC = () => {
     if (po.items) {
       setReceiveItems(
         po.items.map((item) => ({
+          po_item_id: item.id,
           item_name: item.item_name,
           ordered_quantity: item.quantity,
           received_quantity: item.received_quantity || 0,
           quantity_to_receive: item.quantity - (item.received_quantity || 0),
         }))
       );
+      setReceiveKey(newIdempotencyKey());
       setSelectedPO(po);
       setReceiveDialogOpen(true);
     }
@@ -260,7 +275,14 @@ const PurchaseOrders: React.FC = () => {
 
     try {
       setLoading(true);
-      await apiService.receivePurchaseOrder(selectedPO.id, receiveItems);
+      const items = receiveItems
+        .filter((item) => item.quantity_to_receive > 0)
+        .map((item) => ({
+          po_item_id: item.po_item_id,
+          item_name: item.item_name,
+          quantity: item.quantity_to_receive,
+        }));
+      await apiService.receivePurchaseOrder(selectedPO.id, items, receiveKey);
       setSuccess('Items received successfully');
       setReceiveDialogOpen(false);
       fetchPurchaseOrders();
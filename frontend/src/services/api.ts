@@ -287,8 +287,17 @@ export class ApiService {
 
     async exportToPDF(groups?: string[]): Promise<Blob> {
         const params = groups ? { groups: groups.join(',') } : {};
-        const response = await this.api.get('/export/pdf', {
-            params,
+        // Rendered as a background job: queue it, wait for it, then download the file
+        const queued = await this.api.post('/export/pdf', null, { params });
+        let job = queued.data;
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            job = (await this.api.get(`/jobs/${job.id}`)).data;
+        }
+        if (job.status !== 'completed') {
+            throw new Error(job.error || `PDF export ${job.status}`);
+        }
+        const response = await this.api.get(queued.data.download_url, {
             responseType: 'blob'
         });
         return response.data;
@@ -378,6 +387,11 @@ export class ApiService {
         return response.data;
     }
 
+    async getAlertSummary(): Promise<any> {
+        const response = await this.api.get('/alerts/summary');
+        return response.data;
+    }
+
     async updateAlert(alertId: number, updates: any): Promise<any> {
         const response = await this.api.put(`/alerts/${alertId}`, updates);
         return response.data;
@@ -476,8 +490,9 @@ export class ApiService {
         return response.data;
     }
 
-    async receivePurchaseOrder(poId: number, items: any[]): Promise<any> {
-        const response = await this.api.post(`/purchase-orders/${poId}/receive`, { items });
+    async receivePurchaseOrder(poId: number, items: any[], idempotencyKey?: string): Promise<any> {
+        const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined;
+        const response = await this.api.post(`/purchase-orders/${poId}/receive`, { items }, { headers });
         return response.data;
     }
 
@@ -28,12 +28,12 @@ def main():
     # Start backend
     if platform.system() == "Windows":
         backend = subprocess.Popen(
-            ["python", "api.py"],
+            ["python", "-m", "uvicorn", "api:app", "--host", "0.0.0.0", "--port", "8001"],
             creationflags=subprocess.CREATE_NEW_CONSOLE
         )
     else:
         backend = subprocess.Popen(
-            ["python3", "api.py"],
+            ["python3", "-m", "uvicorn", "api:app", "--host", "0.0.0.0", "--port", "8001"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
@@ -0,0 +1,199 @@
+# services/alert_service.py
+
+import logging
+from typing import Dict, Any, Optional
+
+from database.db_connection import DBConnection
+from utils.pagination import encode_cursor, decode_cursor
+
+
+SEVERITIES = ('critical', 'high', 'medium', 'low')
+
+
+class AlertService:
+    """Service class for generating and querying alerts."""
+
+    def __init__(self):
+        """Initialize the alert service."""
+        self.db = DBConnection()
+
+    def check_reorder_levels(self, incremental: bool = False) -> Dict[str, Any]:
+        """
+        Raise reorder alerts for items at or below their reorder level.
+
+        Triggers on items already raise and resolve these alerts as quantities change; this
+        is a catch-up for data written before the triggers existed or with them bypassed.
+
+        Alerts are written with a single INSERT ... SELECT; items that already have an open
+        reorder alert are skipped by the idx_alerts_open_item partial unique index.
+
+        Args:
+            incremental: Only evaluate items whose quantity or reorder level changed since
+                the last check (tracked in reorder_check_queue by triggers on items)
+
+        Returns:
+            Dict[str, Any]: Number of alerts created and items evaluated
+        """
+        source = "reorder_check_queue q JOIN items i ON i.item_name = q.item_name" if incremental else "items i"
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+
+            if incremental:
+                cursor.execute("SELECT COUNT(*) FROM reorder_check_queue")
+            else:
+                cursor.execute("SELECT COUNT(*) FROM items")
+            items_checked = cursor.fetchone()[0]
+
+            cursor.execute(f"""
+                INSERT INTO alerts (alert_type, severity, item_name, message)
+                SELECT 'reorder',
+                       CASE
+                           WHEN i.quantity = 0 THEN 'critical'
+                           WHEN i.quantity * 2 < i.reorder_level THEN 'high'
+                           ELSE 'medium'
+                       END,
+                       i.item_name,
+                       'Item ' || i.item_name || ' is at ' || i.quantity
+                           || ' units (reorder level: ' || i.reorder_level || ')'
+                FROM {source}
+                WHERE i.reorder_level IS NOT NULL AND i.quantity <= i.reorder_level
+                ON CONFLICT(item_name, alert_type) WHERE is_resolved = 0 AND batch_id IS NULL
+                DO NOTHING
+            """)
+            alerts_created = cursor.rowcount
+
+            # Everything queued has now been evaluated
+            cursor.execute("DELETE FROM reorder_check_queue")
+
+        logging.info(f"Reorder check ({'incremental' if incremental else 'full'}): "
+                     f"{alerts_created} alerts from {items_checked} items")
+        return {
+            'alerts_created': alerts_created,
+            'items_checked': items_checked,
+            'incremental': incremental
+        }
+
+    def list_alerts(self, limit: int = 50, cursor: Optional[str] = None, unread_only: bool = False,
+                    alert_type: Optional[str] = None, resolved: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Page through alerts with a keyset cursor: open before resolved, then most severe, then newest.
+
+        The order matches idx_alerts_page, so each page is an index range scan no matter how
+        deep into the list it is.
+
+        Args:
+            limit: Page size
+            cursor: next_cursor from the previous page, None for the first page
+            unread_only: Only alerts that have not been read
+            alert_type: Only alerts of this type
+            resolved: Only resolved (True) or open (False) alerts
+
+        Returns:
+            Dict[str, Any]: The page of alerts and the cursor for the next page (None at the end)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        filters = []
+        filter_params = []
+
+        if unread_only:
+            filters.append("is_read = 0")
+        if alert_type:
+            filters.append("alert_type = ?")
+            filter_params.append(alert_type)
+        if resolved is not None:
+            filters.append("is_resolved = ?")
+            filter_params.append(1 if resolved else 0)
+
+        columns = """
+            id, alert_type, severity, item_name, location_id, batch_id, message,
+            is_read, is_resolved, resolved_by, resolved_at, created_at, severity_rank
+        """
+        order = "ORDER BY is_resolved, severity_rank, created_at DESC, id DESC"
+
+        if cursor:
+            is_resolved, severity_rank, created_at, alert_id = decode_cursor(cursor, 4)
+            # Rows after the cursor, as three index range seeks: the rest of the cursor's
+            # (is_resolved, severity) group, the less severe groups, then the resolved side
+            branches = [
+                ("is_resolved = ? AND severity_rank = ? AND (created_at, id) < (?, ?)",
+                 [is_resolved, severity_rank, created_at, alert_id]),
+                ("is_resolved = ? AND severity_rank > ?", [is_resolved, severity_rank]),
+                ("is_resolved > ?", [is_resolved])
+            ]
+            parts = []
+            params = []
+            for condition, condition_params in branches:
+                where_clause = " AND ".join([condition] + filters)
+                parts.append(f"SELECT * FROM (SELECT {columns} FROM alerts WHERE {where_clause} {order} LIMIT ?)")
+                params.extend(condition_params + filter_params + [limit + 1])
+            query = f"{' UNION ALL '.join(parts)} {order} LIMIT ?"
+            params.append(limit + 1)
+        else:
+            where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
+            query = f"SELECT {columns} FROM alerts {where_clause} {order} LIMIT ?"
+            params = filter_params + [limit + 1]
+
+        with self.db.get_cursor() as db_cursor:
+            db_cursor.execute(query, params)
+            rows = db_cursor.fetchall()
+
+        alerts = []
+        for row in rows[:limit]:
+            alerts.append({
+                "id": row['id'],
+                "alert_type": row['alert_type'],
+                "severity": row['severity'],
+                "item_name": row['item_name'],
+                "location_id": row['location_id'],
+                "batch_id": row['batch_id'],
+                "message": row['message'],
+                "is_read": bool(row['is_read']),
+                "is_resolved": bool(row['is_resolved']),
+                "resolved_by": row['resolved_by'],
+                "resolved_at": row['resolved_at'],
+                "created_at": row['created_at']
+            })
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor([last['is_resolved'], last['severity_rank'], last['created_at'], last['id']])
+
+        return {"alerts": alerts, "count": len(alerts), "next_cursor": next_cursor}
+
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        Alert counts for the notification badge, read from alert_counters.
+
+        The counters are maintained by triggers on alerts, so this reads a handful of rows
+        regardless of how many alerts exist.
+
+        Returns:
+            Dict[str, Any]: Unread and open counts by severity, and open counts by type
+        """
+        unread = {severity: 0 for severity in SEVERITIES}
+        open_alerts = {severity: 0 for severity in SEVERITIES}
+        by_type: Dict[str, int] = {}
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT alert_type, severity, is_read, alert_count
+                FROM alert_counters
+                WHERE is_resolved = 0 AND alert_count > 0
+            """)
+            for row in cursor.fetchall():
+                open_alerts[row['severity']] = open_alerts.get(row['severity'], 0) + row['alert_count']
+                by_type[row['alert_type']] = by_type.get(row['alert_type'], 0) + row['alert_count']
+                if not row['is_read']:
+                    unread[row['severity']] = unread.get(row['severity'], 0) + row['alert_count']
+
+        return {
+            "unread": unread,
+            "unread_total": sum(unread.values()),
+            "open": open_alerts,
+            "open_total": sum(open_alerts.values()),
+            "open_by_type": by_type
+        }
@@ -0,0 +1,318 @@
+# services/batch_service.py
+
+import json
+import logging
+import sqlite3
+from datetime import date, timedelta
+from typing import List, Dict, Any, Optional
+
+from database.db_connection import DBConnection
+
+
+# Batches expiring within this many days get an expiring_soon alert
+EXPIRY_WARNING_DAYS = 30
+
+# job_watermarks key for the expiry sweeper
+EXPIRY_SWEEP_JOB = 'expiry_sweep'
+
+
+class InsufficientBatchStock(ValueError):
+    """Raised when active batches cannot cover a requested quantity."""
+
+    def __init__(self, item_name: str, requested: int, available: int):
+        self.item_name = item_name
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Insufficient batch stock for {item_name}: requested {requested}, available {available}"
+        )
+
+
+class BatchAllocationConflict(RuntimeError):
+    """Raised when a batch changed between being read and being drawn down."""
+
+
+class BatchService:
+    """Service class for batch/lot allocation."""
+
+    def __init__(self):
+        """Initialize the batch service."""
+        self.db = DBConnection()
+
+    def allocate_fefo(self, item_name: str, quantity: int, location_id: Optional[int] = None,
+                      allow_partial: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Draw a quantity down from active batches, first-expired-first-out, in one transaction.
+
+        Args:
+            item_name: Item to pick
+            quantity: Units to take
+            location_id: Only draw from batches at this location (all locations if None)
+            allow_partial: Take what is available instead of failing when batches run short
+            dry_run: Only plan the allocation; batches are left untouched
+
+        Returns:
+            Dict[str, Any]: Allocations per batch and any unallocated remainder
+
+        Raises:
+            InsufficientBatchStock: If batches cannot cover the quantity and allow_partial is False
+            BatchAllocationConflict: If a batch was changed concurrently; nothing is written
+        """
+        with self.db.get_cursor() as cursor:
+            return self.allocate_fefo_in(cursor, item_name, quantity, location_id, allow_partial, dry_run)
+
+    def allocate_fefo_in(self, cursor: sqlite3.Cursor, item_name: str, quantity: int,
+                         location_id: Optional[int] = None, allow_partial: bool = False,
+                         dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Same as allocate_fefo, but runs inside the caller's transaction.
+
+        If no write transaction is open yet, one is started with BEGIN IMMEDIATE so the
+        batch rows read here cannot be changed by another writer before they are updated.
+        """
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+
+        if not dry_run and not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+
+        # Running totals in expiry order; only the batches needed to reach the quantity are kept.
+        # Batches without an expiry date go last; batches already past expiry are never picked.
+        location_clause = "AND location_id = ?" if location_id is not None else ""
+        params = [item_name] + ([location_id] if location_id is not None else []) + [quantity]
+        cursor.execute(f"""
+            SELECT id, batch_number, location_id, expiry_date, quantity, running_total
+            FROM (
+                SELECT id, batch_number, location_id, expiry_date, quantity,
+                       SUM(quantity) OVER (
+                           ORDER BY expiry_date IS NULL, expiry_date, id
+                           ROWS UNBOUNDED PRECEDING
+                       ) AS running_total
+                FROM batches
+                WHERE item_name = ? {location_clause}
+                  AND status = 'active'
+                  AND quantity > 0
+                  AND (expiry_date IS NULL OR expiry_date >= date('now'))
+            )
+            WHERE running_total - quantity < ?
+            ORDER BY expiry_date IS NULL, expiry_date, id
+        """, params)
+
+        allocations = []
+        remaining = quantity
+        for row in cursor.fetchall():
+            take = min(row['quantity'], remaining)
+            allocations.append({
+                'batch_id': row['id'],
+                'batch_number': row['batch_number'],
+                'location_id': row['location_id'],
+                'expiry_date': row['expiry_date'],
+                'quantity': take,
+                'remaining_in_batch': row['quantity'] - take
+            })
+            remaining -= take
+
+        if remaining > 0 and not allow_partial:
+            raise InsufficientBatchStock(item_name, quantity, quantity - remaining)
+
+        if allocations and not dry_run:
+            # Guarded decrement: a batch that changed since it was read fails the whole pick
+            cursor.executemany("""
+                UPDATE batches
+                SET quantity = quantity - :quantity,
+                    status = CASE WHEN quantity = :quantity THEN 'sold_out' ELSE status END,
+                    updated_at = datetime('now')
+                WHERE id = :batch_id AND status = 'active' AND quantity >= :quantity
+            """, allocations)
+            if cursor.rowcount != len(allocations):
+                raise BatchAllocationConflict(f"Batches for {item_name} changed during allocation")
+
+        if not dry_run:
+            logging.info(f"FEFO allocated {quantity - remaining} of {quantity} {item_name} across {len(allocations)} batches")
+        return {
+            'item_name': item_name,
+            'location_id': location_id,
+            'requested': quantity,
+            'allocated': quantity - remaining,
+            'unallocated': remaining,
+            'allocations': allocations
+        }
+
+    def move_allocations_in(self, cursor: sqlite3.Cursor, allocations: List[Dict[str, Any]],
+                            to_location_id: int) -> None:
+        """
+        Re-home allocated batch quantities at another location, inside the caller's transaction.
+
+        Each source batch gets a child batch at the destination numbered
+        "<batch_number>@<location_id>", carrying over its dates, supplier and cost; repeated
+        moves of the same batch to the same location top up that child.
+
+        Raises:
+            ValueError: If the child batch exists but is not active or sold out (e.g. recalled)
+        """
+        if not allocations:
+            return
+        cursor.executemany("""
+            INSERT INTO batches (
+                batch_number, item_name, location_id, quantity, manufacturing_date,
+                expiry_date, received_date, supplier_id, cost_per_unit, status, notes
+            )
+            SELECT batch_number || '@' || :to_location_id, item_name, :to_location_id, :quantity,
+                   manufacturing_date, expiry_date, received_date, supplier_id, cost_per_unit,
+                   'active', 'Transferred from batch ' || batch_number
+            FROM batches WHERE id = :batch_id
+            ON CONFLICT(batch_number) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                status = 'active',
+                updated_at = datetime('now')
+            WHERE batches.status IN ('active', 'sold_out')
+        """, [dict(allocation, to_location_id=to_location_id) for allocation in allocations])
+        # A recalled, quarantined or expired child keeps its status and fails the move
+        if cursor.rowcount != len(allocations):
+            raise ValueError(f"A batch at location {to_location_id} is not active and cannot take transferred stock")
+
+    def sweep_expiries(self, as_of: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Raise expiry alerts and mark expired batches, looking only at what changed since the last sweep.
+
+        The sweep keeps a watermark of the last sweep date, the highest batch id seen and the
+        time the last sweep started. A batch needs attention when its expiry date crossed a
+        threshold in between (found with range scans on idx_batches_expiry), when it was created
+        after the last sweep, or when it was updated since (e.g. set back to active after its
+        expiry date had already passed).
+
+        Args:
+            as_of: Date to sweep up to (defaults to today)
+
+        Returns:
+            Dict[str, Any]: Counts of alerts raised and batches expired, and the new watermark
+        """
+        today = as_of or date.today()
+        warn_until = today + timedelta(days=EXPIRY_WARNING_DAYS)
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT watermark FROM job_watermarks WHERE job_name = ?", (EXPIRY_SWEEP_JOB,))
+            row = cursor.fetchone()
+            if row:
+                watermark = json.loads(row['watermark'])
+                last_date = date.fromisoformat(watermark['date'])
+                last_batch_id = watermark['batch_id']
+                # Watermarks written before updated_at was tracked rescan every batch once
+                last_updated_at = watermark.get('updated_at', '')
+            else:
+                # First sweep: every batch is treated as new
+                last_date, last_batch_id, last_updated_at = date.min, 0, ''
+
+            if last_date > today:
+                return {'alerts_raised': 0, 'batches_expired': 0,
+                        'watermark': {'date': last_date.isoformat(), 'batch_id': last_batch_id,
+                                      'updated_at': last_updated_at}}
+
+            # Same clock and format as the datetime('now') that batch writes stamp into updated_at
+            cursor.execute("SELECT datetime('now')")
+            sweep_started_at = cursor.fetchone()[0]
+
+            last_warn_until = last_date + timedelta(days=EXPIRY_WARNING_DAYS)
+            params = {
+                'today': today.isoformat(),
+                'warn_until': warn_until.isoformat(),
+                'last_date': last_date.isoformat(),
+                'last_warn_until': last_warn_until.isoformat(),
+                'last_batch_id': last_batch_id,
+                'last_updated_at': last_updated_at
+            }
+
+            cursor.execute("DROP TABLE IF EXISTS temp.expiry_sweep")
+            cursor.execute("""
+                CREATE TEMP TABLE expiry_sweep (
+                    batch_id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL
+                )
+            """)
+            # Expired since the last sweep, or new or updated and already expired. The unary + keeps
+            # the planner on the expiry date (rowid, updated_at) range instead of the low-selectivity
+            # status index.
+            cursor.execute("""
+                INSERT OR IGNORE INTO expiry_sweep (batch_id, kind)
+                SELECT id, 'expired' FROM batches
+                WHERE +status = 'active' AND expiry_date >= :last_date AND expiry_date < :today
+                UNION
+                SELECT id, 'expired' FROM batches
+                WHERE id > :last_batch_id AND +status = 'active' AND +expiry_date < :today
+                UNION
+                SELECT id, 'expired' FROM batches
+                WHERE updated_at >= :last_updated_at AND +status = 'active' AND +expiry_date < :today
+            """, params)
+            # Entered the warning window since the last sweep, or new or updated and already inside it
+            cursor.execute("""
+                INSERT OR IGNORE INTO expiry_sweep (batch_id, kind)
+                SELECT id, 'expiring_soon' FROM batches
+                WHERE +status = 'active' AND expiry_date > :last_warn_until
+                  AND expiry_date >= :today AND expiry_date <= :warn_until
+                UNION
+                SELECT id, 'expiring_soon' FROM batches
+                WHERE id > :last_batch_id AND +status = 'active'
+                  AND +expiry_date >= :today AND +expiry_date <= :warn_until
+                UNION
+                SELECT id, 'expiring_soon' FROM batches
+                WHERE updated_at >= :last_updated_at AND +status = 'active'
+                  AND +expiry_date >= :today AND +expiry_date <= :warn_until
+            """, params)
+
+            # One alert per batch and kind; batches that already have an open one are skipped
+            cursor.execute("""
+                INSERT INTO alerts (alert_type, severity, item_name, location_id, batch_id, message)
+                SELECT es.kind,
+                       CASE
+                           WHEN es.kind = 'expired' THEN 'high'
+                           WHEN julianday(b.expiry_date) - julianday(:today) <= 7 THEN 'critical'
+                           WHEN julianday(b.expiry_date) - julianday(:today) <= 14 THEN 'high'
+                           ELSE 'medium'
+                       END,
+                       b.item_name, b.location_id, b.id,
+                       CASE
+                           WHEN es.kind = 'expired' THEN 'Batch ' || b.batch_number || ' expired on ' || b.expiry_date
+                           ELSE 'Batch ' || b.batch_number || ' expires in '
+                                || CAST(julianday(b.expiry_date) - julianday(:today) AS INTEGER) || ' days'
+                       END
+                FROM expiry_sweep es
+                JOIN batches b ON b.id = es.batch_id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM alerts a
+                    WHERE a.batch_id = es.batch_id AND a.alert_type = es.kind AND a.is_resolved = 0
+                )
+            """, params)
+            alerts_raised = cursor.rowcount
+
+            cursor.execute("""
+                UPDATE batches
+                SET status = 'expired', updated_at = datetime('now')
+                WHERE id IN (SELECT batch_id FROM expiry_sweep WHERE kind = 'expired')
+            """)
+            batches_expired = cursor.rowcount
+
+            # An expired batch no longer needs its expiring_soon warning
+            cursor.execute("""
+                UPDATE alerts
+                SET is_resolved = 1, resolved_by = 'expiry_sweep', resolved_at = datetime('now')
+                WHERE alert_type = 'expiring_soon' AND is_resolved = 0
+                  AND batch_id IN (SELECT batch_id FROM expiry_sweep WHERE kind = 'expired')
+            """)
+
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM batches")
+            new_watermark = {'date': today.isoformat(), 'batch_id': max(last_batch_id, cursor.fetchone()[0]),
+                             'updated_at': sweep_started_at}
+            cursor.execute("""
+                INSERT INTO job_watermarks (job_name, watermark) VALUES (?, ?)
+                ON CONFLICT(job_name) DO UPDATE SET watermark = excluded.watermark, updated_at = datetime('now')
+            """, (EXPIRY_SWEEP_JOB, json.dumps(new_watermark)))
+            cursor.execute("DROP TABLE temp.expiry_sweep")
+
+        result = {
+            'alerts_raised': alerts_raised,
+            'batches_expired': batches_expired,
+            'watermark': new_watermark
+        }
+        logging.info(f"Expiry sweep: {result}")
+        return result
@@ -0,0 +1,210 @@
+# services/export_cache_service.py
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from database.db_connection import DBConnection
+
+
+# Generated export files kept for reuse
+EXPORT_CACHE_DIR = "export_cache"
+
+# Total size of cached exports; least recently used files are evicted beyond this
+EXPORT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Files in the cache directory without a cache entry (left by a crash mid-export) are
+# removed once they are this old
+EXPORT_CACHE_ORPHAN_SECONDS = 3600
+
+
+class ExportCacheService:
+    """
+    Disk cache of generated export files, keyed by format, group filter and data version.
+
+    The items data version is a counter bumped by triggers on every change to items, so
+    an entry built at an older version is stale and is replaced on the next export.
+    An export is only cached if the version did not move while it was being generated.
+    """
+
+    def __init__(self, cache_dir: str = EXPORT_CACHE_DIR, max_bytes: int = EXPORT_CACHE_MAX_BYTES):
+        """Initialize the export cache."""
+        self.db = DBConnection()
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(file_format: str, groups: Optional[List[str]]) -> str:
+        """Cache key of an export; the group filter is order-insensitive."""
+        return f"{file_format}:{','.join(sorted(set(groups or [])))}"
+
+    def data_version(self) -> int:
+        """Current items data version."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT version FROM data_versions WHERE scope = 'items'")
+            row = cursor.fetchone()
+        return row['version'] if row else 0
+
+    def create_file(self, suffix: str = "") -> str:
+        """Create an empty file in the cache directory to generate an export into."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.cache_dir)
+        os.close(handle)
+        return path
+
+    def get(self, file_format: str, groups: Optional[List[str]]) -> Optional[str]:
+        """
+        Path of a cached export that is current, or None.
+
+        Args:
+            file_format: Export format ('csv', 'csv.gz', 'xlsx', 'pdf')
+            groups: Group filter of the export
+
+        Returns:
+            Optional[str]: Path of the cached file, or None on a miss
+        """
+        key = self.cache_key(file_format, groups)
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT c.path FROM export_cache c
+                JOIN data_versions v ON v.scope = 'items' AND v.version = c.data_version
+                WHERE c.cache_key = ?
+            """, (key,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("""
+                    UPDATE export_cache SET hits = hits + 1, last_used_at = datetime('now')
+                    WHERE cache_key = ?
+                """, (key,))
+        if row and os.path.exists(row['path']):
+            return row['path']
+        return None
+
+    def put(self, file_format: str, groups: Optional[List[str]], data_version: int, path: str) -> bool:
+        """
+        Add a generated export to the cache.
+
+        Args:
+            file_format: Export format
+            groups: Group filter of the export
+            data_version: Items data version read before the export was generated
+            path: Generated file, created with create_file
+
+        Returns:
+            bool: True if the cache now owns the file; False if it was not cached (the data
+                changed during the export or the file is larger than the cache), in which
+                case the caller still owns it
+        """
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return False
+        key = self.cache_key(file_format, groups)
+        with self._lock:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("SELECT version FROM data_versions WHERE scope = 'items'")
+                row = cursor.fetchone()
+                if (row['version'] if row else 0) != data_version:
+                    return False
+                cursor.execute("SELECT path FROM export_cache WHERE cache_key = ?", (key,))
+                replaced = cursor.fetchone()
+                cursor.execute("""
+                    INSERT INTO export_cache (cache_key, data_version, path, size_bytes)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        data_version = excluded.data_version, path = excluded.path,
+                        size_bytes = excluded.size_bytes, hits = 0,
+                        created_at = datetime('now'), last_used_at = datetime('now')
+                """, (key, data_version, path, size))
+            if replaced and replaced['path'] != path:
+                self._remove(replaced['path'])
+            self._evict(keep=key)
+        return True
+
+    def _evict(self, keep: str) -> None:
+        """Drop stale entries, then least recently used ones until the cache fits its budget."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT c.cache_key, c.path, c.size_bytes, c.data_version = v.version AS is_current
+                FROM export_cache c
+                LEFT JOIN data_versions v ON v.scope = 'items'
+                ORDER BY is_current, c.last_used_at, c.created_at
+            """)
+            entries = cursor.fetchall()
+            total = sum(entry['size_bytes'] for entry in entries)
+            evicted = []
+            for entry in entries:
+                if entry['is_current'] and total <= self.max_bytes:
+                    break
+                if entry['cache_key'] == keep:
+                    continue
+                evicted.append(entry)
+                total -= entry['size_bytes']
+            cursor.executemany("DELETE FROM export_cache WHERE cache_key = ?",
+                               [(entry['cache_key'],) for entry in evicted])
+        for entry in evicted:
+            self._remove(entry['path'])
+        if evicted:
+            logging.info(f"Export cache evicted {len(evicted)} files, {total} bytes remain")
+        self._remove_orphans()
+
+    def _remove_orphans(self) -> None:
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT path FROM export_cache")
+            known = {os.path.abspath(row['path']) for row in cursor.fetchall()}
+        cutoff = time.time() - EXPORT_CACHE_ORPHAN_SECONDS
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and os.path.abspath(entry.path) not in known and entry.stat().st_mtime < cutoff:
+                self._remove(entry.path)
+
+    def link_into(self, source: str, target: str) -> None:
+        """Make target a copy of a cached file (a hard link where the filesystem allows)."""
+        try:
+            os.remove(target)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache entries with their size, version and hit count."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT version FROM data_versions WHERE scope = 'items'")
+            row = cursor.fetchone()
+            cursor.execute("""
+                SELECT cache_key, data_version, size_bytes, hits, created_at, last_used_at
+                FROM export_cache ORDER BY last_used_at DESC
+            """)
+            entries = [dict(entry) for entry in cursor.fetchall()]
+        return {
+            'data_version': row['version'] if row else 0,
+            'total_bytes': sum(entry['size_bytes'] for entry in entries),
+            'max_bytes': self.max_bytes,
+            'entries': entries
+        }
+
+    def clear(self) -> Dict[str, int]:
+        """Remove every cached export."""
+        with self._lock:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("SELECT path FROM export_cache")
+                paths = [row['path'] for row in cursor.fetchall()]
+                cursor.execute("DELETE FROM export_cache")
+            for path in paths:
+                self._remove(path)
+        return {'removed': len(paths)}
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove cached export {path}: {e}")
@@ -0,0 +1,431 @@
+# services/export_service.py
+
+import csv
+import importlib.util
+import io
+import json
+import logging
+import os
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from database.db_connection import DBConnection
+from services.export_cache_service import ExportCacheService
+from services.job_service import JobContext, JobInterrupted, JobService
+from utils.process_pool import SpawnProcessPool
+
+
+# Rows fetched and written per chunk of a streamed export
+EXPORT_CHUNK_ROWS = 5000
+
+INVENTORY_CSV_COLUMNS = ['item_name', 'quantity', 'group_name', 'custom_fields']
+
+# Spreadsheet headers; they read back through the importer's header mapping
+INVENTORY_EXCEL_HEADERS = ["Item Name", "Quantity", "Group", "Reorder Level", "Reorder Quantity", "Custom Fields"]
+
+# Rows sampled to size spreadsheet columns, which must be set before any row is written
+EXCEL_WIDTH_SAMPLE_ROWS = 1000
+
+EXCEL_MAX_COLUMN_WIDTH = 50
+
+# Data rows per worksheet (Excel's limit of 1,048,576 rows, less the header)
+EXCEL_SHEET_ROWS = 1048575
+
+# Background job type for PDF inventory reports
+PDF_REPORT_JOB_TYPE = 'inventory_pdf_report'
+
+# Processes laying out PDF reports, so rendering holds neither the event loop nor the API's GIL
+PDF_RENDER_WORKERS = 2
+
+# Item rows per report table. Each table fills about one page, so layout time grows
+# linearly with the inventory; one giant table is re-measured on every page split
+PDF_TABLE_ROWS = 32
+
+# The first page also carries the title and summary
+PDF_FIRST_TABLE_ROWS = 24
+
+# Pages laid out between progress reports (which are also cancellation checks)
+PDF_PROGRESS_PAGES = 20
+
+# How often a job waiting on its render process checks whether the runner is stopping
+PDF_POLL_SECONDS = 1.0
+
+PDF_TABLE_HEADERS = ['Item Name', 'Quantity', 'Group', 'Reorder Level', 'Reorder Quantity']
+
+
+def _format_custom_fields(custom_fields: Optional[str]) -> str:
+    """Custom fields as "key: value, ..." text, as shown in the inventory screens."""
+    if not custom_fields:
+        return ''
+    return ', '.join(f"{key}: {value}" for key, value in json.loads(custom_fields).items())
+
+
+def _render_inventory_pdf(db_name: str, job_id: str, runner_id: str,
+                          groups: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Lay out the inventory PDF report; runs in a render process (see ExportService.run_pdf_job).
+
+    Progress is reported on behalf of the job's runner every PDF_PROGRESS_PAGES pages,
+    which is also where cancellation or loss of the job stops the render.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    db = DBConnection(db_name)
+    job = JobService().attach(job_id, runner_id)
+    if job is None:
+        raise JobInterrupted(f"Job {job_id} no longer exists")
+
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1976d2')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+    ])
+
+    # One table per page, built as rows are fetched; the style object is shared
+    tables = []
+    rows: List[List[str]] = []
+    items = 0
+    query, params = ExportService._inventory_query(groups)
+    with db.reader() as conn:
+        cursor = conn.execute(query, params)
+        for row in cursor:
+            rows.append([
+                row['item_name'] or '',
+                str(row['quantity']) if row['quantity'] is not None else '0',
+                row['group_name'] or 'N/A',
+                str(row['reorder_level']) if row['reorder_level'] is not None else 'N/A',
+                str(row['reorder_quantity']) if row['reorder_quantity'] is not None else 'N/A'
+            ])
+            items += 1
+            if len(rows) == (PDF_FIRST_TABLE_ROWS if not tables else PDF_TABLE_ROWS):
+                tables.append(Table([PDF_TABLE_HEADERS] + rows, style=table_style, repeatRows=1))
+                rows = []
+    if rows or not tables:
+        tables.append(Table([PDF_TABLE_HEADERS] + rows, style=table_style, repeatRows=1))
+    pages = len(tables)
+    job.report(0, pages, rows_processed=0)
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1976d2'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    subtitle_style = ParagraphStyle(
+        'CustomSubtitle',
+        parent=styles['Normal'],
+        fontSize=12,
+        textColor=colors.grey,
+        spaceAfter=20,
+        alignment=TA_CENTER
+    )
+    elements = [
+        Paragraph("Inventory Management Report", title_style),
+        Paragraph(f"Generated on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", subtitle_style),
+        Spacer(1, 0.3 * inch),
+        Paragraph(f"Total Items: <b>{items}</b>", styles['Normal']),
+        Spacer(1, 0.2 * inch)
+    ]
+    for index, table in enumerate(tables):
+        if index:
+            elements.append(PageBreak())
+        elements.append(table)
+
+    def on_page(canvas, doc) -> None:
+        if doc.page % PDF_PROGRESS_PAGES == 0:
+            job.report(doc.page, pages, rows_processed=min(items, PDF_FIRST_TABLE_ROWS + (doc.page - 1) * PDF_TABLE_ROWS))
+
+    path = JobService.create_file('.pdf')
+    try:
+        SimpleDocTemplate(path, pagesize=letter).build(elements, onFirstPage=on_page, onLaterPages=on_page)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {'file': path, 'items': items, 'pages': pages}
+
+
+class ExportService:
+    """Service class for inventory exports streamed straight from the database."""
+
+    def __init__(self):
+        """Initialize the export service."""
+        self.db = DBConnection()
+        self.cache = ExportCacheService()
+        self._render_pool = SpawnProcessPool(PDF_RENDER_WORKERS)
+
+    @staticmethod
+    def _inventory_query(groups: Optional[List[str]]):
+        if groups:
+            placeholders = ','.join('?' for _ in groups)
+            return f"""
+                SELECT item_name, quantity, group_name, reorder_level, reorder_quantity, custom_fields
+                FROM items
+                WHERE group_name IN ({placeholders})
+                ORDER BY item_name
+            """, list(groups)
+        return """
+            SELECT item_name, quantity, group_name, reorder_level, reorder_quantity, custom_fields
+            FROM items
+            ORDER BY item_name
+        """, []
+
+    def iter_inventory_csv(self, groups: Optional[List[str]] = None, compress: bool = False,
+                           chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+        """
+        Stream the inventory as CSV, optionally gzip-compressed.
+
+        The header is produced before the query runs; rows are then read with fetchmany
+        from a dedicated read-only connection and encoded a chunk at a time, so memory
+        and time to first byte do not depend on the number of items.
+
+        Args:
+            groups: Only items in these groups
+            compress: Emit a gzip stream instead of plain CSV
+            chunk_rows: Rows per fetch and per yielded chunk
+
+        Yields:
+            bytes: Successive pieces of the (compressed) file
+        """
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def drain() -> bytes:
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(data) if compressor else data
+
+        writer.writerow(INVENTORY_CSV_COLUMNS)
+        yield drain()
+
+        query, params = self._inventory_query(groups)
+        with self.db.reader() as conn:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                writer.writerows(
+                    (row['item_name'], row['quantity'], row['group_name'] or '',
+                     _format_custom_fields(row['custom_fields']))
+                    for row in rows
+                )
+                piece = drain()
+                if piece:
+                    yield piece
+
+        if compressor:
+            yield compressor.flush()
+
+    def iter_inventory_csv_cached(self, groups: Optional[List[str]] = None,
+                                  compress: bool = False) -> Iterator[bytes]:
+        """
+        Stream the inventory as CSV like iter_inventory_csv, keeping a copy in the export cache.
+
+        The copy is cached only if the whole file was sent and the items did not change
+        meanwhile; a cached copy is served by the caller (see ExportCacheService.get).
+        """
+        file_format = 'csv.gz' if compress else 'csv'
+        data_version = self.cache.data_version()
+        path = self.cache.create_file(f".{file_format}")
+        cached = False
+        try:
+            with open(path, 'wb') as copy:
+                for piece in self.iter_inventory_csv(groups, compress):
+                    copy.write(piece)
+                    yield piece
+            cached = self.cache.put(file_format, groups, data_version, path)
+        finally:
+            if not cached:
+                os.remove(path)
+
+    def export_inventory_xlsx(self, groups: Optional[List[str]] = None) -> Tuple[str, bool]:
+        """
+        The inventory as an .xlsx file, from the export cache when the items are unchanged.
+
+        Returns:
+            Tuple[str, bool]: Path of the workbook, and whether the cache owns it (otherwise
+                the caller removes it once it has been sent)
+        """
+        cached = self.cache.get('xlsx', groups)
+        if cached:
+            return cached, True
+        data_version = self.cache.data_version()
+        path = self.cache.create_file('.xlsx')
+        try:
+            self.write_inventory_xlsx(path, groups)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, self.cache.put('xlsx', groups, data_version, path)
+
+    def write_inventory_xlsx(self, target: Union[str, BinaryIO], groups: Optional[List[str]] = None,
+                             chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+        """
+        Write the inventory to an .xlsx workbook in openpyxl write-only mode.
+
+        Rows are appended as they are fetched and spooled to disk by openpyxl, so memory
+        stays flat however many items there are. Column widths are estimated from the
+        first EXCEL_WIDTH_SAMPLE_ROWS rows instead of measuring every cell. Exports larger
+        than one worksheet continue on "Inventory (2)", "Inventory (3)", ...
+
+        Args:
+            target: File path or binary file object to save the workbook to
+            groups: Only items in these groups
+            chunk_rows: Rows per fetch
+
+        Returns:
+            int: Number of items written
+        """
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Alignment, Font, PatternFill
+        from openpyxl.utils import get_column_letter
+
+        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        header_font = Font(bold=True, color="FFFFFF")
+        header_alignment = Alignment(horizontal="center")
+
+        def values(row) -> tuple:
+            return (row['item_name'], row['quantity'], row['group_name'], row['reorder_level'],
+                    row['reorder_quantity'], _format_custom_fields(row['custom_fields']) or None)
+
+        workbook = Workbook(write_only=True)
+        query, params = self._inventory_query(groups)
+        with self.db.reader() as conn:
+            cursor = conn.execute(query, params)
+            sample = [values(row) for row in cursor.fetchmany(EXCEL_WIDTH_SAMPLE_ROWS)]
+
+            widths = [len(header) + 2 for header in INVENTORY_EXCEL_HEADERS]
+            for row in sample:
+                for index, value in enumerate(row):
+                    if value is not None:
+                        widths[index] = max(widths[index], len(str(value)) + 2)
+
+            def new_sheet(number: int):
+                sheet = workbook.create_sheet("Inventory" if number == 1 else f"Inventory ({number})")
+                for index, width in enumerate(widths, 1):
+                    sheet.column_dimensions[get_column_letter(index)].width = min(width, EXCEL_MAX_COLUMN_WIDTH)
+                sheet.freeze_panes = "A2"
+                header = []
+                for title in INVENTORY_EXCEL_HEADERS:
+                    cell = WriteOnlyCell(sheet, value=title)
+                    cell.fill = header_fill
+                    cell.font = header_font
+                    cell.alignment = header_alignment
+                    header.append(cell)
+                sheet.append(header)
+                return sheet
+
+            sheets = 1
+            sheet = new_sheet(sheets)
+            written = 0
+
+            def append(rows) -> None:
+                nonlocal sheet, sheets, written
+                for row in rows:
+                    if written and written % EXCEL_SHEET_ROWS == 0:
+                        sheets += 1
+                        sheet = new_sheet(sheets)
+                    sheet.append(row)
+                    written += 1
+
+            append(sample)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                append(values(row) for row in rows)
+
+        workbook.save(target)
+        return written
+
+    def submit_pdf_report(self, jobs: JobService, groups: Optional[List[str]], user_name: str) -> Dict[str, Any]:
+        """
+        Queue a PDF inventory report as a background job.
+
+        Args:
+            jobs: Job service that runs the report
+            groups: Only items in these groups
+            user_name: User who requested the report
+
+        Returns:
+            Dict[str, Any]: The queued job
+        """
+        if importlib.util.find_spec('reportlab') is None:
+            raise RuntimeError("PDF reports require the reportlab package")
+        return jobs.submit(PDF_REPORT_JOB_TYPE, {'groups': groups}, user_name)
+
+    def run_pdf_job(self, job: JobContext) -> Dict[str, Any]:
+        """
+        Job handler for PDF reports: lays the report out in a render process.
+
+        The job thread only waits; the render process reports progress itself and
+        stops at its next report once the job is cancelled or requeued.
+
+        A report for unchanged items is taken from the export cache instead.
+
+        Returns:
+            Dict[str, Any]: The rendered file with its download name, item and page counts
+        """
+        groups = job.params.get('groups')
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        download = {'filename': f"inventory_report_{timestamp}.pdf", 'media_type': 'application/pdf'}
+
+        cached = self.cache.get('pdf', groups)
+        if cached:
+            path = JobService.create_file('.pdf')
+            try:
+                self.cache.link_into(cached, path)
+                return {'file': path, 'cached': True, **download}
+            except FileNotFoundError:
+                # Evicted in the meantime; render it after all
+                os.remove(path)
+
+        data_version = self.cache.data_version()
+        with self._render_pool.executor() as executor:
+            future = executor.submit(
+                _render_inventory_pdf, self.db.db_name, job.id, job.runner_id, groups
+            )
+            while True:
+                try:
+                    result = future.result(timeout=PDF_POLL_SECONDS)
+                    break
+                except FutureTimeout:
+                    if job.interrupted:
+                        future.cancel()
+                        raise JobInterrupted(f"Runner {job.runner_id} is stopping")
+
+        logging.info(f"PDF report for job {job.id}: {result['items']} items on {result['pages']} pages")
+
+        # The job's file is removed when the job is pruned, so the cache keeps its own link
+        copy = self.cache.create_file('.pdf')
+        self.cache.link_into(result['file'], copy)
+        if not self.cache.put('pdf', groups, data_version, copy):
+            os.remove(copy)
+        return {**result, 'cached': False, **download}
+
+    def shutdown(self) -> None:
+        """Stop the render processes; a render still running finds its job requeued and stops."""
+        self._render_pool.shutdown()
@@ -0,0 +1,413 @@
+# services/import_service.py
+
+import codecs
+import csv
+import logging
+import os
+import shutil
+import zipfile
+from itertools import dropwhile, islice
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database.db_connection import DBConnection
+from services.job_service import JobCancelled, JobContext, JobService
+from services.upload_service import UploadAborted, UploadService
+
+
+# Rows staged, validated and merged per transaction
+IMPORT_CHUNK_ROWS = 20000
+
+# Failed rows reported back in detail; the rest are only counted
+MAX_REPORTED_FAILURES = 100
+
+# Background job type for file imports
+IMPORT_JOB_TYPE = 'inventory_import'
+
+# Background job type for imports that parse an upload while it is still arriving; these
+# mostly wait for bytes, so they run on their own worker pool
+UPLOAD_IMPORT_JOB_TYPE = 'inventory_upload_import'
+
+# Importable file formats and the history action recorded for each
+IMPORT_ACTIONS = {'csv': 'csv_import', 'xlsx': 'excel_import'}
+
+# Formats that can be parsed front to back while the file is still arriving
+STREAMABLE_FORMATS = ('csv',)
+
+# (line, item_name, quantity, group_name, reorder_level, reorder_quantity), values as raw text
+StagedRow = Tuple[int, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def _is_integer(column: str) -> str:
+    """SQL condition: the text in `column` is an optionally signed integer (surrounding spaces allowed)."""
+    digits = f"(CASE WHEN substr(trim({column}), 1, 1) IN ('-', '+') THEN substr(trim({column}), 2) ELSE trim({column}) END)"
+    return f"({digits} GLOB '[0-9]*' AND {digits} NOT GLOB '*[^0-9]*')"
+
+
+_VALIDATE_STAGED_SQL = f"""
+    UPDATE import_staging SET error = CASE
+        WHEN item_name IS NULL OR trim(item_name) = '' THEN 'Missing item name'
+        WHEN quantity IS NULL OR NOT {_is_integer('quantity')} THEN 'Invalid quantity: ' || IFNULL(quantity, '')
+        WHEN IFNULL(reorder_level, '') <> '' AND NOT {_is_integer('reorder_level')}
+            THEN 'Invalid reorder_level: ' || reorder_level
+        WHEN IFNULL(reorder_quantity, '') <> '' AND NOT {_is_integer('reorder_quantity')}
+            THEN 'Invalid reorder_quantity: ' || reorder_quantity
+    END
+"""
+
+
+def _cell_text(value: Any) -> Optional[str]:
+    """Spreadsheet cell value as the text a CSV would hold (5.0 reads as "5")."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _row_mapper(header: List[Optional[str]]) -> Callable[[int, List[Optional[str]]], StagedRow]:
+    """
+    Map a header row once and return a function that stages data rows.
+
+    Header names match case-insensitively with spaces read as underscores, so "Item Name"
+    is item_name. Missing trailing cells read as NULL.
+    """
+    positions: Dict[str, int] = {}
+    for index, name in enumerate(header):
+        positions.setdefault((name or '').strip().lower().replace(' ', '_'), index)
+
+    def column(name: str) -> Optional[int]:
+        return positions.get(name)
+
+    name_col, item_name_col = column('name'), column('item_name')
+    group_col, group_name_col = column('group'), column('group_name')
+    quantity_col = column('quantity')
+    reorder_level_col, reorder_quantity_col = column('reorder_level'), column('reorder_quantity')
+
+    def cell(row: List[Optional[str]], index: Optional[int]) -> Optional[str]:
+        return row[index] if index is not None and index < len(row) else None
+
+    def stage(line: int, row: List[Optional[str]]) -> StagedRow:
+        return (
+            line,
+            cell(row, name_col) or cell(row, item_name_col),
+            cell(row, quantity_col) if quantity_col is not None else '0',
+            cell(row, group_col) or cell(row, group_name_col),
+            cell(row, reorder_level_col),
+            cell(row, reorder_quantity_col)
+        )
+
+    return stage
+
+
+class ImportService:
+    """Service class for bulk inventory imports."""
+
+    def __init__(self):
+        """Initialize the import service."""
+        self.db = DBConnection()
+        self.uploads = UploadService()
+
+    def import_file(self, stream: BinaryIO, file_format: str, user_name: str,
+                    chunk_rows: int = IMPORT_CHUNK_ROWS) -> Dict[str, Any]:
+        """
+        Import inventory items from a CSV or .xlsx file without loading it into memory.
+
+        Recognised columns are name/item_name, quantity, group/group_name, reorder_level
+        and reorder_quantity. Existing items are updated, new ones created.
+
+        Args:
+            stream: Binary file object positioned at the start of the file (seekable for .xlsx)
+            file_format: 'csv' or 'xlsx'
+            user_name: User recorded in the history entries
+            chunk_rows: Rows per staging/merge transaction
+
+        Returns:
+            Dict[str, Any]: Counts of rows, new and updated items, and the failed rows
+
+        Raises:
+            ValueError: If the format is unsupported or the file cannot be read
+        """
+        return self.import_rows(self.read_rows(stream, file_format), user_name,
+                                IMPORT_ACTIONS[file_format], chunk_rows)
+
+    def submit_import_job(self, jobs: JobService, stream: BinaryIO, file_format: str,
+                          user_name: str) -> Dict[str, Any]:
+        """
+        Spool an uploaded file to disk and queue it as a background import job.
+
+        Args:
+            jobs: Job service that runs the import
+            stream: Binary file object with the upload
+            file_format: 'csv' or 'xlsx'
+            user_name: User recorded in the history entries
+
+        Returns:
+            Dict[str, Any]: The queued job
+        """
+        if file_format not in IMPORT_ACTIONS:
+            raise ValueError(f"Unsupported import format: {file_format}")
+        path = jobs.create_file(f".{file_format}")
+        try:
+            with open(path, 'wb') as spool:
+                shutil.copyfileobj(stream, spool, 1024 * 1024)
+            return jobs.submit(IMPORT_JOB_TYPE, {'format': file_format, 'path': path, 'files': [path]},
+                               user_name, total=os.path.getsize(path))
+        except Exception:
+            os.remove(path)
+            raise
+
+    def submit_upload_import(self, jobs: JobService, upload_id: str, user_name: str) -> Dict[str, Any]:
+        """
+        Queue an import of a chunked upload.
+
+        A CSV import may be queued before the upload is finalized: it then parses chunks
+        as they arrive and finishes once the upload is complete. An .xlsx workbook can only
+        be read once it is complete.
+
+        Args:
+            jobs: Job service that runs the import
+            upload_id: Upload to import
+            user_name: User recorded in the history entries
+
+        Returns:
+            Dict[str, Any]: The queued job
+        """
+        upload = self.uploads.get_upload(upload_id)
+        if upload['file_format'] not in IMPORT_ACTIONS:
+            raise ValueError(f"Unsupported import format: {upload['file_format']}")
+        if upload['status'] != 'complete' and upload['file_format'] not in STREAMABLE_FORMATS:
+            raise ValueError(f"A .{upload['file_format']} upload can only be imported once it is finalized")
+        follows_upload = upload['status'] != 'complete'
+        job = jobs.submit(UPLOAD_IMPORT_JOB_TYPE if follows_upload else IMPORT_JOB_TYPE, {
+            'format': upload['file_format'],
+            'upload_id': upload_id,
+            'files': [self.uploads.spool_path(upload_id)]
+        }, user_name, total=upload['total_size'])
+        self.uploads.set_job(upload_id, job['id'])
+        return job
+
+    def run_import_job(self, job: JobContext) -> Dict[str, Any]:
+        """
+        Job handler for spooled imports and chunked uploads.
+
+        Progress is measured in bytes of the file read (compressed bytes for .xlsx); the
+        checkpoint holds the counts and last line of the last committed chunk, so a
+        resumed job skips what is done.
+        """
+        upload_id = job.params.get('upload_id')
+        file_format = job.params['format']
+        if upload_id and file_format in STREAMABLE_FORMATS:
+            # Follows the upload while it is still arriving, keeping the job's heartbeat fresh
+            stream = self.uploads.open_stream(upload_id, on_wait=lambda done: job.report(done))
+            total = None
+        else:
+            stream = open(job.params.get('path') or self.uploads.spool_path(upload_id), 'rb')
+            total = os.fstat(stream.fileno()).st_size
+
+        with stream:
+            def on_chunk(cursor, progress: Dict[str, Any]) -> None:
+                size = total
+                if size is None:
+                    # An upload's size is only known for certain once it is finalized
+                    cursor.execute("SELECT total_size FROM uploads WHERE id = ?", (upload_id,))
+                    size = cursor.fetchone()['total_size']
+                job.checkpoint_in(cursor, progress, done=stream.tell(), total=size,
+                                  rows_processed=progress['rows'], rows_failed=progress['failed_count'])
+
+            try:
+                return self.import_rows(self.read_rows(stream, file_format), job.user_name,
+                                        IMPORT_ACTIONS[file_format], resume=job.checkpoint, on_chunk=on_chunk)
+            except UploadAborted as e:
+                raise JobCancelled(str(e))
+
+    @staticmethod
+    def read_csv_rows(stream: BinaryIO) -> Iterator[StagedRow]:
+        """Parse a CSV byte stream incrementally into staged rows."""
+        text = codecs.getreader('utf-8-sig')(stream)
+        reader = csv.reader(text)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise ValueError("CSV file has no header row")
+        except UnicodeDecodeError:
+            raise ValueError("CSV file is not valid UTF-8")
+
+        stage = _row_mapper(header)
+        try:
+            for row in reader:
+                if row:
+                    yield stage(reader.line_num, row)
+        except UnicodeDecodeError:
+            raise ValueError(f"CSV file is not valid UTF-8 (after line {reader.line_num})")
+
+    @staticmethod
+    def read_excel_rows(stream: BinaryIO) -> Iterator[StagedRow]:
+        """
+        Stream the active sheet of an .xlsx workbook into staged rows.
+
+        The workbook is opened in read-only mode, so rows are parsed from the sheet XML as
+        they are consumed instead of building the whole workbook in memory. Line numbers
+        are sheet row numbers.
+        """
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+            raise ValueError(f"Not a valid .xlsx workbook: {e}")
+
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                raise ValueError("Excel sheet has no header row")
+            stage = _row_mapper([_cell_text(value) for value in header])
+            for line, row in enumerate(rows, start=2):
+                if any(value is not None for value in row):
+                    yield stage(line, [_cell_text(value) for value in row])
+        finally:
+            workbook.close()
+
+    @classmethod
+    def read_rows(cls, stream: BinaryIO, file_format: str) -> Iterator[StagedRow]:
+        """Staged rows of a CSV or .xlsx file."""
+        if file_format == 'csv':
+            return cls.read_csv_rows(stream)
+        if file_format == 'xlsx':
+            return cls.read_excel_rows(stream)
+        raise ValueError(f"Unsupported import format: {file_format}")
+
+    def import_rows(self, rows: Iterable[StagedRow], user_name: str, action: str,
+                    chunk_rows: int = IMPORT_CHUNK_ROWS, resume: Optional[Dict[str, Any]] = None,
+                    on_chunk: Optional[Callable[[Any, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Stage, validate and merge rows into items chunk by chunk.
+
+        Each chunk is one transaction: rows are loaded into a temp staging table with
+        executemany, validated with a single UPDATE, merged into items with
+        INSERT ... ON CONFLICT DO UPDATE and logged to history with one INSERT ... SELECT.
+
+        Args:
+            rows: Staged rows in file order
+            user_name: User recorded in the history entries
+            action: History action name
+            chunk_rows: Rows per transaction
+            resume: Progress passed to on_chunk by an earlier, interrupted run; rows up to
+                its line are skipped and its counts carried over
+            on_chunk: Called with the cursor and the progress so far at the end of each
+                chunk, inside the chunk's transaction; raising rolls the chunk back
+
+        Returns:
+            Dict[str, Any]: Counts of rows, new and updated items, and the failed rows
+        """
+        totals = {'rows': 0, 'imported': 0, 'updated': 0, 'failed_count': 0}
+        failed: List[Dict[str, Any]] = []
+        if resume:
+            totals = {key: resume[key] for key in totals}
+            failed = list(resume['failed'])
+            rows = dropwhile(lambda row: row[0] <= resume['line'], rows)
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS temp.import_staging")
+            cursor.execute("""
+                CREATE TEMP TABLE import_staging (
+                    line INTEGER PRIMARY KEY,
+                    item_name TEXT,
+                    quantity TEXT,
+                    group_name TEXT,
+                    reorder_level TEXT,
+                    reorder_quantity TEXT,
+                    error TEXT
+                )
+            """)
+
+        rows = iter(rows)
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_rows))
+                if not chunk:
+                    break
+                with self.db.get_cursor() as cursor:
+                    counts = self._merge_chunk(cursor, chunk, user_name, action,
+                                               MAX_REPORTED_FAILURES - len(failed), failed)
+                    progress = {key: totals[key] + counts[key] for key in totals}
+                    if on_chunk:
+                        on_chunk(cursor, dict(progress, line=chunk[-1][0], failed=failed))
+                totals = progress
+        finally:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS temp.import_staging")
+
+        logging.info(f"Import ({action}) by {user_name}: {totals}")
+        return {
+            "message": f"Import complete: {totals['imported']} new, {totals['updated']} updated",
+            **totals,
+            "failed": failed
+        }
+
+    def _merge_chunk(self, cursor, chunk: List[StagedRow], user_name: str, action: str,
+                     failure_slots: int, failed: List[Dict[str, Any]]) -> Dict[str, int]:
+        cursor.execute("DELETE FROM import_staging")
+        cursor.executemany("""
+            INSERT INTO import_staging (line, item_name, quantity, group_name, reorder_level, reorder_quantity)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, chunk)
+        cursor.execute(_VALIDATE_STAGED_SQL)
+
+        cursor.execute("SELECT COUNT(*) FROM import_staging WHERE error IS NOT NULL")
+        failed_count = cursor.fetchone()[0]
+        if failed_count and failure_slots > 0:
+            cursor.execute("""
+                SELECT line, item_name, error FROM import_staging
+                WHERE error IS NOT NULL ORDER BY line LIMIT ?
+            """, (failure_slots,))
+            failed.extend({"row": row['line'], "item_name": row['item_name'], "reason": row['error']}
+                          for row in cursor.fetchall())
+
+        # Items that do not exist yet; later rows for the same item count as updates
+        cursor.execute("""
+            SELECT COUNT(DISTINCT trim(s.item_name)) FROM import_staging s
+            WHERE s.error IS NULL
+              AND NOT EXISTS (SELECT 1 FROM items i WHERE i.item_name = trim(s.item_name))
+        """)
+        imported = cursor.fetchone()[0]
+
+        cursor.execute("""
+            INSERT OR IGNORE INTO groups (group_name)
+            SELECT DISTINCT trim(group_name) FROM import_staging
+            WHERE error IS NULL AND trim(IFNULL(group_name, '')) <> ''
+        """)
+
+        cursor.execute("""
+            INSERT INTO items (item_name, quantity, group_name, reorder_level, reorder_quantity)
+            SELECT trim(item_name),
+                   CAST(trim(quantity) AS INTEGER),
+                   NULLIF(trim(group_name), ''),
+                   COALESCE(CAST(NULLIF(trim(reorder_level), '') AS INTEGER), 10),
+                   COALESCE(CAST(NULLIF(trim(reorder_quantity), '') AS INTEGER), 50)
+            FROM import_staging
+            WHERE error IS NULL
+            ORDER BY line
+            ON CONFLICT(item_name) DO UPDATE SET
+                quantity = excluded.quantity,
+                group_name = excluded.group_name,
+                reorder_level = excluded.reorder_level,
+                reorder_quantity = excluded.reorder_quantity
+        """)
+        merged = cursor.rowcount
+
+        cursor.execute("""
+            INSERT INTO history (action, item_name, quantity, group_name, user_name)
+            SELECT ?, trim(item_name), CAST(trim(quantity) AS INTEGER), NULLIF(trim(group_name), ''), ?
+            FROM import_staging
+            WHERE error IS NULL
+            ORDER BY line
+        """, (action, user_name))
+
+        return {
+            'rows': len(chunk),
+            'imported': imported,
+            'updated': merged - imported,
+            'failed_count': failed_count
+        }
@@ -2,7 +2,8 @@
 
 import json
 import logging
-import shutil
+import os
+import sqlite3
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
@@ -11,6 +12,13 @@ from models.item import Item
 from models.history_entry import HistoryEntry
 
 
+# Database backups, one backup_<timestamp>.db file each
+BACKUP_DIR = "backups"
+
+# Backups kept by prune_backups; older ones are deleted
+BACKUP_KEEP = 7
+
+
 class InventoryService:
     """Service class for inventory operations."""
 
@@ -316,17 +324,44 @@ class InventoryService:
             return False
 
     def backup_data(self) -> str:
-        """Create a backup of the database."""
+        """Create a backup of the database in BACKUP_DIR."""
         try:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = f"backup_{timestamp}.db"
-            shutil.copy2(self.db.db_name, backup_file)
+            backup_file = os.path.join(BACKUP_DIR, f"backup_{timestamp}.db")
+            # Written under a temporary name, so pruning never sees a half-written backup
+            partial_file = f"{backup_file}.partial"
+            # The online backup API also captures pages still in the WAL file
+            target = sqlite3.connect(partial_file)
+            try:
+                self.db.connect().backup(target)
+            finally:
+                target.close()
+            os.replace(partial_file, backup_file)
             logging.info(f"Created backup: {backup_file}")
             return backup_file
         except Exception as e:
             logging.error(f"Error creating backup: {e}")
             raise
 
+    def prune_backups(self, keep: int = BACKUP_KEEP) -> Dict[str, int]:
+        """Delete all but the newest `keep` backups in BACKUP_DIR."""
+        if not os.path.isdir(BACKUP_DIR):
+            return {'deleted': 0}
+        # Timestamped names sort oldest first
+        backups = sorted(name for name in os.listdir(BACKUP_DIR)
+                         if name.startswith("backup_") and name.endswith(".db"))
+        deleted = 0
+        for name in backups[:max(len(backups) - keep, 0)]:
+            try:
+                os.remove(os.path.join(BACKUP_DIR, name))
+                deleted += 1
+            except OSError as e:
+                logging.warning(f"Could not remove backup {name}: {e}")
+        if deleted:
+            logging.info(f"Pruned {deleted} old backups")
+        return {'deleted': deleted}
+
     def check_low_stock(self, threshold: int = 10) -> List[Dict[str, Any]]:
         """
         Check for items with low stock below the threshold.
@@ -0,0 +1,458 @@
+# services/job_service.py
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from database.db_connection import DBConnection
+
+
+# Jobs run concurrently per API process
+JOB_WORKERS = 2
+
+# Worker pools by name; a job type registered to a pool other than the default runs on its
+# own threads, so jobs that spend most of their time waiting cannot starve the default pool
+JOB_POOLS = {'default': JOB_WORKERS, 'uploads': 4}
+
+# A running job whose heartbeat is older than this is assumed dead and is taken over
+JOB_STALE_SECONDS = 120
+
+# Finished jobs and their files are kept this long
+JOB_RETENTION_DAYS = 7
+
+# Uploaded inputs and rendered outputs of jobs
+JOB_FILES_DIR = "job_files"
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+class JobInterrupted(Exception):
+    """Raised inside a job when this runner is shutting down or lost the job to another runner."""
+
+
+class JobContext:
+    """What a job handler sees of its job: parameters, last checkpoint and progress reporting."""
+
+    def __init__(self, service: 'JobService', row: sqlite3.Row):
+        self._service = service
+        self.id = row['id']
+        self.runner_id = service.runner_id
+        self.job_type = row['job_type']
+        self.user_name = row['user_name']
+        self.params = json.loads(row['params']) if row['params'] else {}
+        self.checkpoint = json.loads(row['checkpoint']) if row['checkpoint'] else None
+        self._started = time.monotonic()
+        self._start_done = row['progress_done'] or 0
+
+    @property
+    def interrupted(self) -> bool:
+        """True once the runner is stopping; a handler waiting on another process should give up."""
+        return self._service._stopping.is_set()
+
+    def checkpoint_in(self, cursor: sqlite3.Cursor, checkpoint: Optional[Dict[str, Any]], done: int,
+                      total: Optional[int] = None, rows_processed: Optional[int] = None,
+                      rows_failed: Optional[int] = None) -> None:
+        """
+        Record progress and a resume checkpoint inside the caller's transaction.
+
+        Committing the checkpoint together with the work it describes means a resumed job
+        continues exactly after the last committed unit of work.
+
+        Raises:
+            JobCancelled: If cancellation was requested; the caller's transaction should roll back
+            JobInterrupted: If the runner is stopping or no longer owns the job
+        """
+        if self._service._stopping.is_set():
+            raise JobInterrupted(f"Runner {self._service.runner_id} is stopping")
+
+        cursor.execute("""
+            SELECT cancel_requested FROM background_jobs
+            WHERE id = ? AND runner = ? AND status = 'running'
+        """, (self.id, self._service.runner_id))
+        row = cursor.fetchone()
+        if row is None:
+            raise JobInterrupted(f"Job {self.id} was taken over by another runner")
+        if row['cancel_requested']:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+        eta_seconds = None
+        elapsed = time.monotonic() - self._started
+        if total and done > self._start_done and elapsed > 0:
+            rate = (done - self._start_done) / elapsed
+            eta_seconds = round(max(total - done, 0) / rate, 1)
+
+        cursor.execute("""
+            UPDATE background_jobs
+            SET checkpoint = COALESCE(?, checkpoint),
+                progress_done = ?,
+                progress_total = COALESCE(?, progress_total),
+                rows_processed = COALESCE(?, rows_processed),
+                rows_failed = COALESCE(?, rows_failed),
+                eta_seconds = ?,
+                heartbeat_at = datetime('now'),
+                updated_at = datetime('now')
+            WHERE id = ?
+        """, (json.dumps(checkpoint) if checkpoint is not None else None, done, total,
+              rows_processed, rows_failed, eta_seconds, self.id))
+
+    def report(self, done: int, total: Optional[int] = None, rows_processed: Optional[int] = None,
+               rows_failed: Optional[int] = None) -> None:
+        """Record progress without a checkpoint, in its own transaction."""
+        with self._service.db.get_cursor() as cursor:
+            self.checkpoint_in(cursor, None, done, total, rows_processed, rows_failed)
+
+
+class JobService:
+    """
+    Background jobs for work too long for a request: imports, report rendering.
+
+    Jobs are rows in background_jobs, run by small thread pools in each API
+    process. A runner claims a job with a conditional UPDATE and keeps a
+    heartbeat while it works; a job whose runner died (stale heartbeat) is
+    claimed again and resumes from its last checkpoint.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, stale_seconds: int = JOB_STALE_SECONDS):
+        """Initialize the job service."""
+        self.db = DBConnection()
+        self.pool_sizes = dict(JOB_POOLS, default=workers)
+        self.stale_seconds = stale_seconds
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[JobContext], Any]] = {}
+        self._job_pools: Dict[str, str] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._active: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def register(self, job_type: str, handler: Callable[[JobContext], Any], pool: str = 'default') -> None:
+        """
+        Register the handler for a job type.
+
+        The handler is called with a JobContext; its return value is stored as the job's
+        result. Long handlers should call checkpoint_in or report regularly so that
+        cancellation is noticed and the heartbeat stays fresh.
+
+        Args:
+            job_type: Job type
+            handler: Handler run for each job of the type
+            pool: Worker pool (a JOB_POOLS name) the jobs run on
+        """
+        if pool not in self.pool_sizes:
+            raise ValueError(f"Unknown job pool: {pool}")
+        self._handlers[job_type] = handler
+        self._job_pools[job_type] = pool
+
+    @staticmethod
+    def create_file(suffix: str = "") -> str:
+        """Create an empty file under JOB_FILES_DIR for a job's input or output and return its path."""
+        os.makedirs(JOB_FILES_DIR, exist_ok=True)
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=JOB_FILES_DIR)
+        os.close(handle)
+        return path
+
+    def start(self) -> Dict[str, int]:
+        """Start the worker pool and pick up queued or orphaned jobs."""
+        self._stopping.clear()
+        return self.recover()
+
+    def stop(self) -> None:
+        """
+        Stop the worker pool. Running jobs stop at their next checkpoint and go back
+        to the queue, to be resumed on the next start.
+        """
+        self._stopping.set()
+        with self._lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+        logging.info(f"Job runner {self.runner_id} stopped")
+
+    def _ensure_executor(self, pool: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if pool not in self._executors:
+                self._executors[pool] = ThreadPoolExecutor(
+                    max_workers=self.pool_sizes[pool], thread_name_prefix=f"job-{pool}"
+                )
+            return self._executors[pool]
+
+    def submit(self, job_type: str, params: Dict[str, Any], user_name: Optional[str],
+               total: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Queue a job and start it as soon as a worker is free.
+
+        Args:
+            job_type: Registered job type
+            params: JSON-serialisable parameters for the handler. Paths listed under
+                "files" are deleted once the job completes or is pruned.
+            user_name: User who submitted the job
+            total: Units of work, if known up front (used for percent and ETA)
+
+        Returns:
+            Dict[str, Any]: The queued job
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = uuid.uuid4().hex
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO background_jobs (id, job_type, status, params, user_name, progress_total)
+                VALUES (?, ?, 'queued', ?, ?, ?)
+            """, (job_id, job_type, json.dumps(params), user_name, total))
+        self._dispatch(job_id, job_type)
+        return self.get_job(job_id)
+
+    def attach(self, job_id: str, runner_id: str) -> Optional[JobContext]:
+        """
+        Context for a job that a runner in another process has claimed.
+
+        Used by work handed off to a subprocess, so that it reports progress (and notices
+        cancellation) on behalf of the runner that owns the job.
+        """
+        self.runner_id = runner_id
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM background_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        return JobContext(self, row) if row else None
+
+    def recover(self) -> Dict[str, int]:
+        """Dispatch queued jobs and jobs whose runner stopped sending heartbeats."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, job_type FROM background_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND heartbeat_at < datetime('now', ?))
+                ORDER BY created_at
+            """, (f"-{self.stale_seconds} seconds",))
+            jobs = cursor.fetchall()
+        dispatched = sum(1 for job in jobs if self._dispatch(job['id'], job['job_type']))
+        if dispatched:
+            logging.info(f"Job runner {self.runner_id} picked up {dispatched} pending jobs")
+        return {'dispatched': dispatched}
+
+    def _dispatch(self, job_id: str, job_type: str) -> bool:
+        if self._stopping.is_set():
+            return False
+        executor = self._ensure_executor(self._job_pools.get(job_type, 'default'))
+        with self._lock:
+            if job_id in self._active:
+                return False
+            self._active.add(job_id)
+        executor.submit(self._run, job_id)
+        return True
+
+    def _claim(self, job_id: str) -> Optional[sqlite3.Row]:
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE background_jobs
+                SET status = 'running', runner = ?, attempts = attempts + 1,
+                    heartbeat_at = datetime('now'), updated_at = datetime('now'),
+                    started_at = COALESCE(started_at, datetime('now'))
+                WHERE id = ?
+                  AND (status = 'queued'
+                       OR (status = 'running' AND heartbeat_at < datetime('now', ?)))
+            """, (self.runner_id, job_id, f"-{self.stale_seconds} seconds"))
+            if cursor.rowcount != 1:
+                return None
+            cursor.execute("SELECT * FROM background_jobs WHERE id = ?", (job_id,))
+            return cursor.fetchone()
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        finished_at = "datetime('now')" if status in FINISHED_STATUSES else "NULL"
+        with self.db.get_cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE background_jobs
+                SET status = ?, result = COALESCE(?, result), error = ?,
+                    eta_seconds = CASE WHEN ? = 'completed' THEN 0 END,
+                    progress_done = CASE WHEN ? = 'completed' THEN COALESCE(progress_total, progress_done)
+                                         ELSE progress_done END,
+                    finished_at = {finished_at}, updated_at = datetime('now')
+                WHERE id = ? AND runner = ?
+            """, (status, json.dumps(result, default=str) if result is not None else None, error,
+                  status, status, job_id, self.runner_id))
+
+    def _run(self, job_id: str) -> None:
+        try:
+            row = self._claim(job_id)
+            if row is None:
+                return
+            context = JobContext(self, row)
+            handler = self._handlers.get(context.job_type)
+            if handler is None:
+                self._finish(job_id, 'failed', error=f"No handler for job type {context.job_type}")
+                return
+
+            logging.info(f"Job {job_id} ({context.job_type}) started on {self.runner_id}")
+            clock = time.perf_counter()
+            try:
+                result = handler(context)
+            except JobCancelled:
+                self._finish(job_id, 'cancelled')
+                logging.info(f"Job {job_id} cancelled")
+                return
+            except JobInterrupted as e:
+                # Back to the queue; the next runner resumes from the last checkpoint
+                self._finish(job_id, 'queued')
+                logging.info(f"Job {job_id} interrupted: {e}")
+                return
+            except Exception as e:
+                self._finish(job_id, 'failed', error=f"{type(e).__name__}: {e}")
+                logging.error(f"Job {job_id} ({context.job_type}) failed: {e}")
+                return
+
+            self._finish(job_id, 'completed', result=result)
+            self._remove_files(context.params.get('files', []))
+            logging.info(f"Job {job_id} ({context.job_type}) completed in {time.perf_counter() - clock:.1f}s")
+        except Exception as e:
+            logging.error(f"Job runner error for job {job_id}: {e}")
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a job. A queued job is cancelled at once; a running one stops at its next
+        checkpoint, keeping the work committed so far.
+
+        Returns:
+            Optional[Dict[str, Any]]: The job, or None if it does not exist
+
+        Raises:
+            ValueError: If the job has already finished
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT status FROM background_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row and row['status'] not in FINISHED_STATUSES:
+                cursor.execute("""
+                    UPDATE background_jobs
+                    SET cancel_requested = 1,
+                        status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                        finished_at = CASE WHEN status = 'queued' THEN datetime('now') END,
+                        updated_at = datetime('now')
+                    WHERE id = ?
+                """, (job_id,))
+        if row is None:
+            return None
+        if row['status'] in FINISHED_STATUSES:
+            raise ValueError(f"Job is already {row['status']}")
+        return self.get_job(job_id)
+
+    def resume(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Queue a failed or cancelled job again; it continues from its last checkpoint.
+
+        Returns:
+            Optional[Dict[str, Any]]: The job, or None if it does not exist
+
+        Raises:
+            ValueError: If the job is not failed or cancelled
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT status, job_type FROM background_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row and row['status'] in ('failed', 'cancelled'):
+                cursor.execute("""
+                    UPDATE background_jobs
+                    SET status = 'queued', cancel_requested = 0, error = NULL,
+                        finished_at = NULL, updated_at = datetime('now')
+                    WHERE id = ?
+                """, (job_id,))
+        if row is None:
+            return None
+        if row['status'] not in ('failed', 'cancelled'):
+            raise ValueError(f"Only failed or cancelled jobs can be resumed (job is {row['status']})")
+        self._dispatch(job_id, row['job_type'])
+        return self.get_job(job_id)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        total, done = row['progress_total'], row['progress_done']
+        return {
+            'id': row['id'],
+            'job_type': row['job_type'],
+            'status': row['status'],
+            'user_name': row['user_name'],
+            'rows_processed': row['rows_processed'],
+            'rows_failed': row['rows_failed'],
+            'progress_done': done,
+            'progress_total': total,
+            'percent': round(100.0 * done / total, 1) if total else None,
+            'eta_seconds': row['eta_seconds'],
+            'cancel_requested': bool(row['cancel_requested']),
+            'attempts': row['attempts'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'heartbeat_at': row['heartbeat_at'],
+            'finished_at': row['finished_at']
+        }
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's status and progress."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM background_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, user_name: Optional[str] = None, status: Optional[str] = None,
+                  limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs, newest first, optionally for one user or status."""
+        filters = []
+        params: List[Any] = []
+        if user_name:
+            filters.append("user_name = ?")
+            params.append(user_name)
+        if status:
+            filters.append("status = ?")
+            params.append(status)
+        where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
+        with self.db.get_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT * FROM background_jobs {where_clause}
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            """, params + [limit])
+            return [self._to_dict(row) for row in cursor.fetchall()]
+
+    def prune(self, retention_days: int = JOB_RETENTION_DAYS) -> Dict[str, int]:
+        """Delete finished jobs older than the retention window, with their input and output files."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, params, result FROM background_jobs
+                WHERE status IN ('completed', 'failed', 'cancelled')
+                  AND COALESCE(finished_at, updated_at) < datetime('now', ?)
+            """, (f"-{retention_days} days",))
+            rows = cursor.fetchall()
+            cursor.executemany("DELETE FROM background_jobs WHERE id = ?", [(row['id'],) for row in rows])
+
+        for row in rows:
+            params = json.loads(row['params']) if row['params'] else {}
+            result = json.loads(row['result']) if row['result'] else None
+            files = list(params.get('files', []))
+            if isinstance(result, dict) and result.get('file'):
+                files.append(result['file'])
+            self._remove_files(files)
+        return {'deleted': len(rows)}
+
+    @staticmethod
+    def _remove_files(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not remove job file {path}: {e}")
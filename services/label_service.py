@@ -0,0 +1,318 @@
+# services/label_service.py
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from database.db_connection import DBConnection
+from utils.process_pool import SpawnProcessPool
+
+
+# Rendered QR codes and barcodes kept in memory, least recently used evicted first
+LABEL_IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Image formats for QR codes and barcodes, with their media types
+IMAGE_MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Allowed QR module (box) sizes in pixels
+QR_MIN_SIZE = 1
+QR_MAX_SIZE = 40
+
+# Longest barcode payload; Code128 gets unreadable beyond this on a label
+BARCODE_MAX_LENGTH = 20
+
+# Most labels in one sheet request
+MAX_SHEET_LABELS = 5000
+
+# QR module size for sheet labels (about 260 dpi at the printed size)
+SHEET_QR_SIZE = 4
+
+# Processes rendering QR codes for label sheets
+LABEL_RENDER_WORKERS = 4
+
+# Fewer QR codes than this are rendered in the calling thread. A QR code takes about 25 ms,
+# so below this a sheet renders in a few seconds, about what starting the worker
+# processes costs on its first use
+LABEL_POOL_MIN_IMAGES = 256
+
+# Avery 5160-style sheet on US letter, in points: 3 columns x 10 rows of 2.625" x 1" labels
+SHEET_COLUMNS = 3
+SHEET_ROWS = 10
+SHEET_LABEL_WIDTH = 189
+SHEET_LABEL_HEIGHT = 72
+SHEET_LEFT_MARGIN = 13.5
+SHEET_TOP_MARGIN = 36
+SHEET_COLUMN_PITCH = 198
+SHEET_LABEL_PADDING = 4
+
+
+def render_qrcode(payload: str, size: int, image_format: str = 'png') -> bytes:
+    """Render a QR code (error correction H, 4-module border)."""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=size,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    output = io.BytesIO()
+    if image_format == 'svg':
+        from qrcode.image.svg import SvgPathImage
+        qr.make_image(image_factory=SvgPathImage).save(output)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(output, format='PNG')
+    return output.getvalue()
+
+
+def render_barcode(payload: str, image_format: str = 'png') -> bytes:
+    """Render a Code128 barcode."""
+    from barcode import Code128
+    from barcode.writer import ImageWriter, SVGWriter
+
+    output = io.BytesIO()
+    Code128(payload, writer=ImageWriter() if image_format == 'png' else SVGWriter()).write(output)
+    return output.getvalue()
+
+
+class LabelService:
+    """
+    QR codes and barcodes for item labels.
+
+    Rendered images are content-addressed: the cache key and ETag are a hash of what
+    determines the image (kind, payload, size and format), so an unchanged image is
+    never rendered twice and clients can revalidate without downloading it again.
+    """
+
+    def __init__(self, max_bytes: int = LABEL_IMAGE_CACHE_BYTES):
+        """Initialize the label service."""
+        self.db = DBConnection()
+        self.max_bytes = max_bytes
+        self._images: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._render_pool = SpawnProcessPool(LABEL_RENDER_WORKERS)
+
+    @staticmethod
+    def image_key(kind: str, payload: str, size: Optional[int], image_format: str) -> str:
+        """Content hash of an image's inputs; used as cache key and ETag."""
+        return hashlib.sha256(json.dumps([kind, payload, size, image_format]).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _check_format(image_format: str) -> str:
+        image_format = image_format.lower()
+        if image_format not in IMAGE_MEDIA_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        return image_format
+
+    @staticmethod
+    def _payload(item) -> str:
+        return json.dumps({
+            "item_name": item['item_name'],
+            "quantity": item['quantity'],
+            "group": item['group_name'],
+            "reorder_point": item['reorder_level'],
+        })
+
+    def qrcode_payload(self, item_name: str) -> Optional[str]:
+        """The JSON an item's QR code encodes, or None if the item does not exist."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT item_name, quantity, group_name, reorder_level FROM items WHERE item_name = ?
+            """, (item_name,))
+            item = cursor.fetchone()
+        return self._payload(item) if item else None
+
+    @staticmethod
+    def barcode_payload(item_name: str) -> str:
+        """What an item's barcode encodes: its name, spaces as underscores, truncated."""
+        return item_name.replace(" ", "_")[:BARCODE_MAX_LENGTH]
+
+    def qrcode_key(self, payload: str, size: int, image_format: str = 'png') -> str:
+        """Key of a QR code image, checking its parameters."""
+        if not QR_MIN_SIZE <= size <= QR_MAX_SIZE:
+            raise ValueError(f"size must be between {QR_MIN_SIZE} and {QR_MAX_SIZE}")
+        return self.image_key('qrcode', payload, size, self._check_format(image_format))
+
+    def barcode_key(self, payload: str, image_format: str = 'png') -> str:
+        """Key of a barcode image, checking its parameters."""
+        return self.image_key('barcode', payload, None, self._check_format(image_format))
+
+    def qrcode_image(self, payload: str, size: int, image_format: str = 'png') -> Tuple[str, bytes]:
+        """QR code image and its key, rendered only if not cached."""
+        key = self.qrcode_key(payload, size, image_format)
+        return key, self._cached(key, lambda: render_qrcode(payload, size, image_format.lower()))
+
+    def barcode_image(self, payload: str, image_format: str = 'png') -> Tuple[str, bytes]:
+        """Barcode image and its key, rendered only if not cached."""
+        key = self.barcode_key(payload, image_format)
+        return key, self._cached(key, lambda: render_barcode(payload, image_format.lower()))
+
+    def _cached(self, key: str, render: Callable[[], bytes]) -> bytes:
+        image = self._cached_image(key)
+        if image is not None:
+            return image
+
+        # Rendered outside the lock; two threads may render the same image once each
+        image = render()
+        if len(image) > self.max_bytes:
+            return image
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = image
+                self._cached_bytes += len(image)
+                while self._cached_bytes > self.max_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        return image
+
+    def _cached_image(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def qrcode_images(self, payloads: List[str], size: int) -> Dict[str, bytes]:
+        """
+        PNG QR codes for many payloads, by payload.
+
+        Cached images are reused; the rest are rendered in parallel across the render
+        processes (or in this thread when there are only a few) and cached.
+        """
+        images: Dict[str, bytes] = {}
+        missing: List[str] = []
+        for payload in dict.fromkeys(payloads):
+            image = self._cached_image(self.qrcode_key(payload, size))
+            if image is None:
+                missing.append(payload)
+            else:
+                images[payload] = image
+
+        if len(missing) >= LABEL_POOL_MIN_IMAGES:
+            chunksize = max(1, len(missing) // (LABEL_RENDER_WORKERS * 4))
+            with self._render_pool.executor() as executor:
+                rendered = executor.map(render_qrcode, missing, [size] * len(missing), chunksize=chunksize)
+                self._cache_qrcodes(images, missing, rendered, size)
+        else:
+            self._cache_qrcodes(images, missing, (render_qrcode(payload, size) for payload in missing), size)
+        return images
+
+    def _cache_qrcodes(self, images: Dict[str, bytes], payloads: List[str],
+                       rendered: Iterable[bytes], size: int) -> None:
+        """Cache rendered QR codes and add them to images, consuming rendered as it arrives."""
+        for payload, image in zip(payloads, rendered):
+            images[payload] = self._cached(self.qrcode_key(payload, size), lambda: image)
+
+    def sheet_items(self, item_names: Optional[List[str]] = None,
+                    po_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Items to label, in order: the given names, or the line items of a purchase order.
+
+        Raises:
+            ValueError: If no items are given, there are too many, or some do not exist
+            LookupError: If the purchase order does not exist
+        """
+        if po_id is not None:
+            with self.db.get_cursor() as cursor:
+                cursor.execute("SELECT 1 FROM purchase_orders WHERE id = ?", (po_id,))
+                po_exists = cursor.fetchone() is not None
+                cursor.execute("SELECT item_name FROM purchase_order_items WHERE po_id = ? ORDER BY id", (po_id,))
+                item_names = [row['item_name'] for row in cursor.fetchall()]
+            if not po_exists:
+                raise LookupError(f"Purchase order {po_id} not found")
+        if not item_names:
+            raise ValueError("No items to label")
+        if len(item_names) > MAX_SHEET_LABELS:
+            raise ValueError(f"At most {MAX_SHEET_LABELS} labels per sheet request")
+
+        unique_names = list(dict.fromkeys(item_names))
+        found = {}
+        with self.db.get_cursor() as cursor:
+            for start in range(0, len(unique_names), 500):
+                batch = unique_names[start:start + 500]
+                cursor.execute(f"""
+                    SELECT item_name, quantity, group_name, reorder_level FROM items
+                    WHERE item_name IN ({','.join('?' for _ in batch)})
+                """, batch)
+                found.update((row['item_name'], dict(row)) for row in cursor.fetchall())
+
+        missing = [name for name in unique_names if name not in found]
+        if missing:
+            raise ValueError(f"Items not found: {', '.join(missing[:10])}"
+                             + (f" and {len(missing) - 10} more" if len(missing) > 10 else ""))
+        return [found[name] for name in item_names]
+
+    def write_label_sheet(self, items: List[Dict[str, Any]], include_qrcode: bool = True) -> str:
+        """
+        Lay labels out on Avery 5160-style sheets (3 x 10 per US letter page).
+
+        Args:
+            items: Items to label, one label each (see sheet_items)
+            include_qrcode: Print each item's QR code on the left of its label
+
+        Returns:
+            str: Path of a temporary PDF; the caller removes it
+        """
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from reportlab.pdfgen import canvas
+
+        images = {}
+        if include_qrcode:
+            payloads = [self._payload(item) for item in items]
+            rendered = self.qrcode_images(payloads, SHEET_QR_SIZE)
+            images = {payload: ImageReader(io.BytesIO(image)) for payload, image in rendered.items()}
+
+        def fit(text: str, font: str, font_size: float, width: float) -> str:
+            if stringWidth(text, font, font_size) <= width:
+                return text
+            while text and stringWidth(text + '...', font, font_size) > width:
+                text = text[:-1]
+            return text + '...'
+
+        handle, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(handle)
+        try:
+            pdf = canvas.Canvas(path, pagesize=letter)
+            page_height = letter[1]
+            per_page = SHEET_COLUMNS * SHEET_ROWS
+            qr_side = SHEET_LABEL_HEIGHT - 2 * SHEET_LABEL_PADDING
+            for index, item in enumerate(items):
+                if index and index % per_page == 0:
+                    pdf.showPage()
+                slot = index % per_page
+                x = SHEET_LEFT_MARGIN + (slot % SHEET_COLUMNS) * SHEET_COLUMN_PITCH
+                y = page_height - SHEET_TOP_MARGIN - (slot // SHEET_COLUMNS + 1) * SHEET_LABEL_HEIGHT
+
+                text_x = x + SHEET_LABEL_PADDING
+                if include_qrcode:
+                    pdf.drawImage(images[self._payload(item)], text_x, y + SHEET_LABEL_PADDING,
+                                  width=qr_side, height=qr_side)
+                    text_x += qr_side + SHEET_LABEL_PADDING
+                text_width = x + SHEET_LABEL_WIDTH - SHEET_LABEL_PADDING - text_x
+
+                pdf.setFont('Helvetica-Bold', 10)
+                pdf.drawString(text_x, y + 48, fit(item['item_name'], 'Helvetica-Bold', 10, text_width))
+                pdf.setFont('Helvetica', 8)
+                pdf.drawString(text_x, y + 34, f"Qty: {item['quantity']}")
+                pdf.drawString(text_x, y + 22, fit(f"Group: {item['group_name'] or 'N/A'}", 'Helvetica', 8, text_width))
+                pdf.drawString(text_x, y + 10, f"Reorder: {item['reorder_level'] if item['reorder_level'] is not None else 'N/A'}")
+            pdf.save()
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def shutdown(self) -> None:
+        """Stop the QR render processes."""
+        self._render_pool.shutdown()
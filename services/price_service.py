@@ -2,13 +2,83 @@
 
 import json
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
 
 from database.db_connection import DBConnection
 from models.price_entry import PriceEntry
 
 
+# Raw price_history rows younger than this are kept as-is; older rows are
+# folded into daily aggregates by compact_price_history().
+RAW_PRICE_RETENTION_DAYS = 30
+
+# Upper bound on the number of points returned by get_price_history()
+MAX_HISTORY_POINTS = 500
+
+# Daily OHLC roll-up of raw price_history rows, one row per item/supplier/day.
+# Raw timestamps mix 'T' and space separators, so they are ordered on datetime(timestamp).
+_DAILY_ROLLUP_SQL = """
+    SELECT DISTINCT
+        item_name,
+        COALESCE(supplier, 'default') AS supplier,
+        date(timestamp) AS day,
+        FIRST_VALUE(price) OVER w AS open_price,
+        MAX(price) OVER w AS high_price,
+        MIN(price) OVER w AS low_price,
+        LAST_VALUE(price) OVER w AS close_price,
+        AVG(price) OVER w AS avg_price,
+        COUNT(*) OVER w AS sample_count,
+        MIN(datetime(timestamp)) OVER w AS first_timestamp,
+        MAX(datetime(timestamp)) OVER w AS last_timestamp,
+        LAST_VALUE(quantity_at_time) OVER w AS close_quantity
+    FROM price_history
+    WHERE {where}
+    WINDOW w AS (
+        PARTITION BY item_name, COALESCE(supplier, 'default'), date(timestamp)
+        ORDER BY datetime(timestamp), id
+        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+    )
+"""
+
+
+def _bucket_start(day: str, resolution: str) -> str:
+    """Return the first day of the bucket that contains the given day."""
+    if resolution == 'weekly':
+        parsed = date.fromisoformat(day)
+        return (parsed - timedelta(days=parsed.weekday())).isoformat()
+    if resolution == 'monthly':
+        return f"{day[:7]}-01"
+    return day
+
+
+def _as_of_bounds(as_of: datetime) -> Tuple[datetime, str, str]:
+    """Normalise as_of to naive local time and return it with its next-day and second bounds."""
+    if as_of.tzinfo is not None:
+        as_of = as_of.astimezone().replace(tzinfo=None)
+    return as_of, (as_of.date() + timedelta(days=1)).isoformat(), as_of.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _merge_ohlc(current: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge two OHLC aggregates covering the same bucket."""
+    samples = current['sample_count'] + other['sample_count']
+    first = current if current['first_timestamp'] <= other['first_timestamp'] else other
+    last = current if current['last_timestamp'] >= other['last_timestamp'] else other
+    return {
+        **current,
+        'open_price': first['open_price'],
+        'high_price': max(current['high_price'], other['high_price']),
+        'low_price': min(current['low_price'], other['low_price']),
+        'close_price': last['close_price'],
+        'avg_price': (current['avg_price'] * current['sample_count'] +
+                      other['avg_price'] * other['sample_count']) / samples if samples else 0,
+        'sample_count': samples,
+        'first_timestamp': first['first_timestamp'],
+        'last_timestamp': last['last_timestamp'],
+        'close_quantity': last['close_quantity'],
+    }
+
+
 class PriceService:
     """Service class for price operations."""
     
@@ -84,6 +154,90 @@ class PriceService:
             )
             return True
     
+    def set_prices_bulk(self, entries: List[Tuple[str, Optional[str], float]]) -> Dict[str, Any]:
+        """
+        Set or update many unit prices in a single transaction.
+
+        Entries are staged and validated against items with one join; price
+        history and current prices are then written with executemany. Rows
+        that fail validation are reported and skipped, the rest are applied.
+
+        Args:
+            entries: List of (item_name, supplier, unit_price) tuples
+
+        Returns:
+            Dict[str, Any]: Number of prices updated and the failed rows with reasons
+        """
+        timestamp = datetime.now().isoformat()
+        failed = []
+        staged = []
+
+        for index, (item_name, supplier, price) in enumerate(entries):
+            if not item_name:
+                failed.append({'index': index, 'item_name': item_name, 'supplier': supplier,
+                               'reason': 'Missing item name'})
+            elif price is None or price < 0:
+                failed.append({'index': index, 'item_name': item_name, 'supplier': supplier,
+                               'reason': 'Price must be a non-negative number'})
+            else:
+                staged.append((index, item_name, supplier or 'default', float(price)))
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS staged_prices (
+                    idx INTEGER PRIMARY KEY,
+                    item_name TEXT NOT NULL,
+                    supplier TEXT NOT NULL,
+                    price REAL NOT NULL
+                )
+            """)
+            cursor.execute("DELETE FROM staged_prices")
+            cursor.executemany(
+                "INSERT INTO staged_prices (idx, item_name, supplier, price) VALUES (?, ?, ?, ?)",
+                staged
+            )
+
+            # Validate every staged row against items in one pass
+            cursor.execute("""
+                SELECT s.idx, s.item_name, s.supplier, s.price, i.quantity
+                FROM staged_prices s
+                LEFT JOIN items i ON i.item_name = s.item_name
+                ORDER BY s.idx
+            """)
+            valid = []
+            for row in cursor.fetchall():
+                if row['quantity'] is None:
+                    failed.append({'index': row['idx'], 'item_name': row['item_name'],
+                                   'supplier': row['supplier'], 'reason': 'Item not found'})
+                else:
+                    valid.append(row)
+
+            cursor.executemany(
+                """
+                INSERT INTO price_history (
+                    item_name, price, supplier, timestamp, is_unit_price, quantity_at_time
+                ) VALUES (?, ?, ?, ?, 1, ?)
+                """,
+                ((row['item_name'], row['price'], row['supplier'], timestamp, row['quantity'])
+                 for row in valid)
+            )
+            cursor.executemany(
+                """
+                INSERT INTO prices (item_name, price, supplier, date_updated, is_unit_price)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(item_name, supplier) DO UPDATE SET
+                    price = excluded.price,
+                    date_updated = excluded.date_updated,
+                    is_unit_price = 1
+                """,
+                ((row['item_name'], row['price'], row['supplier'], timestamp) for row in valid)
+            )
+            cursor.execute("DELETE FROM staged_prices")
+
+        failed.sort(key=lambda failure: failure['index'])
+        logging.info(f"Bulk price update: {len(valid)} updated, {len(failed)} failed")
+        return {'updated': len(valid), 'failed': failed}
+    
     def get_price(self, 
                   item_name: str, 
                   supplier: Optional[str] = None,
@@ -132,61 +286,395 @@ class PriceService:
     def get_price_history(self, 
                          item_name: str, 
                          supplier: Optional[str] = None,
-                         as_unit_price: bool = True) -> List[Dict[str, Any]]:
+                         as_unit_price: bool = True,
+                         start: Optional[datetime] = None,
+                         end: Optional[datetime] = None,
+                         max_points: int = MAX_HISTORY_POINTS) -> List[Dict[str, Any]]:
         """
         Get the price history for an item.
+
+        The resolution is chosen from the requested range: raw points when they
+        fit within max_points and none of the range has been compacted,
+        otherwise daily, weekly or monthly OHLC buckets.
         
         Args:
             item_name: Name of the item
             supplier: Filter by specific supplier (optional)
             as_unit_price: Whether to return unit prices (True) or total prices (False)
+            start: Start of the requested range (optional, defaults to the first recorded price)
+            end: End of the requested range (optional, defaults to now)
+            max_points: Maximum number of entries to return
             
         Returns:
-            List[Dict[str, Any]]: List of price history entries
+            List[Dict[str, Any]]: List of price history entries, newest first
         """
+        end = end or datetime.now()
+        supplier_params = (supplier,) if supplier else ()
+        daily_supplier_filter = " AND supplier = ?" if supplier else ""
+        raw_supplier_filter = " AND COALESCE(supplier, 'default') = ?" if supplier else ""
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT quantity FROM items WHERE item_name = ?", (item_name,))
+            quantity_result = cursor.fetchone()
+            current_quantity = quantity_result['quantity'] if quantity_result else 0
+
+            if start is None:
+                cursor.execute(
+                    """
+                    SELECT MIN(first) AS first FROM (
+                        SELECT MIN(day) AS first FROM price_history_daily WHERE item_name = ?
+                        UNION ALL
+                        SELECT MIN(timestamp) FROM price_history WHERE item_name = ?
+                    )
+                    """,
+                    (item_name, item_name)
+                )
+                first = cursor.fetchone()['first']
+                if not first:
+                    return []
+                start = datetime.fromisoformat(first)
+
+            start_day, end_day = start.date().isoformat(), end.date().isoformat()
+            # Timestamps are stored both as ISO strings ('T' separator) and as CURRENT_TIMESTAMP
+            # defaults (space separator), so rows are matched on the normalised datetime(timestamp).
+            # The plain text bounds around it cover the whole days of the range and keep the
+            # index range seek.
+            raw_where = (f"item_name = ? AND timestamp >= ? AND timestamp < ?"
+                         f" AND datetime(timestamp) BETWEEN ? AND ?{raw_supplier_filter}")
+            raw_params = (item_name, start_day, (end.date() + timedelta(days=1)).isoformat(),
+                          start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'),
+                          *supplier_params)
+
+            cursor.execute(
+                f"""
+                SELECT 1 FROM price_history_daily
+                WHERE item_name = ? AND day BETWEEN ? AND ?{daily_supplier_filter}
+                LIMIT 1
+                """,
+                (item_name, start_day, end_day, *supplier_params)
+            )
+            compacted = cursor.fetchone() is not None
+
+            if not compacted:
+                cursor.execute(
+                    f"""
+                    SELECT * FROM price_history
+                    WHERE {raw_where}
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                    """,
+                    (*raw_params, max_points + 1)
+                )
+                rows = cursor.fetchall()
+                if len(rows) <= max_points:
+                    return [self._raw_history_entry(row, current_quantity, as_unit_price) for row in rows]
+
+            span_days = (end.date() - start.date()).days + 1
+            if span_days <= max_points:
+                resolution = 'daily'
+            elif span_days <= max_points * 7:
+                resolution = 'weekly'
+            else:
+                resolution = 'monthly'
+
+            cursor.execute(
+                f"""
+                SELECT * FROM price_history_daily
+                WHERE item_name = ? AND day BETWEEN ? AND ?{daily_supplier_filter}
+                """,
+                (item_name, start_day, end_day, *supplier_params)
+            )
+            daily_rows = [dict(row) for row in cursor.fetchall()]
+
+            # Days that have not been compacted yet are rolled up on the fly
+            cursor.execute(_DAILY_ROLLUP_SQL.format(where=raw_where), raw_params)
+            daily_rows.extend(dict(row) for row in cursor.fetchall())
+
+        buckets = {}
+        for row in daily_rows:
+            key = (row['supplier'], _bucket_start(row['day'], resolution))
+            if key in buckets:
+                buckets[key] = _merge_ohlc(buckets[key], row)
+            else:
+                buckets[key] = {**row, 'day': key[1]}
+
+        newest_first = sorted(buckets.values(), key=lambda bucket: bucket['day'], reverse=True)
+        return [
+            self._bucket_history_entry(bucket, current_quantity, as_unit_price, resolution)
+            for bucket in newest_first[:max_points]
+        ]
+
+    def _raw_history_entry(self, row, current_quantity: int, as_unit_price: bool) -> Dict[str, Any]:
+        """Build a history entry from a raw price_history row."""
+        date_updated = datetime.fromisoformat(row['timestamp']) if row['timestamp'] else datetime.now()
+        quantity = row['quantity_at_time'] or current_quantity or 0
+        price = row['price']
+
+        if not as_unit_price and quantity > 0:
+            price = price * quantity
+
+        return {
+            'item_name': row['item_name'],
+            'price': price,
+            'supplier': row['supplier'],
+            'timestamp': date_updated.isoformat(),
+            'is_unit_price': as_unit_price,
+            'quantity': quantity,
+            'resolution': 'raw'
+        }
+
+    def _bucket_history_entry(self, bucket: Dict[str, Any], current_quantity: int,
+                              as_unit_price: bool, resolution: str) -> Dict[str, Any]:
+        """Build a history entry from an OHLC bucket."""
+        quantity = bucket['close_quantity'] or current_quantity or 0
+        factor = quantity if not as_unit_price and quantity > 0 else 1
+
+        return {
+            'item_name': bucket['item_name'],
+            'price': bucket['close_price'] * factor,
+            'supplier': bucket['supplier'],
+            'timestamp': bucket['day'],
+            'is_unit_price': as_unit_price,
+            'quantity': quantity,
+            'open': bucket['open_price'] * factor,
+            'high': bucket['high_price'] * factor,
+            'low': bucket['low_price'] * factor,
+            'close': bucket['close_price'] * factor,
+            'average': bucket['avg_price'] * factor,
+            'samples': bucket['sample_count'],
+            'resolution': resolution
+        }
+
+    def compact_price_history(self, raw_retention_days: int = RAW_PRICE_RETENTION_DAYS) -> Dict[str, int]:
+        """
+        Fold raw price history older than the retention window into daily aggregates.
+
+        Aggregates are merged into any existing row for the same item, supplier
+        and day, so the compaction can be re-run safely.
+
+        Args:
+            raw_retention_days: Number of days of raw price points to keep
+
+        Returns:
+            Dict[str, int]: Number of daily buckets written and raw rows removed
+        """
+        cutoff = (datetime.now() - timedelta(days=raw_retention_days)).strftime('%Y-%m-%d')
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO price_history_daily (
+                    item_name, supplier, day, open_price, high_price, low_price,
+                    close_price, avg_price, sample_count, first_timestamp,
+                    last_timestamp, close_quantity
+                )
+                {_DAILY_ROLLUP_SQL.format(where='timestamp < ?')}
+                ON CONFLICT(item_name, supplier, day) DO UPDATE SET
+                    open_price = CASE
+                        WHEN excluded.first_timestamp < price_history_daily.first_timestamp
+                        THEN excluded.open_price ELSE price_history_daily.open_price
+                    END,
+                    high_price = MAX(price_history_daily.high_price, excluded.high_price),
+                    low_price = MIN(price_history_daily.low_price, excluded.low_price),
+                    close_price = CASE
+                        WHEN excluded.last_timestamp >= price_history_daily.last_timestamp
+                        THEN excluded.close_price ELSE price_history_daily.close_price
+                    END,
+                    close_quantity = CASE
+                        WHEN excluded.last_timestamp >= price_history_daily.last_timestamp
+                        THEN excluded.close_quantity ELSE price_history_daily.close_quantity
+                    END,
+                    avg_price = (price_history_daily.avg_price * price_history_daily.sample_count
+                                 + excluded.avg_price * excluded.sample_count)
+                                / (price_history_daily.sample_count + excluded.sample_count),
+                    sample_count = price_history_daily.sample_count + excluded.sample_count,
+                    first_timestamp = MIN(price_history_daily.first_timestamp, excluded.first_timestamp),
+                    last_timestamp = MAX(price_history_daily.last_timestamp, excluded.last_timestamp)
+                """,
+                (cutoff,)
+            )
+            buckets_written = cursor.rowcount
+
+            cursor.execute("DELETE FROM price_history WHERE timestamp < ?", (cutoff,))
+            rows_compacted = cursor.rowcount
+
+        logging.info(
+            f"Compacted {rows_compacted} price history rows older than {cutoff} "
+            f"into {buckets_written} daily buckets"
+        )
+        return {'buckets_written': buckets_written, 'rows_compacted': rows_compacted}
+    
+    def get_price_as_of(self,
+                        item_name: str,
+                        as_of: datetime,
+                        supplier: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the price that was in effect for an item at a point in time.
+
+        Raw history answers to the exact timestamp; compacted history answers
+        with the closing price of the latest day that ended before as_of.
+        Timezone-aware values are converted to local time first.
+
+        Args:
+            item_name: Name of the item
+            as_of: Point in time to look up
+            supplier: Specific supplier (optional, if None the most recent price from any supplier)
+
+        Returns:
+            Optional[Dict[str, Any]]: Price, supplier and effective timestamp, or None if no price was set yet
+        """
+        # Timestamps are stored both as ISO strings ('T' separator) and as CURRENT_TIMESTAMP
+        # defaults (space separator), so they are compared and ordered on datetime(timestamp);
+        # the text bound on the following day keeps the index range seek.
+        as_of, next_day, as_of_ts = _as_of_bounds(as_of)
+
         with self.db.get_cursor() as cursor:
             if supplier:
                 cursor.execute(
                     """
-                    SELECT ph.*, i.quantity as current_quantity 
-                    FROM price_history ph
-                    LEFT JOIN items i ON i.item_name = ph.item_name
-                    WHERE ph.item_name = ? AND ph.supplier = ?
-                    ORDER BY ph.timestamp DESC
+                    SELECT price, COALESCE(supplier, 'default') AS supplier, timestamp AS effective_at,
+                           datetime(timestamp) AS effective_key
+                    FROM price_history
+                    WHERE item_name = ? AND COALESCE(supplier, 'default') = ?
+                      AND timestamp < ? AND datetime(timestamp) <= ?
+                    ORDER BY datetime(timestamp) DESC
+                    LIMIT 1
                     """,
-                    (item_name, supplier)
+                    (item_name, supplier, next_day, as_of_ts)
+                )
+                raw = cursor.fetchone()
+                cursor.execute(
+                    """
+                    SELECT close_price AS price, supplier, last_timestamp AS effective_at,
+                           datetime(last_timestamp) AS effective_key
+                    FROM price_history_daily
+                    WHERE item_name = ? AND supplier = ? AND day <= ?
+                      AND last_timestamp < ? AND datetime(last_timestamp) <= ?
+                    ORDER BY day DESC
+                    LIMIT 1
+                    """,
+                    (item_name, supplier, as_of.date().isoformat(), next_day, as_of_ts)
                 )
+                compacted = cursor.fetchone()
             else:
                 cursor.execute(
                     """
-                    SELECT ph.*, i.quantity as current_quantity
-                    FROM price_history ph
-                    LEFT JOIN items i ON i.item_name = ph.item_name
-                    WHERE ph.item_name = ?
-                    ORDER BY ph.timestamp DESC
+                    SELECT price, COALESCE(supplier, 'default') AS supplier, timestamp AS effective_at,
+                           datetime(timestamp) AS effective_key
+                    FROM price_history
+                    WHERE item_name = ? AND timestamp < ? AND datetime(timestamp) <= ?
+                    ORDER BY datetime(timestamp) DESC
+                    LIMIT 1
                     """,
-                    (item_name,)
+                    (item_name, next_day, as_of_ts)
                 )
-                
-            history = []
-            for row in cursor.fetchall():
-                date_updated = datetime.fromisoformat(row['timestamp']) if row['timestamp'] else datetime.now()
-                quantity = row['quantity_at_time'] or row['current_quantity'] or 0
-                price = row['price']
-                
-                if not as_unit_price and quantity > 0:
-                    price = price * quantity
-                
-                history.append({
+                raw = cursor.fetchone()
+                cursor.execute(
+                    """
+                    SELECT close_price AS price, supplier, last_timestamp AS effective_at,
+                           datetime(last_timestamp) AS effective_key
+                    FROM price_history_daily
+                    WHERE item_name = ? AND day <= ?
+                      AND last_timestamp < ? AND datetime(last_timestamp) <= ?
+                    ORDER BY day DESC, datetime(last_timestamp) DESC
+                    LIMIT 1
+                    """,
+                    (item_name, as_of.date().isoformat(), next_day, as_of_ts)
+                )
+                compacted = cursor.fetchone()
+
+        candidates = [row for row in (raw, compacted) if row]
+        if not candidates:
+            return None
+
+        row = max(candidates, key=lambda candidate: candidate['effective_key'])
+        return {
+            'item_name': item_name,
+            'price': row['price'],
+            'supplier': row['supplier'],
+            'effective_at': row['effective_at']
+        }
+
+    def get_prices_as_of(self,
+                         as_of: datetime,
+                         item_names: Optional[List[str]] = None,
+                         supplier: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the prices in effect at a point in time for many items at once.
+
+        All items are resolved in a single grouped pass over raw and compacted
+        history instead of one lookup per item. Timezone-aware values are
+        converted to local time first.
+
+        Args:
+            as_of: Point in time to look up
+            item_names: Items to look up (optional, defaults to every item with a price history)
+            supplier: Specific supplier (optional, if None the most recent price from any supplier)
+
+        Returns:
+            List[Dict[str, Any]]: One entry per item that had a price at as_of
+        """
+        # Compared on datetime(timestamp) as in get_price_as_of()
+        _, next_day, as_of_ts = _as_of_bounds(as_of)
+        filters = ""
+        params: List[Any] = []
+
+        if supplier:
+            filters += " AND supplier_key = ?"
+            params.append(supplier)
+
+        with self.db.get_cursor() as cursor:
+            if item_names is not None:
+                # Stage the requested items so the lookup stays one join
+                # regardless of how many names were asked for
+                cursor.execute("CREATE TEMP TABLE IF NOT EXISTS as_of_items (item_name TEXT PRIMARY KEY)")
+                cursor.execute("DELETE FROM as_of_items")
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO as_of_items (item_name) VALUES (?)",
+                    ((name,) for name in item_names)
+                )
+                filters += " AND item_name IN (SELECT item_name FROM as_of_items)"
+
+            cursor.execute(
+                f"""
+                WITH candidates AS (
+                    SELECT item_name, supplier_key AS supplier, price, timestamp AS effective_at,
+                           MAX(datetime(timestamp)) AS effective_key
+                    FROM (
+                        SELECT item_name, COALESCE(supplier, 'default') AS supplier_key, price, timestamp
+                        FROM price_history
+                        WHERE timestamp < ? AND datetime(timestamp) <= ?
+                    )
+                    WHERE 1=1{filters}
+                    GROUP BY item_name, supplier_key
+                    UNION ALL
+                    SELECT item_name, supplier_key AS supplier, close_price, last_timestamp,
+                           MAX(datetime(last_timestamp))
+                    FROM (
+                        SELECT item_name, supplier AS supplier_key, close_price, last_timestamp
+                        FROM price_history_daily
+                        WHERE last_timestamp < ? AND datetime(last_timestamp) <= ?
+                    )
+                    WHERE 1=1{filters}
+                    GROUP BY item_name, supplier_key
+                )
+                SELECT item_name, supplier, price, effective_at, MAX(effective_key) AS effective_key
+                FROM candidates
+                GROUP BY item_name
+                ORDER BY item_name
+                """,
+                (next_day, as_of_ts, *params, next_day, as_of_ts, *params)
+            )
+
+            return [
+                {
                     'item_name': row['item_name'],
-                    'price': price,
+                    'price': row['price'],
                     'supplier': row['supplier'],
-                    'timestamp': date_updated.isoformat(),
-                    'is_unit_price': as_unit_price,
-                    'quantity': quantity
-                })
-                
-            return history
+                    'effective_at': row['effective_at']
+                }
+                for row in cursor.fetchall()
+            ]
     
     def get_all_prices(self, as_unit_price: bool = True) -> Dict[str, List[PriceEntry]]:
         """
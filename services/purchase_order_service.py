@@ -0,0 +1,331 @@
+# services/purchase_order_service.py
+
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from database.db_connection import DBConnection
+from utils.pagination import encode_cursor, decode_cursor
+
+
+# Largest page of purchase orders; also keeps the line item IN (...) list under SQLite's
+# bound parameter limit
+MAX_PURCHASE_ORDER_PAGE = 500
+
+# How long a stored Idempotency-Key response is replayed for retries of the same request
+IDEMPOTENCY_KEY_RETENTION_HOURS = 24
+
+
+class IdempotencyKeyConflict(RuntimeError):
+    """Raised when an Idempotency-Key is reused for a different request."""
+
+
+class PurchaseOrderService:
+    """Service class for purchase order operations."""
+
+    def __init__(self):
+        """Initialize the purchase order service."""
+        self.db = DBConnection()
+
+    def list_purchase_orders(self, limit: int = 50, cursor: Optional[str] = None,
+                             status: Optional[str] = None, supplier_id: Optional[int] = None,
+                             include_items: bool = True) -> Dict[str, Any]:
+        """
+        Page through purchase orders, newest first, keyed on (created_at, id).
+
+        Line items for the whole page are loaded with a single po_id IN (...) query, so a
+        page costs two queries however many orders it holds.
+
+        Args:
+            limit: Page size
+            cursor: next_cursor from the previous page, or None for the first page
+            status: Only orders with this status
+            supplier_id: Only orders from this supplier
+            include_items: Attach each order's line items
+
+        Returns:
+            Dict[str, Any]: The page of orders and the cursor for the next page (None at the end)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        conditions = []
+        params: List[Any] = []
+
+        if status:
+            conditions.append("po.status = ?")
+            params.append(status)
+        if supplier_id:
+            conditions.append("po.supplier_id = ?")
+            params.append(supplier_id)
+        if cursor:
+            created_at, po_id = decode_cursor(cursor, 2)
+            conditions.append("(po.created_at, po.id) < (?, ?)")
+            params.extend([created_at, po_id])
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit + 1)
+
+        with self.db.get_cursor() as db_cursor:
+            db_cursor.execute(f"""
+                SELECT po.id, po.order_number, po.supplier_id, s.name AS supplier_name,
+                       po.location_id, l.name AS location_name, po.order_date,
+                       po.expected_delivery_date, po.actual_delivery_date, po.status,
+                       po.total_amount, po.shipping_cost, po.tax_amount, po.created_by,
+                       po.approved_by, po.received_by, po.created_at, po.updated_at, po.notes
+                FROM purchase_orders po
+                LEFT JOIN suppliers s ON po.supplier_id = s.id
+                LEFT JOIN locations l ON po.location_id = l.id
+                {where_clause}
+                ORDER BY po.created_at DESC, po.id DESC
+                LIMIT ?
+            """, params)
+            rows = db_cursor.fetchall()
+            page = rows[:limit]
+
+            items_by_po: Dict[int, List[Dict[str, Any]]] = {row['id']: [] for row in page}
+            if include_items and page:
+                db_cursor.execute(f"""
+                    SELECT id, po_id, item_name, quantity, unit_price, total_price,
+                           received_quantity, notes
+                    FROM purchase_order_items
+                    WHERE po_id IN ({','.join('?' for _ in page)})
+                    ORDER BY po_id, id
+                """, [row['id'] for row in page])
+                for item in db_cursor.fetchall():
+                    items_by_po[item['po_id']].append({
+                        "id": item['id'],
+                        "item_name": item['item_name'],
+                        "quantity": item['quantity'],
+                        "unit_price": item['unit_price'],
+                        "total_price": item['total_price'],
+                        "received_quantity": item['received_quantity'],
+                        "notes": item['notes']
+                    })
+
+        orders = []
+        for row in page:
+            order = dict(row)
+            if include_items:
+                order['items'] = items_by_po[row['id']]
+            orders.append(order)
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor([last['created_at'], last['id']])
+
+        return {"purchase_orders": orders, "count": len(orders), "next_cursor": next_cursor}
+
+    def receive_items(self, po_id: int, lines: List[Dict[str, Any]], user_name: str,
+                      idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Receive purchase order lines into stock in one short write transaction.
+
+        Line items, item stock, location stock (when the order has a location), the history
+        ledger and optional batches are each written with one executemany. The order becomes
+        'received' once every line is fully received; a partial receipt keeps its status.
+
+        Args:
+            po_id: Purchase order ID
+            lines: Received lines: item_name, quantity, and optionally po_item_id (needed when
+                the order has several lines for the item), batch_number, manufacturing_date
+                and expiry_date. A line with a batch_number creates (or tops up) that batch
+            user_name: User receiving the goods
+            idempotency_key: Client key of the request; a retry with the same key and lines
+                returns the first response instead of receiving again
+
+        Returns:
+            Dict[str, Any]: Receipt result with each line's received and outstanding quantity,
+                the order status and receipt_status ('partial' or 'complete')
+
+        Raises:
+            LookupError: If the purchase order does not exist
+            ValueError: If the order is cancelled or a line is unknown or over-received
+            IdempotencyKeyConflict: If the key was already used for different lines
+        """
+        scope = f"purchase_order_receive:{po_id}"
+        request_hash = hashlib.sha256(
+            json.dumps(lines, sort_keys=True, separators=(',', ':')).encode()
+        ).hexdigest()
+
+        with self.db.get_cursor() as cursor:
+            # Take the write lock first, so a concurrent retry waits and then finds the key
+            cursor.execute("BEGIN IMMEDIATE")
+
+            if idempotency_key:
+                cursor.execute("""
+                    SELECT request_hash, response FROM idempotency_keys
+                    WHERE scope = ? AND idempotency_key = ?
+                      AND created_at >= datetime('now', ?)
+                """, (scope, idempotency_key, f"-{IDEMPOTENCY_KEY_RETENTION_HOURS} hours"))
+                stored = cursor.fetchone()
+                if stored:
+                    if stored['request_hash'] != request_hash:
+                        raise IdempotencyKeyConflict("Idempotency-Key was already used for a different request")
+                    return dict(json.loads(stored['response']), replayed=True)
+
+            cursor.execute("""
+                SELECT id, order_number, supplier_id, location_id, status
+                FROM purchase_orders WHERE id = ?
+            """, (po_id,))
+            po = cursor.fetchone()
+            if not po:
+                raise LookupError(f"Purchase order {po_id} not found")
+            if po['status'] == 'cancelled':
+                raise ValueError("Cannot receive a cancelled purchase order")
+
+            cursor.execute("""
+                SELECT id, item_name, quantity, received_quantity, unit_price
+                FROM purchase_order_items WHERE po_id = ? ORDER BY id
+            """, (po_id,))
+            po_items = {row['id']: dict(row, received_quantity=row['received_quantity'] or 0)
+                        for row in cursor.fetchall()}
+            ids_by_name: Dict[str, List[int]] = {}
+            for po_item in po_items.values():
+                ids_by_name.setdefault(po_item['item_name'], []).append(po_item['id'])
+
+            receipts = []
+            for line in lines:
+                if line['quantity'] <= 0:
+                    raise ValueError(f"Quantity for {line['item_name']} must be positive")
+                po_item_id = line.get('po_item_id')
+                if po_item_id is None:
+                    candidates = ids_by_name.get(line['item_name'], [])
+                    if len(candidates) > 1:
+                        raise ValueError(f"{line['item_name']} is on several lines of this order; give po_item_id")
+                    po_item_id = candidates[0] if candidates else None
+                po_item = po_items.get(po_item_id)
+                if not po_item or po_item['item_name'] != line['item_name']:
+                    raise ValueError(f"{line['item_name']} is not on purchase order {po_id}")
+                outstanding = po_item['quantity'] - po_item['received_quantity']
+                if line['quantity'] > outstanding:
+                    raise ValueError(f"Receiving {line['quantity']} {line['item_name']} exceeds the "
+                                     f"{outstanding} outstanding")
+                po_item['received_quantity'] += line['quantity']
+                receipts.append(dict(line, po_item_id=po_item_id, unit_price=po_item['unit_price']))
+
+            if not receipts:
+                raise ValueError("No items to receive")
+
+            cursor.executemany("""
+                UPDATE purchase_order_items
+                SET received_quantity = COALESCE(received_quantity, 0) + :quantity
+                WHERE id = :po_item_id
+            """, receipts)
+
+            totals: Dict[str, int] = {}
+            for receipt in receipts:
+                totals[receipt['item_name']] = totals.get(receipt['item_name'], 0) + receipt['quantity']
+            cursor.executemany("""
+                INSERT INTO items (item_name, quantity) VALUES (?, ?)
+                ON CONFLICT(item_name) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, list(totals.items()))
+
+            if po['location_id'] is not None:
+                cursor.executemany("""
+                    INSERT INTO item_locations (item_name, location_id, quantity)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(item_name, location_id) DO UPDATE SET
+                        quantity = quantity + excluded.quantity,
+                        updated_at = datetime('now')
+                """, [(item_name, po['location_id'], quantity) for item_name, quantity in totals.items()])
+
+            batches = [receipt for receipt in receipts if receipt.get('batch_number')]
+            if batches:
+                # A repeated batch number tops up the batch, but only an active batch of the same
+                # item and expiry date; a recalled, quarantined or expired lot is never reactivated
+                batch_numbers = list(dict.fromkeys(receipt['batch_number'] for receipt in batches))
+                cursor.execute(f"""
+                    SELECT batch_number, item_name, status, expiry_date FROM batches
+                    WHERE batch_number IN ({','.join('?' for _ in batch_numbers)})
+                """, batch_numbers)
+                existing = {row['batch_number']: row for row in cursor.fetchall()}
+                for receipt in batches:
+                    batch = existing.get(receipt['batch_number'])
+                    if batch is None:
+                        continue
+                    if batch['item_name'] != receipt['item_name']:
+                        raise ValueError(f"Batch {receipt['batch_number']} is already used by a different item")
+                    if batch['status'] != 'active':
+                        raise ValueError(f"Batch {receipt['batch_number']} is {batch['status']} and cannot be topped up")
+                    if batch['expiry_date'] != receipt.get('expiry_date'):
+                        raise ValueError(f"Batch {receipt['batch_number']} expires on {batch['expiry_date']}, "
+                                         f"not {receipt.get('expiry_date')}")
+
+                cursor.executemany("""
+                    INSERT INTO batches (
+                        batch_number, item_name, location_id, quantity, manufacturing_date,
+                        expiry_date, supplier_id, cost_per_unit, notes
+                    )
+                    VALUES (:batch_number, :item_name, :location_id, :quantity, :manufacturing_date,
+                            :expiry_date, :supplier_id, :unit_price, :notes)
+                    ON CONFLICT(batch_number) DO UPDATE SET
+                        quantity = quantity + excluded.quantity,
+                        updated_at = datetime('now')
+                    WHERE batches.item_name = excluded.item_name
+                      AND batches.status = 'active'
+                      AND batches.expiry_date IS excluded.expiry_date
+                """, [{
+                    'batch_number': receipt['batch_number'],
+                    'item_name': receipt['item_name'],
+                    'location_id': po['location_id'],
+                    'quantity': receipt['quantity'],
+                    'manufacturing_date': receipt.get('manufacturing_date'),
+                    'expiry_date': receipt.get('expiry_date'),
+                    'supplier_id': po['supplier_id'],
+                    'unit_price': receipt['unit_price'],
+                    'notes': f"Received on {po['order_number']}"
+                } for receipt in batches])
+                if cursor.rowcount != len(batches):
+                    raise ValueError("A batch number is repeated with a different item or expiry date")
+
+            cursor.executemany("""
+                INSERT INTO history (action, item_name, quantity, group_name, user_name)
+                SELECT 'received_from_po', item_name, ?, group_name, ?
+                FROM items WHERE item_name = ?
+            """, [(receipt['quantity'], user_name, receipt['item_name']) for receipt in receipts])
+
+            complete = all(item['received_quantity'] >= item['quantity'] for item in po_items.values())
+            cursor.execute("""
+                UPDATE purchase_orders
+                SET status = CASE WHEN ? THEN 'received' ELSE status END,
+                    actual_delivery_date = CASE WHEN ? THEN date('now') ELSE actual_delivery_date END,
+                    received_by = ?, updated_at = datetime('now')
+                WHERE id = ?
+            """, (complete, complete, user_name, po_id))
+
+            result = {
+                "status": "success",
+                "po_id": po_id,
+                "order_number": po['order_number'],
+                "po_status": 'received' if complete else po['status'],
+                "receipt_status": 'complete' if complete else 'partial',
+                "received": [{
+                    "po_item_id": receipt['po_item_id'],
+                    "item_name": receipt['item_name'],
+                    "quantity": receipt['quantity'],
+                    "batch_number": receipt.get('batch_number')
+                } for receipt in receipts],
+                "lines": [{
+                    "po_item_id": item['id'],
+                    "item_name": item['item_name'],
+                    "ordered_quantity": item['quantity'],
+                    "received_quantity": item['received_quantity'],
+                    "outstanding_quantity": item['quantity'] - item['received_quantity']
+                } for item in po_items.values()],
+                "replayed": False
+            }
+
+            if idempotency_key:
+                cursor.execute("""
+                    DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)
+                """, (f"-{IDEMPOTENCY_KEY_RETENTION_HOURS} hours",))
+                cursor.execute("""
+                    INSERT INTO idempotency_keys (scope, idempotency_key, request_hash, response)
+                    VALUES (?, ?, ?, ?)
+                """, (scope, idempotency_key, request_hash, json.dumps(result)))
+
+        logging.info(f"Received {sum(totals.values())} units on {po['order_number']} ({result['receipt_status']})")
+        return result
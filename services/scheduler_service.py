@@ -0,0 +1,348 @@
+# services/scheduler_service.py
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from database.db_connection import DBConnection
+
+
+# Seconds between checks for due jobs
+SCHEDULER_POLL_SECONDS = 15
+
+# Run history older than this is pruned
+JOB_RUN_RETENTION_DAYS = 30
+
+_CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+
+def _format_time(moment: datetime) -> str:
+    return moment.isoformat(sep=' ', timespec='seconds')
+
+
+class CronSchedule:
+    """
+    Five-field cron expression (minute hour day-of-month month day-of-week).
+
+    Fields accept `*`, numbers, ranges (`1-5`), steps (`*/15`, `0-30/10`) and
+    comma-separated lists; day-of-week runs 0-6 from Sunday (7 is also Sunday).
+    As in cron, when both day fields are restricted a day matching either runs.
+    """
+
+    _FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        """Parse a cron expression or one of @hourly, @daily, @weekly, @monthly."""
+        self.expression = expression
+        fields = _CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(','):
+            spec, _, step = part.partition('/')
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(v) for v in spec.split('-', 1))
+            else:
+                start = end = int(spec)
+            step = int(step) if step else 1
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First time strictly after `moment` that matches the schedule."""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Skip whole months, days and hours that cannot match; bounded to a few years of search
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class _Job:
+    """A registered job."""
+
+    def __init__(self, name: str, schedule: CronSchedule, func: Callable[[], Any],
+                 jitter_seconds: int, lease_seconds: int):
+        self.name = name
+        self.schedule = schedule
+        self.func = func
+        self.jitter_seconds = jitter_seconds
+        self.lease_seconds = lease_seconds
+
+
+class SchedulerService:
+    """
+    In-process scheduler for periodic maintenance jobs.
+
+    Jobs run one at a time in a background thread, off the request path. Each
+    job's next due time and lease live in scheduled_jobs, so when several API
+    workers share the database only the worker that takes the lease runs a
+    given slot. Every run is recorded in job_runs with its timing.
+    """
+
+    def __init__(self, poll_seconds: int = SCHEDULER_POLL_SECONDS):
+        """Initialize the scheduler."""
+        self.db = DBConnection()
+        self.poll_seconds = poll_seconds
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._jobs: Dict[str, _Job] = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, schedule: str, func: Callable[[], Any],
+                 jitter_seconds: int = 0, lease_seconds: int = 3600) -> None:
+        """
+        Register a job.
+
+        Args:
+            name: Unique job name
+            schedule: Cron expression for when the job is due
+            func: Callable run with no arguments; its return value is stored with the run
+            jitter_seconds: Random delay of up to this many seconds added to each due time
+            lease_seconds: How long a runner may hold the job before others may take it over
+        """
+        self._jobs[name] = _Job(name, CronSchedule(schedule), func, jitter_seconds, lease_seconds)
+
+    def start(self) -> None:
+        """Record the registered jobs and start the scheduler thread."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        now = datetime.now()
+        with self.db.get_cursor() as cursor:
+            for job in self._jobs.values():
+                # A changed schedule takes effect immediately; otherwise keep the stored due time
+                cursor.execute("""
+                    INSERT INTO scheduled_jobs (job_name, schedule, next_run_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(job_name) DO UPDATE SET
+                        schedule = excluded.schedule,
+                        next_run_at = excluded.next_run_at,
+                        updated_at = datetime('now')
+                    WHERE scheduled_jobs.schedule != excluded.schedule
+                """, (job.name, job.schedule.expression, _format_time(self._next_due(job, now))))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+        logging.info(f"Scheduler {self.runner_id} started with jobs: {', '.join(sorted(self._jobs))}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop the scheduler thread, letting a running job finish.
+
+        Blocks for up to timeout seconds, so async callers should run it in a worker thread.
+        The scheduler thread closes its own database connection as it exits.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        logging.info(f"Scheduler {self.runner_id} stopped")
+
+    def trigger(self, name: str) -> bool:
+        """
+        Make a job due now; the scheduler thread picks it up on its next pass.
+
+        Returns:
+            bool: False if no such job is registered
+        """
+        if name not in self._jobs:
+            return False
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs SET next_run_at = ?, updated_at = datetime('now')
+                WHERE job_name = ?
+            """, (_format_time(datetime.now()), name))
+        self._wake.set()
+        return True
+
+    def _next_due(self, job: _Job, after: datetime) -> datetime:
+        due = job.schedule.next_after(after)
+        if job.jitter_seconds:
+            due += timedelta(seconds=random.uniform(0, job.jitter_seconds))
+        return due
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            for job in list(self._jobs.values()):
+                if self._stop.is_set():
+                    break
+                try:
+                    if self._acquire(job):
+                        self._run(job)
+                except Exception as e:
+                    logging.error(f"Scheduler error for job {job.name}: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+        self.db.close()
+
+    def _acquire(self, job: _Job) -> bool:
+        """Take the job's lease if it is due and nobody else holds it."""
+        now = datetime.now()
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE scheduled_jobs
+                SET lease_owner = ?, lease_until = ?
+                WHERE job_name = ? AND next_run_at <= ?
+                  AND (lease_until IS NULL OR lease_until < ? OR lease_owner = ?)
+            """, (self.runner_id, _format_time(now + timedelta(seconds=job.lease_seconds)),
+                  job.name, _format_time(now), _format_time(now), self.runner_id))
+            return cursor.rowcount == 1
+
+    def _run(self, job: _Job) -> None:
+        started = datetime.now()
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO job_runs (job_name, runner, status, started_at)
+                VALUES (?, ?, 'running', ?)
+            """, (job.name, self.runner_id, _format_time(started)))
+            run_id = cursor.lastrowid
+
+        clock = time.perf_counter()
+        status, result, error = 'success', None, None
+        try:
+            result = json.dumps(job.func(), default=str)
+        except Exception as e:
+            status, error = 'failed', f"{type(e).__name__}: {e}"
+            logging.error(f"Scheduled job {job.name} failed: {error}")
+        duration_ms = (time.perf_counter() - clock) * 1000
+
+        finished = datetime.now()
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE job_runs
+                SET status = ?, finished_at = ?, duration_ms = ?, result = ?, error = ?
+                WHERE id = ?
+            """, (status, _format_time(finished), round(duration_ms, 3), result, error, run_id))
+            cursor.execute("""
+                UPDATE scheduled_jobs
+                SET next_run_at = ?, lease_owner = NULL, lease_until = NULL, updated_at = datetime('now')
+                WHERE job_name = ? AND lease_owner = ?
+            """, (_format_time(self._next_due(job, finished)), job.name, self.runner_id))
+        logging.info(f"Scheduled job {job.name} {status} in {duration_ms:.1f} ms")
+
+    def prune_history(self, retention_days: int = JOB_RUN_RETENTION_DAYS) -> Dict[str, int]:
+        """Delete job run history older than the retention window."""
+        cutoff = _format_time(datetime.now() - timedelta(days=retention_days))
+        with self.db.get_cursor() as cursor:
+            cursor.execute("DELETE FROM job_runs WHERE started_at < ? AND status != 'running'", (cutoff,))
+            return {'deleted': cursor.rowcount}
+
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        """
+        Registered jobs with their schedule, lease and timing metrics.
+
+        Returns:
+            List[Dict[str, Any]]: One entry per job, with run counts, failures and
+            average/max/last duration over the retained history
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT j.job_name, j.schedule, j.next_run_at, j.lease_owner, j.lease_until,
+                       COUNT(r.id) AS runs,
+                       SUM(r.status = 'failed') AS failures,
+                       AVG(r.duration_ms) AS avg_duration_ms,
+                       MAX(r.duration_ms) AS max_duration_ms,
+                       MAX(r.started_at) AS last_started_at
+                FROM scheduled_jobs j
+                LEFT JOIN job_runs r ON r.job_name = j.job_name
+                GROUP BY j.job_name
+                ORDER BY j.job_name
+            """)
+            rows = cursor.fetchall()
+
+            jobs = []
+            for row in rows:
+                if row['job_name'] not in self._jobs:
+                    continue
+                cursor.execute("""
+                    SELECT status, duration_ms, error FROM job_runs
+                    WHERE job_name = ? ORDER BY started_at DESC, id DESC LIMIT 1
+                """, (row['job_name'],))
+                last = cursor.fetchone()
+                jobs.append({
+                    'job_name': row['job_name'],
+                    'schedule': row['schedule'],
+                    'next_run_at': row['next_run_at'],
+                    'running_on': row['lease_owner'],
+                    'lease_until': row['lease_until'],
+                    'runs': row['runs'],
+                    'failures': row['failures'] or 0,
+                    'avg_duration_ms': round(row['avg_duration_ms'], 3) if row['avg_duration_ms'] is not None else None,
+                    'max_duration_ms': row['max_duration_ms'],
+                    'last_started_at': row['last_started_at'],
+                    'last_status': last['status'] if last else None,
+                    'last_duration_ms': last['duration_ms'] if last else None,
+                    'last_error': last['error'] if last else None
+                })
+            return jobs
+
+    def get_runs(self, name: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent runs of a job, newest first."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, runner, status, started_at, finished_at, duration_ms, result, error
+                FROM job_runs
+                WHERE job_name = ?
+                ORDER BY started_at DESC, id DESC
+                LIMIT ?
+            """, (name, limit))
+            return [
+                {
+                    'id': row['id'],
+                    'runner': row['runner'],
+                    'status': row['status'],
+                    'started_at': row['started_at'],
+                    'finished_at': row['finished_at'],
+                    'duration_ms': row['duration_ms'],
+                    'result': json.loads(row['result']) if row['result'] else None,
+                    'error': row['error']
+                }
+                for row in cursor.fetchall()
+            ]
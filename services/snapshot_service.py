@@ -0,0 +1,344 @@
+# services/snapshot_service.py
+
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from database.db_connection import DBConnection
+from database.setup import SNAPSHOT_TABLE_KEYS
+from services.job_service import JobContext, JobService
+
+
+# Analytics snapshots, one directory per snapshot
+SNAPSHOT_DIR = "snapshots"
+
+# Tables exported at the same time, each on its own read connection
+SNAPSHOT_WORKERS = 4
+
+# Rows fetched and written per batch
+SNAPSHOT_CHUNK_ROWS = 50000
+
+# Snapshot files are kept this long; the newest completed snapshot is always kept
+SNAPSHOT_RETENTION_DAYS = 14
+
+# Background job type for analytics snapshots
+SNAPSHOT_JOB_TYPE = 'analytics_snapshot'
+
+# Parquet needs pyarrow; NDJSON (gzip) is always available
+SNAPSHOT_FORMATS = {'parquet': '.parquet', 'ndjson': '.ndjson.gz'}
+
+
+def _arrow_type(declared_type: str):
+    """Arrow type for a column from its declared SQLite type (by SQLite's affinity rules)."""
+    import pyarrow as pa
+
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type:
+        return pa.int64()
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return pa.string()
+
+
+def _write_parquet(path: str, columns: List[Tuple[str, str]], batches: Iterator[List[tuple]]) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, _arrow_type(declared_type)) for name, declared_type in columns])
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            values = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values[index], type=field.type) for index, field in enumerate(schema)],
+                schema=schema
+            ))
+            rows += len(batch)
+        if not rows:
+            writer.write_table(schema.empty_table())
+    return rows
+
+
+def _write_ndjson(path: str, columns: List[Tuple[str, str]], batches: Iterator[List[tuple]]) -> int:
+    names = [name for name, _ in columns]
+    rows = 0
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as output:
+        for batch in batches:
+            output.write(''.join(
+                json.dumps(dict(zip(names, row)), separators=(',', ':'), default=str) + '\n' for row in batch
+            ))
+            rows += len(batch)
+    return rows
+
+
+class SnapshotService:
+    """
+    Bulk snapshots of the inventory tables for the analytics warehouse.
+
+    A snapshot writes one file per table (Parquet, or gzipped NDJSON without pyarrow),
+    reading the tables in parallel on connections that share one consistent snapshot.
+    Triggers record the key of every changed row in snapshot_changes; each snapshot
+    claims the changes recorded so far, so an incremental snapshot exports just the rows
+    changed since the last completed one, plus the keys of deleted rows.
+    """
+
+    def __init__(self):
+        """Initialize the snapshot service."""
+        self.db = DBConnection()
+
+    @staticmethod
+    def default_format() -> str:
+        """Parquet when pyarrow is installed, NDJSON otherwise."""
+        return 'parquet' if importlib.util.find_spec('pyarrow') else 'ndjson'
+
+    def _check_format(self, file_format: Optional[str]) -> str:
+        file_format = (file_format or self.default_format()).lower()
+        if file_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unsupported snapshot format: {file_format}")
+        if file_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            raise ValueError("Parquet snapshots require the pyarrow package")
+        return file_format
+
+    def submit_snapshot(self, jobs: JobService, incremental: bool = True, file_format: Optional[str] = None,
+                        user_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a snapshot as a background job.
+
+        Args:
+            jobs: Job service that runs the snapshot
+            incremental: Only rows changed since the last completed snapshot (a full
+                snapshot is taken if there is none)
+            file_format: 'parquet' or 'ndjson' (defaults to parquet when available)
+            user_name: User who requested the snapshot
+
+        Returns:
+            Dict[str, Any]: The queued job
+        """
+        file_format = self._check_format(file_format)
+        return jobs.submit(SNAPSHOT_JOB_TYPE, {'incremental': incremental, 'format': file_format},
+                           user_name, total=len(SNAPSHOT_TABLE_KEYS))
+
+    def run_snapshot_job(self, job: JobContext) -> Dict[str, Any]:
+        """Job handler for snapshots; progress is counted in tables."""
+        done = 0
+        lock = threading.Lock()
+
+        def on_table(table: str) -> None:
+            nonlocal done
+            with lock:
+                done += 1
+                job.report(done, len(SNAPSHOT_TABLE_KEYS))
+
+        return self.create_snapshot(job.params.get('incremental', True), job.params.get('format'),
+                                    job.user_name, on_table)
+
+    def create_snapshot(self, incremental: bool = True, file_format: Optional[str] = None,
+                        user_name: Optional[str] = None,
+                        on_table: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Write a snapshot of the analytics tables.
+
+        Args:
+            incremental: Only rows changed since the last completed snapshot (a full
+                snapshot is taken if there is none)
+            file_format: 'parquet' or 'ndjson' (defaults to parquet when available)
+            user_name: User recorded on the snapshot
+            on_table: Called with each table's name once its files are written
+
+        Returns:
+            Dict[str, Any]: The completed snapshot
+        """
+        file_format = self._check_format(file_format)
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT MAX(id) AS id FROM snapshot_exports WHERE status = 'completed'")
+            since_id = cursor.fetchone()['id'] if incremental else None
+            kind = 'incremental' if since_id else 'full'
+            cursor.execute("""
+                INSERT INTO snapshot_exports (kind, file_format, since_id, created_by)
+                VALUES (?, ?, ?, ?)
+            """, (kind, file_format, since_id, user_name))
+            snapshot_id = cursor.lastrowid
+            path = os.path.join(SNAPSHOT_DIR, f"{snapshot_id:06d}")
+            cursor.execute("UPDATE snapshot_exports SET path = ? WHERE id = ?", (path, snapshot_id))
+            # Claim the changes recorded so far; later changes belong to the next snapshot
+            for table in SNAPSHOT_TABLE_KEYS:
+                cursor.execute("""
+                    UPDATE snapshot_changes SET change_seq = ?
+                    WHERE table_name = ? AND change_seq IS NULL
+                """, (snapshot_id, table))
+
+        try:
+            os.makedirs(path, exist_ok=True)
+            tables = self._export_tables(path, kind, file_format, since_id or 0, snapshot_id, on_table)
+            manifest = {
+                'snapshot_id': snapshot_id,
+                'kind': kind,
+                'format': file_format,
+                'since_snapshot_id': since_id,
+                'tables': tables
+            }
+            with open(os.path.join(path, 'manifest.json'), 'w') as output:
+                json.dump(manifest, output, indent=2)
+        except BaseException as e:
+            shutil.rmtree(path, ignore_errors=True)
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    UPDATE snapshot_exports SET status = 'failed', error = ?, finished_at = datetime('now')
+                    WHERE id = ?
+                """, (f"{type(e).__name__}: {e}", snapshot_id))
+            raise
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE snapshot_exports SET status = 'completed', tables = ?, finished_at = datetime('now')
+                WHERE id = ?
+            """, (json.dumps(tables), snapshot_id))
+        logging.info(f"Snapshot {snapshot_id} ({kind}, {file_format}) written to {path}")
+        return self.get_snapshot(snapshot_id)
+
+    def _export_tables(self, path: str, kind: str, file_format: str, since_id: int, snapshot_id: int,
+                       on_table: Optional[Callable[[str], None]]) -> Dict[str, Dict[str, Any]]:
+        pending: 'queue.Queue[str]' = queue.Queue()
+        for table in SNAPSHOT_TABLE_KEYS:
+            pending.put(table)
+        tables: Dict[str, Dict[str, Any]] = {}
+
+        def work(conn: sqlite3.Connection) -> None:
+            while True:
+                try:
+                    table = pending.get_nowait()
+                except queue.Empty:
+                    return
+                tables[table] = self._export_table(conn, table, path, kind, file_format, since_id, snapshot_id)
+                if on_table:
+                    on_table(table)
+
+        workers = min(SNAPSHOT_WORKERS, len(SNAPSHOT_TABLE_KEYS))
+        with self.db.snapshot_readers(workers) as readers:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as executor:
+                for future in [executor.submit(work, conn) for conn in readers]:
+                    future.result()
+        return {table: tables[table] for table in SNAPSHOT_TABLE_KEYS}
+
+    def _export_table(self, conn: sqlite3.Connection, table: str, path: str, kind: str, file_format: str,
+                      since_id: int, snapshot_id: int) -> Dict[str, Any]:
+        key_columns = SNAPSHOT_TABLE_KEYS[table]
+        columns = [(row['name'], row['type']) for row in conn.execute(f"PRAGMA table_info({table})")]
+        write = _write_parquet if file_format == 'parquet' else _write_ndjson
+        suffix = SNAPSHOT_FORMATS[file_format]
+
+        def batches(cursor: sqlite3.Cursor) -> Iterator[List[tuple]]:
+            while True:
+                batch = cursor.fetchmany(SNAPSHOT_CHUNK_ROWS)
+                if not batch:
+                    return
+                yield batch
+
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        if kind == 'full':
+            cursor.execute(f"SELECT * FROM {table}")
+        else:
+            join = ' AND '.join(f"t.{column} = json_extract(c.row_key, '$[{index}]')"
+                                for index, column in enumerate(key_columns))
+            cursor.execute(f"""
+                SELECT t.* FROM snapshot_changes c
+                JOIN {table} t ON {join}
+                WHERE c.table_name = ? AND c.change_seq > ? AND c.change_seq <= ? AND c.deleted = 0
+            """, (table, since_id, snapshot_id))
+        file_name = f"{table}{suffix}"
+        rows = write(os.path.join(path, file_name), columns, batches(cursor))
+        result = {'rows': rows, 'deleted': 0, 'files': [file_name]}
+
+        if kind == 'incremental':
+            cursor.execute("""
+                SELECT row_key FROM snapshot_changes
+                WHERE table_name = ? AND change_seq > ? AND change_seq <= ? AND deleted = 1
+            """, (table, since_id, snapshot_id))
+            key_types = dict(columns)
+            deleted_name = f"{table}.deleted{suffix}"
+            result['deleted'] = write(
+                os.path.join(path, deleted_name),
+                [(column, key_types[column]) for column in key_columns],
+                ([tuple(json.loads(row[0])) for row in batch] for batch in batches(cursor))
+            )
+            result['files'].append(deleted_name)
+
+        result['bytes'] = sum(os.path.getsize(os.path.join(path, name)) for name in result['files'])
+        return result
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'format': row['file_format'],
+            'since_snapshot_id': row['since_id'],
+            'status': row['status'],
+            'tables': json.loads(row['tables']) if row['tables'] else None,
+            'error': row['error'],
+            'created_by': row['created_by'],
+            'created_at': row['created_at'],
+            'finished_at': row['finished_at']
+        }
+
+    def get_snapshot(self, snapshot_id: int) -> Optional[Dict[str, Any]]:
+        """Get a snapshot with its tables' row counts and file names."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM snapshot_exports WHERE id = ?", (snapshot_id,))
+            row = cursor.fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_snapshots(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent snapshots, newest first."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM snapshot_exports ORDER BY id DESC LIMIT ?", (limit,))
+            return [self._to_dict(row) for row in cursor.fetchall()]
+
+    def file_path(self, snapshot_id: int, file_name: str) -> Optional[str]:
+        """Path of one of a completed snapshot's files, or None if it has no such file."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT path, tables FROM snapshot_exports WHERE id = ? AND status = 'completed'
+            """, (snapshot_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        names = {'manifest.json'}
+        for table in json.loads(row['tables']).values():
+            names.update(table['files'])
+        if file_name not in names:
+            return None
+        path = os.path.join(row['path'], file_name)
+        return path if os.path.exists(path) else None
+
+    def prune(self, retention_days: int = SNAPSHOT_RETENTION_DAYS) -> Dict[str, int]:
+        """
+        Delete snapshots older than the retention window, keeping the newest completed one,
+        and forget deletions that completed snapshots have already exported.
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT MAX(id) AS id FROM snapshot_exports WHERE status = 'completed'")
+            latest = cursor.fetchone()['id'] or 0
+            cursor.execute("""
+                SELECT id, path FROM snapshot_exports
+                WHERE id < ? AND COALESCE(finished_at, created_at) < datetime('now', ?)
+            """, (latest, f"-{retention_days} days"))
+            rows = cursor.fetchall()
+            cursor.executemany("DELETE FROM snapshot_exports WHERE id = ?", [(row['id'],) for row in rows])
+            cursor.execute("""
+                DELETE FROM snapshot_changes WHERE deleted = 1 AND change_seq <= ?
+            """, (latest,))
+            purged = cursor.rowcount
+        for row in rows:
+            if row['path']:
+                shutil.rmtree(row['path'], ignore_errors=True)
+        return {'deleted': len(rows), 'purged_deletions': purged}
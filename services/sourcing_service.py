@@ -0,0 +1,564 @@
+# services/sourcing_service.py
+
+import json
+import logging
+from threading import Lock
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple
+
+import numpy as np
+
+from database.db_connection import DBConnection
+from utils.geo import GridIndex, haversine_matrix
+
+
+# Upper bound on improvement rounds in each phase of the basket local search
+MAX_OPTIMIZER_ROUNDS = 200
+
+# Upper bound on suppliers banned for falling below their minimum order value
+MAX_SUPPLIER_BAN_ROUNDS = 10
+
+# Cell size in degrees of the supplier proximity grid (about 111 km of latitude)
+SUPPLIER_GRID_CELL_DEG = 1.0
+
+
+class _Basket(NamedTuple):
+    """
+    Sparse cost model for one basket. Each entry of the offer arrays is one
+    (line, supplier) option; shipping is charged once per (supplier, location)
+    pair that is used.
+    """
+    line: np.ndarray             # (offers,) basket line, numbered over lines that have offers
+    line_start: np.ndarray       # (lines,) first offer of each line; offers are grouped by line
+    supplier: np.ndarray         # (offers,) supplier column
+    cost: np.ndarray             # (offers,) unit price times quantity rounded up to the MOQ
+    pair: np.ndarray             # (offers,) flat index into shipping
+    shipping: np.ndarray         # (suppliers, locations)
+    min_order_value: np.ndarray  # (suppliers,)
+    n_lines: int
+
+
+class SourcingService:
+    """Service class for choosing suppliers across a basket of items."""
+
+    def __init__(self):
+        """Initialize the sourcing service."""
+        self.db = DBConnection()
+        self._supplier_grid: Optional[GridIndex] = None
+        self._supplier_grid_lock = Lock()
+
+    def invalidate_supplier_grid(self) -> None:
+        """Drop the cached supplier proximity grid; it is rebuilt on the next nearest-supplier query."""
+        with self._supplier_grid_lock:
+            self._supplier_grid = None
+
+    def _get_supplier_grid(self) -> GridIndex:
+        """Grid of active suppliers that have coordinates, built on first use."""
+        with self._supplier_grid_lock:
+            if self._supplier_grid is None:
+                with self.db.get_cursor() as cursor:
+                    cursor.execute("""
+                        SELECT id, latitude, longitude FROM suppliers
+                        WHERE is_active = 1 AND latitude IS NOT NULL AND longitude IS NOT NULL
+                    """)
+                    grid = GridIndex(SUPPLIER_GRID_CELL_DEG)
+                    grid.insert_many((row['id'], row['latitude'], row['longitude']) for row in cursor.fetchall())
+                self._supplier_grid = grid
+                logging.info(f"Built supplier proximity grid with {len(grid)} suppliers")
+            return self._supplier_grid
+
+    def refresh_supplier_distances(self, create_missing: bool = False) -> Dict[str, int]:
+        """
+        Recompute supplier_locations.distance_km from supplier and location coordinates.
+
+        Distances for every supplier x location pair are computed in one vectorized
+        haversine pass; existing links are then updated with executemany.
+
+        Args:
+            create_missing: Also create links for pairs that have none yet
+
+        Returns:
+            Dict[str, int]: Counts of suppliers, locations, links updated and links created
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, latitude, longitude FROM suppliers
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                ORDER BY id
+            """)
+            suppliers = cursor.fetchall()
+            cursor.execute("""
+                SELECT id, latitude, longitude FROM locations
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                ORDER BY id
+            """)
+            locations = cursor.fetchall()
+
+            result = {'suppliers': len(suppliers), 'locations': len(locations), 'updated': 0, 'created': 0}
+            if not suppliers or not locations:
+                return result
+
+            distances = haversine_matrix(
+                [row['latitude'] for row in suppliers], [row['longitude'] for row in suppliers],
+                [row['latitude'] for row in locations], [row['longitude'] for row in locations]
+            )
+            supplier_row = {row['id']: i for i, row in enumerate(suppliers)}
+            location_col = {row['id']: k for k, row in enumerate(locations)}
+
+            cursor.execute("SELECT supplier_id, location_id FROM supplier_locations")
+            linked = {(row['supplier_id'], row['location_id']) for row in cursor.fetchall()}
+
+            updates = [
+                (round(float(distances[supplier_row[s], location_col[l]]), 2), s, l)
+                for s, l in linked if s in supplier_row and l in location_col
+            ]
+            cursor.executemany("""
+                UPDATE supplier_locations
+                SET distance_km = ?, updated_at = datetime('now')
+                WHERE supplier_id = ? AND location_id = ?
+            """, updates)
+            result['updated'] = len(updates)
+
+            if create_missing:
+                missing = [
+                    (s['id'], l['id'], round(float(distances[i, k]), 2))
+                    for i, s in enumerate(suppliers) for k, l in enumerate(locations)
+                    if (s['id'], l['id']) not in linked
+                ]
+                cursor.executemany("""
+                    INSERT INTO supplier_locations (supplier_id, location_id, distance_km)
+                    VALUES (?, ?, ?)
+                """, missing)
+                result['created'] = len(missing)
+
+        logging.info(f"Refreshed supplier distances: {result}")
+        return result
+
+    def nearest_suppliers(self, location_id: int, item_name: Optional[str] = None,
+                          limit: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """
+        Find the active suppliers closest to a location, optionally only those carrying an item.
+
+        Args:
+            location_id: ID of the delivery location
+            item_name: Only consider suppliers with this item available in their catalogue
+            limit: Number of suppliers to return
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: Suppliers nearest first, or None if the location does not exist
+
+        Raises:
+            ValueError: If the location has no coordinates
+        """
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT latitude, longitude FROM locations WHERE id = ?", (location_id,))
+            location = cursor.fetchone()
+
+            offers = None
+            if location and item_name is not None:
+                cursor.execute("""
+                    SELECT supplier_id, unit_price, minimum_order_quantity
+                    FROM supplier_products
+                    WHERE item_name = ? AND is_available = 1
+                """, (item_name,))
+                offers = {row['supplier_id']: row for row in cursor.fetchall()}
+
+        if not location:
+            return None
+        if location['latitude'] is None or location['longitude'] is None:
+            raise ValueError("Location has no coordinates")
+
+        grid = self._get_supplier_grid()
+        nearest = grid.nearest(location['latitude'], location['longitude'], limit,
+                               accept=None if offers is None else offers.__contains__)
+        if not nearest:
+            return []
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT s.id, s.name, s.rating, s.lead_time_days, s.minimum_order_value,
+                       sl.shipping_cost, sl.estimated_delivery_days
+                FROM suppliers s
+                LEFT JOIN supplier_locations sl ON sl.supplier_id = s.id AND sl.location_id = ?
+                WHERE s.id IN (SELECT value FROM json_each(?))
+            """, (location_id, json.dumps([supplier_id for supplier_id, _ in nearest])))
+            details = {row['id']: row for row in cursor.fetchall()}
+
+        suppliers = []
+        for supplier_id, distance in nearest:
+            row = details.get(supplier_id)
+            if row is None:
+                continue
+            supplier = {
+                'supplier_id': supplier_id,
+                'supplier_name': row['name'],
+                'distance_km': round(distance, 2),
+                'rating': row['rating'],
+                'lead_time_days': row['lead_time_days'],
+                'minimum_order_value': row['minimum_order_value'],
+                'shipping_cost': row['shipping_cost'],
+                'estimated_delivery_days': row['estimated_delivery_days']
+            }
+            if offers is not None:
+                supplier['unit_price'] = offers[supplier_id]['unit_price']
+                supplier['minimum_order_quantity'] = offers[supplier_id]['minimum_order_quantity']
+            suppliers.append(supplier)
+        return suppliers
+
+    def optimize_basket(self, lines: List[Tuple[str, int, Optional[int]]]) -> Dict[str, Any]:
+        """
+        Assign each basket line to a supplier so that the total landed cost is minimal.
+
+        Line cost is the supplier's unit price times the quantity rounded up to the
+        minimum order quantity. Shipping from supplier_locations is charged once per
+        supplier and delivery location that is used. A supplier whose order falls
+        below its minimum order value is charged the shortfall as a surcharge.
+
+        The assignment is found with a vectorized local search, so it is a good
+        solution rather than a proven optimum.
+
+        Args:
+            lines: List of (item_name, quantity, location_id) tuples
+
+        Returns:
+            Dict[str, Any]: Per-line assignments, per-supplier orders and cost totals
+        """
+        item_names = sorted({item_name for item_name, _, _ in lines})
+        location_ids = sorted({location_id for _, _, location_id in lines if location_id is not None})
+
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT sp.supplier_id, sp.item_name, sp.unit_price,
+                       COALESCE(sp.minimum_order_quantity, 1) AS minimum_order_quantity,
+                       s.name AS supplier_name,
+                       COALESCE(s.minimum_order_value, 0) AS minimum_order_value
+                FROM supplier_products sp
+                JOIN suppliers s ON s.id = sp.supplier_id
+                WHERE sp.item_name IN (SELECT value FROM json_each(?))
+                  AND sp.is_available = 1 AND s.is_active = 1
+            """, (json.dumps(item_names),))
+            offers = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT supplier_id, location_id, COALESCE(shipping_cost, 0) AS shipping_cost
+                FROM supplier_locations
+                WHERE location_id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(location_ids),))
+            shipping_rows = cursor.fetchall()
+
+        supplier_ids = sorted({row['supplier_id'] for row in offers})
+        supplier_index = {supplier_id: j for j, supplier_id in enumerate(supplier_ids)}
+        supplier_names = {row['supplier_id']: row['supplier_name'] for row in offers}
+        # Column 0 stands for lines without a delivery location (no shipping)
+        location_index = {location_id: k + 1 for k, location_id in enumerate(location_ids)}
+        item_index = {item_name: n for n, item_name in enumerate(item_names)}
+        n_suppliers, n_locations = len(supplier_ids), len(location_ids) + 1
+
+        min_order_value = np.zeros(n_suppliers)
+        for row in offers:
+            min_order_value[supplier_index[row['supplier_id']]] = row['minimum_order_value']
+
+        shipping = np.zeros((n_suppliers, n_locations))
+        for row in shipping_rows:
+            j = supplier_index.get(row['supplier_id'])
+            if j is not None:
+                shipping[j, location_index[row['location_id']]] = row['shipping_cost']
+
+        # Sort catalogue offers by item so each item's offers form one contiguous run
+        offer_item = np.array([item_index[row['item_name']] for row in offers], dtype=np.int64)
+        by_item = np.argsort(offer_item, kind='stable')
+        offer_item = offer_item[by_item]
+        offer_supplier = np.array([supplier_index[row['supplier_id']] for row in offers], dtype=np.int64)[by_item]
+        offer_price = np.array([row['unit_price'] for row in offers], dtype=float)[by_item]
+        offer_moq = np.array([max(row['minimum_order_quantity'], 1) for row in offers], dtype=float)[by_item]
+        item_count = np.bincount(offer_item, minlength=len(item_names))
+        item_start = np.cumsum(item_count) - item_count
+
+        # Expand to one option per (basket line, offer of the line's item)
+        line_item = np.array([item_index[item_name] for item_name, _, _ in lines], dtype=np.int64)
+        line_qty = np.array([quantity for _, quantity, _ in lines], dtype=float)
+        line_loc = np.array([location_index.get(location_id, 0) for _, _, location_id in lines], dtype=np.int64)
+        per_line = item_count[line_item]
+        option_line = np.repeat(np.arange(len(lines)), per_line)
+        option_offer = (np.repeat(item_start[line_item], per_line)
+                        + np.arange(per_line.sum()) - np.repeat(np.cumsum(per_line) - per_line, per_line))
+        option_supplier = offer_supplier[option_offer]
+        option_qty = np.maximum(line_qty[option_line], offer_moq[option_offer])
+        option_cost = offer_price[option_offer] * option_qty
+
+        # Lines nobody offers are reported as unassigned and left out of the search
+        feasible = per_line > 0
+        search_line = np.cumsum(feasible) - 1
+        basket = _Basket(
+            line=search_line[option_line],
+            line_start=(np.cumsum(per_line) - per_line)[feasible],
+            supplier=option_supplier,
+            cost=option_cost,
+            pair=option_supplier * n_locations + line_loc[option_line],
+            shipping=shipping,
+            min_order_value=min_order_value,
+            n_lines=int(feasible.sum())
+        )
+
+        chosen = np.full(len(lines), -1)
+        if basket.n_lines > 0:
+            chosen[feasible] = self._optimize(basket)
+
+        return self._summarize(lines, supplier_ids, supplier_names, chosen, option_supplier, option_cost,
+                               option_qty, offer_price[option_offer], shipping, min_order_value, line_loc)
+
+    def _optimize(self, basket: _Basket) -> np.ndarray:
+        """Search for the cheapest choice of option per line, banning suppliers that only add surcharges."""
+        allowed = np.ones(len(basket.min_order_value), dtype=bool)
+        chosen, total = self._search(basket, allowed)
+        best = (allowed, chosen, total)
+
+        # Banning one short supplier often just moves its lines to another short
+        # supplier, so keep banning the worst offender and remember the cheapest result
+        for _ in range(MAX_SUPPLIER_BAN_ROUNDS):
+            bannable = [j for j in self._suppliers_below_minimum(basket, chosen)
+                        if self._still_covered(basket, allowed, j)]
+            if not bannable:
+                break
+            allowed = allowed.copy()
+            allowed[bannable[0]] = False
+            chosen, total = self._search(basket, allowed)
+            if total < best[2] - 1e-9:
+                best = (allowed, chosen, total)
+
+        # Re-admit any banned supplier whose return lowers the total
+        allowed, chosen, total = best
+        for j in np.flatnonzero(~allowed):
+            trial = allowed.copy()
+            trial[j] = True
+            trial_chosen, trial_total = self._search(basket, trial)
+            if trial_total < total - 1e-9:
+                allowed, chosen, total = trial, trial_chosen, trial_total
+
+        return chosen
+
+    def _search(self, basket: _Basket, allowed: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Open supplier/location pairs, improve them, then refine single lines on the exact cost."""
+        usable = allowed[basket.supplier]
+        open_pairs = self._greedy_open(basket, usable)
+        open_pairs = self._improve(basket, usable, open_pairs)
+        chosen = self._cheapest_per_line(basket, basket.cost, usable & open_pairs[basket.pair])
+        chosen = self._refine(basket, usable, chosen)
+        return chosen, self._total_cost(basket, chosen)
+
+    @staticmethod
+    def _cheapest_per_line(basket: _Basket, values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Option with the lowest value per line among masked options, -1 where a line has none."""
+        masked = np.where(mask, values, np.inf)
+        line_min = np.minimum.reduceat(masked, basket.line_start)
+        hit = mask & (masked == line_min[basket.line])
+        n_options = len(values)
+        first_hit = np.minimum.reduceat(np.where(hit, np.arange(n_options), n_options), basket.line_start)
+        return np.where(first_hit < n_options, first_hit, -1)
+
+    @staticmethod
+    def _still_covered(basket: _Basket, allowed: np.ndarray, banned: int) -> bool:
+        """Whether every line keeps at least one option once `banned` is also excluded."""
+        usable = allowed[basket.supplier]
+        options_per_line = np.bincount(basket.line[usable], minlength=basket.n_lines)
+        lines_of_banned = basket.line[usable & (basket.supplier == banned)]
+        return bool((options_per_line[lines_of_banned] > 1).all())
+
+    @staticmethod
+    def _greedy_open(basket: _Basket, usable: np.ndarray) -> np.ndarray:
+        """At every location at once, keep opening the pair that saves the most until none helps."""
+        shipping = basket.shipping.ravel()
+        n_suppliers, n_locations = basket.shipping.shape
+        locations = np.arange(n_locations)
+
+        # Uncovered lines count as costing more than any real option, so covering them always pays
+        uncovered = np.zeros(basket.n_lines)
+        np.maximum.at(uncovered, basket.line, basket.cost)
+        uncovered += shipping.max(initial=0.0) + 1.0
+        current = uncovered.copy()
+        open_pairs = np.zeros(len(shipping), dtype=bool)
+
+        for _ in range(MAX_OPTIMIZER_ROUNDS):
+            savings = np.where(usable, np.maximum(current[basket.line] - basket.cost, 0.0), 0.0)
+            gain = np.bincount(basket.pair, weights=savings, minlength=len(shipping)) - shipping
+            gain[open_pairs] = -np.inf
+            gain = gain.reshape(n_suppliers, n_locations)
+            best_supplier = np.argmax(gain, axis=0)
+            take = gain[best_supplier, locations] > 1e-9
+            if not take.any():
+                break
+            open_pairs[(best_supplier * n_locations + locations)[take]] = True
+            reachable = usable & open_pairs[basket.pair]
+            current = uncovered.copy()
+            np.minimum.at(current, basket.line[reachable], basket.cost[reachable])
+
+        return open_pairs
+
+    def _improve(self, basket: _Basket, usable: np.ndarray, open_pairs: np.ndarray) -> np.ndarray:
+        """Open or close one pair per location per round while that lowers line and shipping cost."""
+        shipping = basket.shipping.ravel()
+        n_suppliers, n_locations = basket.shipping.shape
+        locations = np.arange(n_locations)
+
+        for _ in range(MAX_OPTIMIZER_ROUNDS):
+            current = self._cheapest_per_line(basket, basket.cost, usable & open_pairs[basket.pair])
+            best = basket.cost[current]
+            current_pair = basket.pair[current]
+
+            # Closing a pair saves its shipping but moves its lines to their best other option,
+            # paying that option's shipping if its pair is not open yet (counted per line,
+            # so the estimate errs on the side of keeping the pair)
+            fallback_value = basket.cost + np.where(open_pairs[basket.pair], 0.0, shipping[basket.pair])
+            fallback = self._cheapest_per_line(basket, fallback_value,
+                                               usable & (basket.pair != current_pair[basket.line]))
+            penalty = np.where(fallback >= 0, fallback_value[fallback] - best, np.inf)
+            close_gain = np.where(open_pairs,
+                                  shipping - np.bincount(current_pair, weights=penalty, minlength=len(shipping)),
+                                  -np.inf)
+
+            # Opening a pair costs its shipping but lets lines at that location switch to it
+            savings = np.where(usable, np.maximum(best[basket.line] - basket.cost, 0.0), 0.0)
+            open_gain = np.where(open_pairs, -np.inf,
+                                 np.bincount(basket.pair, weights=savings, minlength=len(shipping)) - shipping)
+
+            gain = np.maximum(close_gain, open_gain).reshape(n_suppliers, n_locations)
+            best_supplier = np.argmax(gain, axis=0)
+            take = gain[best_supplier, locations] > 1e-9
+            if not take.any():
+                break
+            toggle = (best_supplier * n_locations + locations)[take]
+            closing = np.zeros(len(shipping), dtype=bool)
+            closing[toggle[open_pairs[toggle]]] = True
+            open_pairs[toggle] = ~open_pairs[toggle]
+            open_pairs[basket.pair[fallback[closing[current_pair]]]] = True
+
+        return open_pairs
+
+    def _refine(self, basket: _Basket, usable: np.ndarray, chosen: np.ndarray) -> np.ndarray:
+        """Move single lines between suppliers while that lowers the exact landed cost."""
+        shipping = basket.shipping.ravel()
+        min_order_value = basket.min_order_value
+        n_suppliers = len(min_order_value)
+        supplier, pair = basket.supplier, basket.pair
+        chosen = chosen.copy()
+
+        for _ in range(MAX_OPTIMIZER_ROUNDS):
+            current, current_supplier, current_pair = basket.cost[chosen], supplier[chosen], pair[chosen]
+            subtotal = np.bincount(current_supplier, weights=current, minlength=n_suppliers)
+            line_count = np.bincount(current_supplier, minlength=n_suppliers)
+            pair_count = np.bincount(current_pair, minlength=len(shipping))
+            surcharge = np.where(line_count > 0, np.maximum(min_order_value - subtotal, 0.0), 0.0)
+
+            # Change in cost from taking each line away from its current supplier
+            j = current_supplier
+            leave = -current - surcharge[j]
+            leave += np.where(line_count[j] > 1, np.maximum(min_order_value[j] - (subtotal[j] - current), 0.0), 0.0)
+            leave -= np.where(pair_count[current_pair] == 1, shipping[current_pair], 0.0)
+
+            # Change in cost from giving each line to each of its other options
+            join = (basket.cost + np.maximum(min_order_value[supplier] - (subtotal[supplier] + basket.cost), 0.0)
+                    - surcharge[supplier] + np.where(pair_count[pair] > 0, 0.0, shipping[pair]))
+            delta = leave[basket.line] + join
+
+            target = self._cheapest_per_line(basket, delta, usable & (supplier != current_supplier[basket.line]))
+            movable = np.flatnonzero(target >= 0)
+            gain = delta[target[movable]]
+            movable = movable[gain < -1e-9]
+            if len(movable) == 0:
+                break
+
+            # Moves between disjoint suppliers do not affect each other, so apply them together
+            touched = set()
+            for line in movable[np.argsort(delta[target[movable]])]:
+                source, destination = int(current_supplier[line]), int(supplier[target[line]])
+                if source in touched or destination in touched:
+                    continue
+                touched.update((source, destination))
+                chosen[line] = target[line]
+
+        return chosen
+
+    @staticmethod
+    def _supplier_totals(basket: _Basket, chosen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-supplier subtotal and whether each supplier is used by a choice of options."""
+        n_suppliers = len(basket.min_order_value)
+        subtotal = np.bincount(basket.supplier[chosen], weights=basket.cost[chosen], minlength=n_suppliers)
+        used = np.bincount(basket.supplier[chosen], minlength=n_suppliers) > 0
+        return subtotal, used
+
+    def _total_cost(self, basket: _Basket, chosen: np.ndarray) -> float:
+        """Landed cost of a choice of options: lines, shipping per used pair and minimum order surcharges."""
+        subtotal, used = self._supplier_totals(basket, chosen)
+        surcharge = np.where(used, np.maximum(basket.min_order_value - subtotal, 0.0), 0.0)
+        shipping = basket.shipping.ravel()[np.unique(basket.pair[chosen])]
+        return float(subtotal.sum() + shipping.sum() + surcharge.sum())
+
+    def _suppliers_below_minimum(self, basket: _Basket, chosen: np.ndarray) -> np.ndarray:
+        """Used suppliers whose order falls short of their minimum order value, largest shortfall first."""
+        subtotal, used = self._supplier_totals(basket, chosen)
+        shortfall = np.where(used, basket.min_order_value - subtotal, 0.0)
+        short = np.flatnonzero(shortfall > 0)
+        return short[np.argsort(-shortfall[short])]
+
+    @staticmethod
+    def _summarize(lines, supplier_ids, supplier_names, chosen, option_supplier, option_cost,
+                   option_qty, option_price, shipping, min_order_value, line_loc) -> Dict[str, Any]:
+        """Build the response payload from the chosen option of every line."""
+        assignments = []
+        unassigned = []
+        orders: Dict[int, Dict[str, Any]] = {}
+        used_pairs = set()
+
+        for i, (item_name, quantity, location_id) in enumerate(lines):
+            option = int(chosen[i])
+            if option < 0:
+                unassigned.append({'line': i, 'item_name': item_name, 'quantity': quantity,
+                                   'location_id': location_id, 'reason': 'No active supplier offers this item'})
+                continue
+            j = int(option_supplier[option])
+            supplier_id = supplier_ids[j]
+            order = orders.setdefault(supplier_id, {
+                'supplier_id': supplier_id,
+                'supplier_name': supplier_names[supplier_id],
+                'subtotal': 0.0,
+                'shipping_cost': 0.0,
+                'minimum_order_value': float(min_order_value[j]),
+                'surcharge': 0.0,
+                'line_count': 0
+            })
+            order['subtotal'] += float(option_cost[option])
+            order['line_count'] += 1
+            if (j, int(line_loc[i])) not in used_pairs:
+                used_pairs.add((j, int(line_loc[i])))
+                order['shipping_cost'] += float(shipping[j, line_loc[i]])
+            assignments.append({
+                'line': i,
+                'item_name': item_name,
+                'quantity': quantity,
+                'order_quantity': int(option_qty[option]),
+                'location_id': location_id,
+                'supplier_id': supplier_id,
+                'supplier_name': supplier_names[supplier_id],
+                'unit_price': float(option_price[option]),
+                'line_cost': round(float(option_cost[option]), 2)
+            })
+
+        for order in orders.values():
+            order['surcharge'] = round(max(order['minimum_order_value'] - order['subtotal'], 0.0), 2)
+            order['subtotal'] = round(order['subtotal'], 2)
+            order['shipping_cost'] = round(order['shipping_cost'], 2)
+            order['total'] = round(order['subtotal'] + order['shipping_cost'] + order['surcharge'], 2)
+
+        items_cost = sum(order['subtotal'] for order in orders.values())
+        shipping_cost = sum(order['shipping_cost'] for order in orders.values())
+        surcharge = sum(order['surcharge'] for order in orders.values())
+        logging.info(f"Optimized basket of {len(lines)} lines across {len(orders)} suppliers")
+
+        return {
+            'assignments': assignments,
+            'orders': sorted(orders.values(), key=lambda order: order['supplier_id']),
+            'unassigned': unassigned,
+            'items_cost': round(items_cost, 2),
+            'shipping_cost': round(shipping_cost, 2),
+            'surcharge': round(surcharge, 2),
+            'total_cost': round(items_cost + shipping_cost + surcharge, 2)
+        }
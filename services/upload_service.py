@@ -0,0 +1,341 @@
+# services/upload_service.py
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from database.db_connection import DBConnection
+from services.job_service import JobService
+
+
+# Largest chunk accepted in one request
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Chunk size suggested to clients
+UPLOAD_CHUNK_HINT_BYTES = 8 * 1024 * 1024
+
+# A reader following an upload gives up when no bytes arrive for this long
+UPLOAD_STALL_SECONDS = 3600
+
+# While waiting for bytes, a reader reports that it is alive this often
+UPLOAD_WAIT_REPORT_SECONDS = 10
+
+# Unfinished uploads untouched for this long are aborted and their spool files removed
+UPLOAD_RETENTION_HOURS = 24
+
+
+class UploadOffsetMismatch(ValueError):
+    """Raised when a chunk does not start where the upload currently ends."""
+
+    def __init__(self, expected: int, received: int):
+        self.expected = expected
+        self.received = received
+        super().__init__(f"Chunk offset {received} does not match upload offset {expected}")
+
+
+class UploadAborted(ValueError):
+    """Raised by a reader following an upload that was aborted."""
+
+
+class UploadService:
+    """
+    Resumable chunked uploads into a spool file.
+
+    A client creates an upload, sends the file as chunks at explicit offsets and
+    finalizes it with the file's SHA-256. After a dropped connection it asks for
+    the upload's current offset and continues from there. received_bytes only
+    moves once a chunk is fully on disk, so readers may follow an upload that is
+    still in progress.
+    """
+
+    def __init__(self):
+        """Initialize the upload service."""
+        self.db = DBConnection()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, upload_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def create_upload(self, file_name: str, user_name: str, total_size: Optional[int] = None,
+                      sha256: Optional[str] = None, file_format: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Start an upload.
+
+        Args:
+            file_name: Original file name
+            user_name: Uploading user
+            total_size: Expected size in bytes, if known
+            sha256: Expected hex SHA-256 of the whole file, if known now (can also be given at finalize)
+            file_format: File format (defaults to the file name's extension)
+
+        Returns:
+            Dict[str, Any]: The new upload
+        """
+        if total_size is not None and total_size < 0:
+            raise ValueError("total_size must not be negative")
+        file_format = (file_format or os.path.splitext(file_name)[1].lstrip('.')).lower()
+        upload_id = uuid.uuid4().hex
+        path = JobService.create_file(f".{file_format}" if file_format else "")
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO uploads (id, file_name, file_format, path, total_size, expected_sha256, user_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (upload_id, file_name, file_format, path, total_size, sha256.lower() if sha256 else None, user_name))
+        return self.get_upload(upload_id)
+
+    def _load(self, upload_id: str):
+        with self.db.get_cursor() as cursor:
+            cursor.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,))
+            return cursor.fetchone()
+
+    def get_upload(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Get an upload's state, including the offset the next chunk must start at."""
+        row = self._load(upload_id)
+        if not row:
+            return None
+        return {
+            'id': row['id'],
+            'file_name': row['file_name'],
+            'file_format': row['file_format'],
+            'status': row['status'],
+            'received_bytes': row['received_bytes'],
+            'total_size': row['total_size'],
+            'sha256': row['sha256'],
+            'user_name': row['user_name'],
+            'job_id': row['job_id'],
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    def write_chunk(self, upload_id: str, offset: int, data: bytes,
+                    chunk_sha256: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Append a chunk to an upload.
+
+        Args:
+            upload_id: Upload to write to
+            offset: Byte offset the chunk starts at; must equal the upload's received_bytes
+            data: Chunk content
+            chunk_sha256: Hex SHA-256 of the chunk, checked before anything is written
+
+        Returns:
+            Optional[Dict[str, Any]]: The upload after the write, or None if it does not exist
+
+        Raises:
+            UploadOffsetMismatch: If the chunk does not start at the current end of the upload
+            ValueError: If the upload is not open, the chunk is too large, overruns the
+                declared size or fails its checksum
+        """
+        if len(data) > MAX_CHUNK_BYTES:
+            raise ValueError(f"Chunk larger than {MAX_CHUNK_BYTES} bytes")
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            raise ValueError("Chunk checksum mismatch")
+
+        with self._lock_for(upload_id):
+            upload = self._load(upload_id)
+            if not upload:
+                return None
+            if upload['status'] != 'uploading':
+                raise ValueError(f"Upload is {upload['status']}")
+            if offset != upload['received_bytes']:
+                raise UploadOffsetMismatch(upload['received_bytes'], offset)
+            end = offset + len(data)
+            if upload['total_size'] is not None and end > upload['total_size']:
+                raise ValueError(f"Chunk ends at {end}, past the declared size {upload['total_size']}")
+
+            with open(upload['path'], 'r+b') as spool:
+                # Drop whatever a failed earlier attempt left past the offset
+                spool.truncate(offset)
+                spool.seek(offset)
+                spool.write(data)
+                spool.flush()
+                os.fsync(spool.fileno())
+
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    UPDATE uploads SET received_bytes = ?, updated_at = datetime('now')
+                    WHERE id = ? AND received_bytes = ? AND status = 'uploading'
+                """, (end, upload_id, offset))
+                written = cursor.rowcount == 1
+            if not written:
+                raise ValueError("Upload changed during the write; ask for the current offset and retry")
+        return self.get_upload(upload_id)
+
+    def finalize(self, upload_id: str, sha256: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Complete an upload after checking its size and SHA-256.
+
+        A failed check marks the upload failed (readers following it stop with an error).
+
+        Args:
+            upload_id: Upload to complete
+            sha256: Expected hex SHA-256 of the whole file (required unless given at creation)
+
+        Returns:
+            Optional[Dict[str, Any]]: The completed upload, or None if it does not exist
+
+        Raises:
+            ValueError: If the upload is not open, is incomplete or fails its checksum
+        """
+        with self._lock_for(upload_id):
+            upload = self._load(upload_id)
+            if not upload:
+                return None
+            if upload['status'] == 'complete':
+                return self.get_upload(upload_id)
+            if upload['status'] != 'uploading':
+                raise ValueError(f"Upload is {upload['status']}")
+
+            expected = (sha256 or upload['expected_sha256'] or '').lower()
+            if not expected:
+                raise ValueError("sha256 is required to finalize the upload")
+            if upload['total_size'] is not None and upload['received_bytes'] != upload['total_size']:
+                raise ValueError(f"Upload incomplete: {upload['received_bytes']} of {upload['total_size']} bytes")
+
+            digest = hashlib.sha256()
+            with open(upload['path'], 'rb') as spool:
+                for block in iter(lambda: spool.read(1024 * 1024), b''):
+                    digest.update(block)
+            actual = digest.hexdigest()
+
+            status, error = ('complete', None) if actual == expected else ('failed', "Checksum mismatch")
+            with self.db.get_cursor() as cursor:
+                cursor.execute("""
+                    UPDATE uploads
+                    SET status = ?, sha256 = ?, total_size = received_bytes, error = ?, updated_at = datetime('now')
+                    WHERE id = ?
+                """, (status, actual, error, upload_id))
+            if error:
+                raise ValueError(f"Checksum mismatch: expected {expected}, got {actual}")
+        logging.info(f"Upload {upload_id} complete: {upload['received_bytes']} bytes")
+        return self.get_upload(upload_id)
+
+    def abort(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Abort an unfinished upload and remove its spool file."""
+        with self._lock_for(upload_id):
+            upload = self._load(upload_id)
+            if not upload:
+                return None
+            if upload['status'] == 'uploading':
+                with self.db.get_cursor() as cursor:
+                    cursor.execute("""
+                        UPDATE uploads SET status = 'aborted', updated_at = datetime('now')
+                        WHERE id = ? AND status = 'uploading'
+                    """, (upload_id,))
+                self._remove_spool(upload['path'])
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+        return self.get_upload(upload_id)
+
+    def spool_path(self, upload_id: str) -> Optional[str]:
+        """Path of an upload's spool file."""
+        row = self._load(upload_id)
+        return row['path'] if row else None
+
+    def set_job(self, upload_id: str, job_id: str) -> None:
+        """Record the job that processes an upload."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("UPDATE uploads SET job_id = ? WHERE id = ?", (job_id, upload_id))
+
+    def prune(self, retention_hours: int = UPLOAD_RETENTION_HOURS) -> Dict[str, int]:
+        """Abort uploads that have been idle longer than the retention window."""
+        with self.db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT id FROM uploads
+                WHERE status = 'uploading' AND updated_at < datetime('now', ?)
+            """, (f"-{retention_hours} hours",))
+            upload_ids = [row['id'] for row in cursor.fetchall()]
+        for upload_id in upload_ids:
+            self.abort(upload_id)
+        return {'aborted': len(upload_ids)}
+
+    @staticmethod
+    def _remove_spool(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def open_stream(self, upload_id: str, on_wait: Optional[Callable[[int], None]] = None) -> io.BufferedReader:
+        """
+        Open an upload for reading while it may still be arriving.
+
+        Reads block until more bytes are received and end when the upload is complete.
+
+        Args:
+            upload_id: Upload to read
+            on_wait: Called with the bytes read so far whenever the reader has to wait
+
+        Raises:
+            UploadAborted: From reads, if the upload is aborted
+            ValueError: From reads, if the upload fails its checksum
+            TimeoutError: From reads, if nothing arrives for UPLOAD_STALL_SECONDS
+        """
+        return io.BufferedReader(_UploadStream(self, upload_id, on_wait), buffer_size=1024 * 1024)
+
+
+class _UploadStream(io.RawIOBase):
+    """Raw reader over a spool file that only returns bytes the upload has committed."""
+
+    def __init__(self, service: UploadService, upload_id: str,
+                 on_wait: Optional[Callable[[int], None]], poll_seconds: float = 0.5):
+        upload = service._load(upload_id)
+        if not upload:
+            raise ValueError(f"Upload {upload_id} not found")
+        self._service = service
+        self._upload_id = upload_id
+        self._on_wait = on_wait
+        self._poll_seconds = poll_seconds
+        self._file = open(upload['path'], 'rb')
+        self._limit = 0
+        self._complete = False
+        self._last_report = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def readinto(self, buffer) -> int:
+        waited_since = None
+        while True:
+            position = self._file.tell()
+            if position < self._limit:
+                data = self._file.read(min(len(buffer), self._limit - position))
+                buffer[:len(data)] = data
+                return len(data)
+            if self._complete:
+                return 0
+
+            upload = self._service.get_upload(self._upload_id)
+            if upload is None or upload['status'] == 'aborted':
+                raise UploadAborted(f"Upload {self._upload_id} was aborted")
+            if upload['status'] == 'failed':
+                raise ValueError(f"Upload {self._upload_id} failed: {upload['error']}")
+            self._complete = upload['status'] == 'complete'
+            if upload['received_bytes'] > self._limit or self._complete:
+                self._limit = upload['received_bytes']
+                continue
+
+            now = time.monotonic()
+            waited_since = waited_since or now
+            if now - waited_since > UPLOAD_STALL_SECONDS:
+                raise TimeoutError(f"Upload {self._upload_id} stalled at {self._limit} bytes")
+            if self._on_wait and now - self._last_report >= UPLOAD_WAIT_REPORT_SECONDS:
+                self._last_report = now
+                self._on_wait(position)
+            time.sleep(self._poll_seconds)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
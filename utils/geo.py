@@ -0,0 +1,149 @@
+# utils/geo.py
+
+import heapq
+import math
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distances between two sets of points.
+
+    Args:
+        lat1, lon1: Coordinates in degrees of the first set (length m)
+        lat2, lon2: Coordinates in degrees of the second set (length n)
+
+    Returns:
+        np.ndarray: (m, n) matrix of distances in kilometres
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lon2, dtype=float))[None, :]
+
+    a = (np.sin((lat2 - lat1) / 2.0) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in kilometres between two points given in degrees."""
+    return float(haversine_matrix([lat1], [lon1], [lat2], [lon2])[0, 0])
+
+
+class GridIndex:
+    """
+    Fixed-size latitude/longitude grid for nearest-neighbour queries.
+
+    Points are bucketed into cells of `cell_deg` degrees. A query scans rings of
+    cells outward from the query point and stops once no unvisited cell can hold
+    anything closer than the k-th best match found so far.
+    """
+
+    def __init__(self, cell_deg: float = 1.0):
+        """Initialize an empty grid."""
+        self.cell_deg = cell_deg
+        self._lon_cells = max(1, int(math.ceil(360.0 / cell_deg)))
+        self._cells: Dict[Tuple[int, int], List[Tuple[Hashable, float, float]]] = defaultdict(list)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor((lon % 360.0) / self.cell_deg)) % self._lon_cells
+
+    def insert(self, key: Hashable, lat: float, lon: float) -> None:
+        """Add a point under `key`."""
+        self._cells[self._cell(lat, lon)].append((key, lat, lon))
+        self._size += 1
+
+    def insert_many(self, points: Iterable[Tuple[Hashable, float, float]]) -> None:
+        """Add (key, lat, lon) points."""
+        for key, lat, lon in points:
+            self.insert(key, lat, lon)
+
+    def _ring(self, center: Tuple[int, int], radius: int) -> Iterable[Tuple[int, int]]:
+        """Cells on the square ring `radius` cells away from `center`."""
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        # Once the ring wraps the whole globe in longitude, each row only needs visiting once
+        cols = range(col - radius, col + radius + 1)
+        if len(cols) > self._lon_cells:
+            cols = range(self._lon_cells)
+        seen = set()
+        for r in (row - radius, row + radius):
+            for c in cols:
+                cell = (r, c % self._lon_cells)
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+        for r in range(row - radius + 1, row + radius):
+            for c in (col - radius, col + radius):
+                cell = (r, c % self._lon_cells)
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+
+    def _lower_bound_km(self, lat: float, radius: int) -> float:
+        """Smallest possible distance to a point outside the block of rings 0..radius."""
+        span = math.radians(radius * self.cell_deg)
+        if span >= math.pi:
+            return math.inf
+        # Outside the block means a latitude gap of at least `span` (distance >= R * span), or a
+        # longitude gap of at least `span` between points no further from the equator than max_lat
+        max_lat = min(90.0, abs(lat) + (radius + 1) * self.cell_deg)
+        by_lat = EARTH_RADIUS_KM * span
+        by_lon = 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(max_lat)) * math.sin(span / 2.0)))
+        return min(by_lat, by_lon)
+
+    def nearest(self, lat: float, lon: float, k: int,
+                accept: Optional[Callable[[Hashable], bool]] = None) -> List[Tuple[Hashable, float]]:
+        """
+        Find the k nearest points to (lat, lon).
+
+        Args:
+            lat, lon: Query point in degrees
+            k: Number of neighbours to return
+            accept: Optional predicate on keys; rejected points are skipped
+
+        Returns:
+            List[Tuple[Hashable, float]]: (key, distance_km) pairs, nearest first
+        """
+        if k <= 0 or self._size == 0:
+            return []
+
+        center = self._cell(lat, lon)
+        max_radius = int(math.ceil(180.0 / self.cell_deg)) + 1
+        # Max-heap of the best k so far, stored as (-distance, tiebreak, key)
+        best: List[Tuple[float, int, Hashable]] = []
+        counter = 0
+        visited = 0
+
+        for radius in range(max_radius + 1):
+            points = [point for cell in self._ring(center, radius) for point in self._cells.get(cell, ())]
+            visited += len(points)
+            batch = [point for point in points if accept is None or accept(point[0])]
+            if batch:
+                distances = haversine_matrix([lat], [lon], [p[1] for p in batch], [p[2] for p in batch])[0]
+                for (key, _, _), distance in zip(batch, distances):
+                    counter += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, counter, key))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, counter, key))
+
+            if visited == self._size:
+                break
+            if len(best) == k and self._lower_bound_km(lat, radius) >= -best[0][0]:
+                break
+
+        return [(key, float(-negative)) for negative, _, key in sorted(best, key=lambda entry: -entry[0])]
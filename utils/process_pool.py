@@ -0,0 +1,51 @@
+# utils/process_pool.py
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class SpawnProcessPool:
+    """
+    Process pool that is started on first use and replaced after a worker process dies.
+
+    Workers are spawned rather than forked: the API process runs threads holding open
+    database connections, which a forked child would inherit.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def executor(self) -> Iterator[ProcessPoolExecutor]:
+        """
+        Use the pool, starting it if needed.
+
+        If a worker dies (e.g. out of memory) while the block runs, BrokenProcessPool is
+        re-raised and the next caller gets a fresh pool.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            pool = self._pool
+        try:
+            yield pool
+        except BrokenProcessPool:
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+
+    def shutdown(self) -> None:
+        """Stop the worker processes without waiting; queued work is cancelled."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)